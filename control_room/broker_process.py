@@ -0,0 +1,509 @@
+# Host the module connections and the CallbackBroker in a dedicated process.
+#
+# The GUI (Dash served by waitress) and the broker compete for the GIL if they
+# share a process. With the broker in its own process, callback routing is not
+# affected by the load of rendering the GUI. The GUI talks to the modules via
+# RemoteModuleConnection proxies, which forward to the child via a pipe.
+
+import multiprocessing
+import signal
+import threading
+import time
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any
+
+from control_room.utils.health import HEARTBEAT_S, HealthMonitor, ModuleHealth
+from control_room.utils.logging import logger
+from control_room.utils.modules import GUI_HIDDEN_PCOMMS
+from control_room.utils.scheduling import apply_to_threads, get_control_room_profiles
+from control_room.utils.supervisor import ProcessSupervisor
+from control_room.utils.telemetry import TelemetrySampler
+
+# time the child gets to launch and connect to all modules
+STARTUP_TIMEOUT_S: float = 60
+# time the child gets to answer a request of the GUI process
+REQUEST_TIMEOUT_S: float = 10
+
+# Requests and replies are tagged with a sequence number, so a late reply to a
+# request which already timed out is not taken as the reply to the next one.
+# The reply to the startup is tagged with 0.
+STARTUP_SEQ: int = 0
+# requests which wait on a module and are answered by a thread of their own
+BLOCKING_REQUESTS: set[str] = {"is_up", "get_pcommands", "send_up", "wait_up_ack"}
+
+
+class BrokerProcessError(ConnectionError):
+    pass
+
+
+def describe_connection(conn) -> dict:
+    """Collect the state of a connection which is mirrored to the GUI process."""
+    return {
+        "name": conn.name,
+        "pcomms": list(conn.pcomms),
+        "pcomms_defaults": conn.pcomms_defaults,
+        "depends_on": list(conn.depends_on),
+        "scheduling_effective": conn.scheduling_effective,
+        "heartbeat": conn.heartbeat,
+        "outbound_depth": conn.outbound.depth,
+        "outbound_sent": conn.outbound.sent,
+        "outbound_dropped": conn.outbound.dropped,
+        "repr": str(conn),
+    }
+
+
+def run_broker_process(
+    cfg: dict,
+    cfg_file: Path,
+    pipe: Connection,
+    loglevel: int = 10,
+    heartbeat_s: float = HEARTBEAT_S,
+    telemetry_s: float = 0,
+):
+    """
+    Entry point of the broker process.
+
+    Launches and connects to all modules, runs the CallbackBroker and serves
+    the requests of the GUI process until asked to stop or the pipe breaks.
+    """
+    # imported here, as the gui callbacks are only needed in the child
+    from control_room.callbacks import start_callback_broker
+    from control_room.utils.modules import initialize_modules
+    from control_room.utils.startup import start_modules, stop_modules
+
+    logger.setLevel(loglevel)
+
+    # Shutdown is controlled by the GUI process. A CTRL+C in the terminal is
+    # sent to the whole process group and must not stop the broker by itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, "SIGBREAK"):
+        signal.signal(signal.SIGBREAK, signal.SIG_IGN)  # type: ignore
+
+    connections = []
+    cbb = None
+    cbb_th = None
+    monitor = None
+    supervisor = None
+    sampler = None
+    try:
+        connections = initialize_modules(cfg, cfg_file)
+        start_modules(connections)
+        cbb, cbb_th = start_callback_broker(connections)
+        monitor = HealthMonitor(connections, broker=cbb, interval_s=heartbeat_s)
+        monitor.start()
+        supervisor = ProcessSupervisor(connections, broker=cbb)
+        supervisor.start()
+        if telemetry_s > 0:
+            sampler = TelemetrySampler(connections, interval_s=telemetry_s)
+            sampler.start()
+        # New threads and processes inherit the scheduling of the thread
+        # creating them. The profile is therefore applied to the broker thread
+        # only, after all other threads are running. The writer threads would
+        # otherwise be started lazily by the broker thread.
+        for c in connections:
+            c.outbound.start()
+        apply_to_threads(
+            get_control_room_profiles(cfg)["broker"], [cbb_th], "broker process"
+        )
+        pipe.send((STARTUP_SEQ, "ok", [describe_connection(c) for c in connections]))
+    except Exception as e:
+        logger.error(f"Broker process failed to start: {e}")
+        pipe.send((STARTUP_SEQ, "error", repr(e)))
+
+    if cbb is not None:
+        serve_requests(pipe, {c.name: c for c in connections}, sampler)
+
+    logger.info("Broker process is shutting down")
+    if sampler is not None:
+        sampler.stop()
+    if supervisor is not None:
+        supervisor.stop()
+    if monitor is not None:
+        monitor.stop()
+    if cbb is not None and cbb_th is not None:
+        cbb.stop()
+        cbb_th.join(timeout=3)
+
+    stop_modules(connections)
+
+
+def serve_requests(
+    pipe: Connection,
+    connections: dict[str, Any],
+    sampler: TelemetrySampler | None = None,
+):
+    """Answer requests of the GUI process until `stop` is received.
+
+    Requests which wait on a module, see `BLOCKING_REQUESTS`, are answered by
+    a thread of their own, so e.g. an `is_up` of a stalled module does not
+    hold up the state reads of the GUI. Replies are tagged with the sequence
+    number of their request and may therefore be sent out of order.
+    """
+    send_lock = threading.Lock()
+
+    def reply(seq: int, status: str, ret: Any):
+        with send_lock:
+            try:
+                pipe.send((seq, status, ret))
+            except (EOFError, OSError) as e:
+                logger.debug(f"Cannot reply to the GUI process: {e}")
+
+    def answer(seq: int, op: str, args: tuple):
+        try:
+            reply(seq, "ok", handle_request(op, args, connections, sampler))
+        except Exception as e:
+            reply(seq, "error", repr(e))
+
+    while True:
+        try:
+            seq, op, args = pipe.recv()
+        except (EOFError, OSError):
+            logger.warning("Lost the connection to the GUI process")
+            return
+
+        if op == "stop":
+            reply(seq, "ok", None)
+            return
+
+        if op in BLOCKING_REQUESTS:
+            threading.Thread(
+                target=answer,
+                args=(seq, op, args),
+                name=f"broker_request_{seq}",
+                daemon=True,
+            ).start()
+        else:
+            answer(seq, op, args)
+
+
+def handle_request(
+    op: str,
+    args: tuple,
+    connections: dict[str, Any],
+    sampler: TelemetrySampler | None = None,
+) -> Any:
+    """Process a single request of the GUI process and return the reply."""
+    if op == "state":
+        return {n: describe_connection(c) for n, c in connections.items()}
+    elif op == "health":
+        return {n: c.health.to_dict() for n, c in connections.items()}
+    elif op == "telemetry":
+        return sampler.snapshot(*args) if sampler is not None else {}
+    elif op == "latency":
+        return connections[args[0]].latency_summary()
+    elif op in ("send_message", "enqueue_message"):
+        # handed to the writer thread of the connection, so a module which
+        # does not read cannot block the other requests
+        return connections[args[0]].enqueue_message(args[1])
+    elif op == "is_up":
+        return connections[args[0]].is_up(*args[1:])
+    elif op == "send_up":
+        return connections[args[0]].send_up()
+    elif op == "wait_up_ack":
+        return connections[args[0]].wait_up_ack(*args[1:])
+    elif op == "get_pcommands":
+        connections[args[0]].get_pcommands()
+        return list(connections[args[0]].pcomms)
+    raise ValueError(f"Unknown broker process request {op=}")
+
+
+@dataclass
+class BrokerProcess:
+    """
+    Run the module connections and the CallbackBroker in a child process.
+
+    Attributes
+    ----------
+    cfg : dict
+        The control room config, as returned by `check_and_transform_legacy_cfg`.
+    cfg_file : Path
+        Path of the config file, used to resolve relative paths.
+    heartbeat_s : float
+        Interval of the HealthMonitor running in the child.
+    telemetry_s : float
+        Interval of the TelemetrySampler running in the child, 0 to disable.
+    connections : list[RemoteModuleConnection]
+        Proxies for the modules connected by the child, available after `start`.
+    """
+
+    cfg: dict
+    cfg_file: Path
+    loglevel: int = 10
+    heartbeat_s: float = HEARTBEAT_S
+    telemetry_s: float = 0
+    connections: list["RemoteModuleConnection"] = field(default_factory=list)
+
+    # the health of all modules is fetched at once and reused by all proxies
+    _health: dict[str, ModuleHealth] = field(default_factory=dict, repr=False)
+    _health_fetched_at: float = field(default=0.0, repr=False)
+    _state_fetched_at: float = field(default=0.0, repr=False)
+
+    _process: multiprocessing.Process | None = field(default=None, repr=False)
+    _pipe: Connection | None = field(default=None, repr=False)
+    # Several requests can be pending at once. Replies are read by the
+    # `_reader` thread and handed to the waiting request via `_replies`.
+    _send_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _cond: threading.Condition = field(default_factory=threading.Condition, repr=False)
+    _seq: int = field(default=STARTUP_SEQ, repr=False)
+    _waiting: set[int] = field(default_factory=set, repr=False)
+    _replies: dict[int, tuple[str, Any]] = field(default_factory=dict, repr=False)
+    _lost: str | None = field(default=None, repr=False)
+    _reader: threading.Thread | None = field(default=None, repr=False)
+
+    def start(self) -> list["RemoteModuleConnection"]:
+        # spawn on all platforms, forking a process with running threads (e.g.
+        # of the log handler) is not safe
+        ctx = multiprocessing.get_context("spawn")
+        self._pipe, child_pipe = ctx.Pipe(duplex=True)
+        self._process = ctx.Process(
+            target=run_broker_process,
+            args=(
+                self.cfg,
+                self.cfg_file,
+                child_pipe,
+                self.loglevel,
+                self.heartbeat_s,
+                self.telemetry_s,
+            ),
+            name="control_room_broker",
+            daemon=False,
+        )
+        self._process.start()
+        child_pipe.close()
+
+        logger.info(f"Started broker process with pid {self._process.pid}")
+
+        with self._cond:
+            self._lost = None
+            self._waiting.add(STARTUP_SEQ)
+        self._start_reader()
+        status, ret = self._receive(STARTUP_SEQ, STARTUP_TIMEOUT_S, "startup")
+        if status != "ok":
+            raise BrokerProcessError(f"Broker process failed to start: {ret}")
+
+        self.connections = [RemoteModuleConnection(state=d, host=self) for d in ret]
+        return self.connections
+
+    def request(
+        self, op: str, *args, reply_timeout_s: float = REQUEST_TIMEOUT_S
+    ) -> Any:
+        """Send a request to the child and return its reply."""
+        with self._cond:
+            if self._pipe is None:
+                raise BrokerProcessError("Broker process is not running")
+            self._seq += 1
+            seq = self._seq
+            self._waiting.add(seq)
+
+        try:
+            with self._send_lock:
+                self._pipe.send((seq, op, args))
+        except (EOFError, OSError) as e:
+            with self._cond:
+                self._waiting.discard(seq)
+            raise BrokerProcessError(f"Lost connection to broker process: {e}")
+
+        self._start_reader()
+        status, ret = self._receive(seq, reply_timeout_s, f"{op=}")
+        if status != "ok":
+            raise BrokerProcessError(f"Broker process failed on {op=}: {ret}")
+        return ret
+
+    def _start_reader(self):
+        with self._cond:
+            if self._reader is not None and self._reader.is_alive():
+                return
+            self._reader = threading.Thread(
+                target=self._read_replies,
+                args=(self._pipe,),
+                name="broker_process_replies",
+                daemon=True,
+            )
+            self._reader.start()
+
+    def _read_replies(self, pipe: Connection):
+        """Hand the replies of the child to the waiting requests."""
+        while True:
+            try:
+                reply_seq, status, ret = pipe.recv()
+            except (EOFError, OSError) as e:
+                with self._cond:
+                    self._lost = str(e) or type(e).__name__
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                if reply_seq in self._waiting:
+                    self._replies[reply_seq] = (status, ret)
+                    self._cond.notify_all()
+                else:
+                    logger.debug(f"Dropping stale broker process reply {reply_seq=}")
+
+    def _receive(self, seq: int, timeout_s: float, what: str) -> tuple[str, Any]:
+        """Wait for the reply tagged with `seq`, later replies to it are dropped."""
+        deadline = time.monotonic() + timeout_s
+        with self._cond:
+            try:
+                while seq not in self._replies:
+                    if self._lost is not None:
+                        raise BrokerProcessError(
+                            f"Lost connection to broker process: {self._lost}"
+                        )
+                    remaining_s = deadline - time.monotonic()
+                    if remaining_s <= 0:
+                        raise BrokerProcessError(
+                            f"Broker process did not reply on {what} within {timeout_s}s"
+                        )
+                    self._cond.wait(remaining_s)
+                return self._replies.pop(seq)
+            finally:
+                self._waiting.discard(seq)
+
+    def refresh_state(self, max_age_s: float = 0):
+        """Update the state mirrored by the proxies, if older than `max_age_s`."""
+        if time.monotonic() - self._state_fetched_at <= max_age_s:
+            return
+        states = self.request("state")
+        for c in self.connections:
+            c.state = states.get(c.name, c.state)
+        self._state_fetched_at = time.monotonic()
+
+    def health(self, max_age_s: float = 0.5) -> dict[str, ModuleHealth]:
+        """The health of all modules, fetched at most every `max_age_s`."""
+        if time.monotonic() - self._health_fetched_at > max_age_s:
+            try:
+                table = self.request("health")
+                self._health = {n: ModuleHealth(**d) for n, d in table.items()}
+            except BrokerProcessError as e:
+                logger.debug(f"Cannot get the health of the modules: {e}")
+                self._health = {}
+            self._health_fetched_at = time.monotonic()
+        return self._health
+
+    def stop(self, timeout_s: float = 10):
+        if self._process is None:
+            return
+
+        try:
+            self.request("stop", reply_timeout_s=timeout_s)
+        except BrokerProcessError as e:
+            logger.debug(f"Broker process did not acknowledge stop: {e}")
+
+        self._process.join(timeout=timeout_s)
+        if self._process.is_alive():
+            logger.warning("Broker process did not stop in time, terminating it")
+            self._process.terminate()
+            self._process.join(timeout=3)
+
+        if self._pipe is not None:
+            self._pipe.close()
+        self._pipe = None
+        self._process = None
+
+
+@dataclass
+class RemoteTelemetry:
+    """Telemetry source for the GUI, fetching the samples of the broker process."""
+
+    host: BrokerProcess
+
+    def snapshot(self, last_n: int | None = None) -> dict:
+        try:
+            return self.host.request("telemetry", last_n)
+        except BrokerProcessError as e:
+            logger.debug(f"Cannot get the telemetry of the modules: {e}")
+            return {}
+
+
+@dataclass
+class RemoteModuleConnection:
+    """
+    Proxy for a module connection hosted by a BrokerProcess.
+
+    Provides the parts of the ControlRoomModuleConnection interface used by the
+    GUI. Commands are forwarded to the broker process, which owns the sockets.
+    """
+
+    state: dict
+    host: BrokerProcess = field(repr=False)
+
+    @property
+    def name(self) -> str:
+        return self.state["name"]
+
+    @property
+    def pcomms(self) -> list[str]:
+        return self.state["pcomms"]
+
+    @property
+    def pcomms_defaults(self) -> dict | None:
+        return self.state["pcomms_defaults"]
+
+    @property
+    def depends_on(self) -> list[str]:
+        return self.state["depends_on"]
+
+    @property
+    def scheduling_effective(self) -> dict:
+        return self.state["scheduling_effective"]
+
+    @property
+    def heartbeat(self) -> bool:
+        return self.state["heartbeat"]
+
+    @property
+    def gui_pcomms(self) -> list[str]:
+        return [pc for pc in self.pcomms if pc not in GUI_HIDDEN_PCOMMS]
+
+    @property
+    def health(self) -> ModuleHealth:
+        return self.host.health().get(self.name, ModuleHealth(name=self.name))
+
+    def send_message(self, msg: bytes):
+        # queued by the broker process, see `handle_request`
+        if not self.host.request("send_message", self.name, msg):
+            raise BrokerProcessError(
+                f"Broker process dropped the message to {self.name}"
+            )
+
+    def enqueue_message(self, msg: bytes) -> bool:
+        return self.host.request("enqueue_message", self.name, msg)
+
+    def send_up(self) -> int:
+        return self.host.request("send_up", self.name)
+
+    def wait_up_ack(self, seq: int, timeout_s: float) -> bool:
+        # the broker process replies once the `UP` is acknowledged
+        return self.host.request(
+            "wait_up_ack",
+            self.name,
+            seq,
+            timeout_s,
+            reply_timeout_s=timeout_s + REQUEST_TIMEOUT_S,
+        )
+
+    def get_pcommands(self) -> None:
+        self.state["pcomms"] = self.host.request("get_pcommands", self.name)
+
+    def latency_summary(self) -> dict[str, dict]:
+        try:
+            return self.host.request("latency", self.name)
+        except BrokerProcessError as e:
+            logger.debug(f"Cannot get the pcomm latencies of {self.name}: {e}")
+            return {}
+
+    def is_up(self, timeout_s: float = 0.1) -> bool:
+        try:
+            return self.host.request("is_up", self.name, timeout_s)
+        except BrokerProcessError as e:
+            logger.debug(f"Cannot check state of {self.name}: {e}")
+            return False
+
+    def stop(self):
+        # the connection is owned and stopped by the broker process
+        pass
+
+    def __str__(self) -> str:
+        return self.state["repr"]
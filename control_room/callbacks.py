@@ -6,15 +6,16 @@
 #
 # Put this handling into another thread.
 
+import selectors
+import socket
 import threading
-import time
 from dataclasses import dataclass, field
-from socket import socket
 
 from dareplane_utils.general.time import sleep_s
 from dareplane_utils.module_handling.communication import SocketCommunicator
 
 from control_room.gui.callbacks import is_ao_module, make_ao_payload_from_json
+from control_room.utils.framing import FrameParser
 from control_room.utils.logging import logger
 from control_room.utils.modules import ControlRoomModuleConnection
 
@@ -34,47 +35,254 @@ class CallbackBroker:
         A dictionary mapping module names to their connections.
     stop_event : threading.Event
         An event to signal the stopping of the callback listening loop.
+    use_selector : bool
+        If True (default), the sockets are registered with a
+        `selectors.DefaultSelector` (epoll/kqueue/select depending on the
+        platform) and only sockets with pending data are read. If False, the
+        legacy polling loop is used, which checks every socket in turn.
+    select_timeout_s : float
+        Upper bound for a single wait on the selector. Setting the `stop_event`
+        directly is picked up at the latest after this time, `stop()` and
+        `add_connection()` interrupt the wait immediately.
+    up_ack_cond : threading.Condition
+        Notified whenever an `UP` acknowledgement was recorded.
     """
 
     mod_connections: dict[str, ControlRoomModuleConnection] = field(
         default_factory=dict
     )
     stop_event: threading.Event = threading.Event()
+    use_selector: bool = True
+    select_timeout_s: float = 0.5
+    up_ack_cond: threading.Condition = field(
+        default_factory=threading.Condition, repr=False
+    )
+
+    _selector: selectors.BaseSelector | None = field(
+        default=None, init=False, repr=False
+    )
+    _wakeup_r: socket.socket | None = field(default=None, init=False, repr=False)
+    _wakeup_w: socket.socket | None = field(default=None, init=False, repr=False)
+    # sockets currently registered with the selector, by module name
+    _registered: dict[str, socket.socket] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # sockets which were closed by the peer, these are not registered again
+    # until the module connection provides a new socket
+    _closed_sockets: list[socket.socket] = field(
+        default_factory=list, init=False, repr=False
+    )
+    # reassembly buffers for the incoming byte stream of each module
+    _parsers: dict[str, FrameParser] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # modules whose sockets are temporarily read by someone else, e.g. during
+    # the startup probes of a restarted module
+    _suspended: set[str] = field(default_factory=set, init=False, repr=False)
 
     def listen_for_callbacks(self):
         """
         Start listening for callbacks from connected modules.
 
-        This method runs in a loop, checking each connected module for callbacks.
-        If a callback is received, it is processed and forwarded to the appropriate
-        target module. The loop continues until the stop event is set.
+        This method runs until the stop event is set. If a callback is
+        received, it is processed and forwarded to the appropriate target
+        module. Depending on `use_selector`, the sockets are either waited on
+        for readiness or polled one after another.
+        """
+        if self.use_selector:
+            self._listen_selector()
+        else:
+            self._listen_polling()
+
+    def _listen_polling(self):
+        """
+        Check every connected module for callbacks in a loop.
 
         Notes
         -----
-        This loop could be a performance bottleneck if multiple modules need to be
-        checked. Consider creating a whitelist of modules to be checked for callbacks.
+        Each iteration performs a (short timeout) `recv` on every socket, so
+        the load and the worst case latency grow linearly with the number of
+        modules. Prefer the selector based loop.
         """
         while not self.stop_event.is_set():
-            # TODO: This loop could be a performance bottleneck, if multiple
-            # modules need to be checked --> potentially create a whitelist
-            # of modules which are to be checked for callbacks.
             for mod_name, mod_connection in self.mod_connections.items():
                 if self.stop_event.is_set():
                     break
 
-                # We currently only do callbacks for modules connected via TCP
-                if (
-                    isinstance(mod_connection.communicator, SocketCommunicator)
-                    and mod_connection.communicator.socket_c is not None
-                ):
-                    self.check_for_callback(
-                        mod_connection.communicator.socket_c, mod_name
-                    )
+                msocket = self._get_socket(mod_connection)
+                if msocket is not None:
+                    self.check_for_callback(msocket, mod_name)
 
             # Yield briefly, so the main thread can process shutdown signals.
             # Kept minimal to stay responsive for callbacks.
             sleep_s(0.0005)
 
+    def _listen_selector(self):
+        """
+        Wait for readiness of the module sockets and only read the ready ones.
+
+        A local socket pair is registered alongside the module sockets, writing
+        to it via `wakeup()` interrupts a pending `select`. This is used to stop
+        the loop and to pick up new or re-established connections.
+        """
+        self._selector = selectors.DefaultSelector()
+        # a socket pair instead of os.pipe, as pipes cannot be selected on windows
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, data=None)
+
+        try:
+            while not self.stop_event.is_set():
+                self._sync_registrations()
+
+                for key, _ in self._selector.select(timeout=self.select_timeout_s):
+                    if self.stop_event.is_set():
+                        break
+
+                    if key.data is None:
+                        self._drain_wakeup()
+                    else:
+                        self._read_ready_socket(key.fileobj, key.data)  # type: ignore
+        finally:
+            self._close_selector()
+
+    def _get_socket(
+        self, mod_connection: ControlRoomModuleConnection
+    ) -> socket.socket | None:
+        # We currently only do callbacks for modules connected via TCP
+        if (
+            isinstance(mod_connection.communicator, SocketCommunicator)
+            and mod_connection.communicator.socket_c is not None
+        ):
+            return mod_connection.communicator.socket_c
+        return None
+
+    def _sync_registrations(self):
+        """Align the selector registrations with the current module sockets.
+
+        Sockets can change during runtime, e.g. if a module is reconnected. Stale
+        sockets are unregistered before new ones are registered, as a new socket
+        might reuse the file descriptor of a closed one.
+        """
+        if self._selector is None:
+            return
+
+        sockets = {
+            mod_name: self._get_socket(mod_connection)
+            for mod_name, mod_connection in list(self.mod_connections.items())
+        }
+
+        # forget about closed sockets which are no longer used by any module
+        self._closed_sockets = [
+            cs for cs in self._closed_sockets if any(cs is s for s in sockets.values())
+        ]
+        current = {
+            mod_name: msocket
+            for mod_name, msocket in sockets.items()
+            if msocket is not None
+            and mod_name not in self._suspended
+            and not any(msocket is cs for cs in self._closed_sockets)
+        }
+
+        for mod_name, msocket in list(self._registered.items()):
+            if current.get(mod_name) is not msocket:
+                self._unregister(mod_name)
+
+        for mod_name, msocket in current.items():
+            if mod_name in self._registered:
+                continue
+            try:
+                self._selector.register(msocket, selectors.EVENT_READ, data=mod_name)
+                self._registered[mod_name] = msocket
+            except (KeyError, ValueError, OSError) as e:
+                logger.warning(
+                    f"CallbackBroker cannot watch the socket of {mod_name}: {e}"
+                )
+                self._closed_sockets.append(msocket)
+
+    def _unregister(self, mod_name: str):
+        msocket = self._registered.pop(mod_name, None)
+        if msocket is None or self._selector is None:
+            return
+        try:
+            self._selector.unregister(msocket)
+        except (KeyError, ValueError, OSError):
+            # the socket was already closed and removed by the OS
+            pass
+
+    def _read_ready_socket(self, msocket: socket.socket, mod_name: str):
+        """Read from a socket which was reported as ready by the selector."""
+        try:
+            msg = msocket.recv(4096)
+        except (BlockingIOError, TimeoutError, InterruptedError):
+            # spurious wakeup, nothing to read after all
+            return
+        except OSError as e:
+            logger.warning(f"CallbackBroker lost the connection to {mod_name}: {e}")
+            msg = b""
+
+        if msg == b"":
+            # The peer closed the connection. A closed socket would always be
+            # reported as ready, so it is not watched until it is replaced.
+            logger.debug(f"CallbackBroker stops watching closed socket of {mod_name}")
+            self._closed_sockets.append(msocket)
+            self._unregister(mod_name)
+            return
+
+        self.process_message(msg, mod_name)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r and self._wakeup_r.recv(1024):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _close_selector(self):
+        for mod_name in list(self._registered.keys()):
+            self._unregister(mod_name)
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        for s in [self._wakeup_r, self._wakeup_w]:
+            if s is not None:
+                s.close()
+        self._wakeup_r, self._wakeup_w = None, None
+
+    def wakeup(self):
+        """Interrupt a pending wait of the selector loop."""
+        wakeup_w = self._wakeup_w
+        if wakeup_w is None:
+            return
+        try:
+            wakeup_w.send(b"\x00")
+        except (BlockingIOError, OSError):
+            # either the buffer is full, which already guarantees a wakeup, or
+            # the loop is shutting down
+            pass
+
+    def add_connection(self, mod_connection: ControlRoomModuleConnection):
+        """Register a module connection and have the running loop pick it up."""
+        self.mod_connections[mod_connection.name] = mod_connection
+        self.wakeup()
+
+    def suspend(self, mod_name: str):
+        """Stop reading from a module until `resume` is called."""
+        self._suspended.add(mod_name)
+        self._parsers.pop(mod_name, None)
+        self.wakeup()
+
+    def resume(self, mod_name: str):
+        """Read from a suspended module again, e.g. from its new socket."""
+        self._suspended.discard(mod_name)
+        self.wakeup()
+
+    def stop(self):
+        """Stop the listening loop without waiting for the select timeout."""
+        self.stop_event.set()
+        self.wakeup()
+
     def _consume_up_acks(self, msg: bytes, mod_name: str) -> bytes:
         """
         Strip `UP` acknowledgements from a received message.
@@ -98,35 +306,29 @@ class CallbackBroker:
         if b"1" not in msg:
             return msg
 
-        # an ack may arrive concatenated with a real callback, so only strip the
-        # leading/trailing `1`s and keep the remainder for routing
-        stripped = msg.strip(b"1")
+        # an ack may precede a real callback, so only strip the leading `1`s
+        # and keep the remainder for routing. Trailing `1`s belong to the
+        # callback, e.g. its payload, as an ack after it follows the `;`.
+        stripped = msg.lstrip(b"1")
         if stripped != msg:
-            mod_connection = self.mod_connections.get(mod_name, None)
-            if mod_connection is not None:
-                mod_connection.last_up_ack = time.time()
+            self._record_up_ack(mod_name, len(msg) - len(stripped))
             # logger.debug(f"Received UP acknowledgement from {mod_name}")
 
         return stripped
 
-    def check_for_callback(self, msocket: socket, mod_name: str):
+    def check_for_callback(self, msocket: socket.socket, mod_name: str):
         """
         Check for callbacks on the given socket.
 
-        This method reads messages from the provided socket and processes them.
-        If a valid callback message is received, it is forwarded to the appropriate
-        target module. The method handles message formatting and validation.
+        This method reads messages from the provided socket until it times out
+        and processes them. Used by the polling loop.
 
         Parameters
         ----------
-        msocket : socket
+        msocket : socket.socket
             The socket to check for callbacks.
         mod_name : str
             The name of the module associated with the socket.
-
-        Notes
-        -----
-        This method ignores fully blank messages and common start bytes.
         """
         # logger.debug(f"Checking for callbacks in {msocket=}")
         fragments = []
@@ -140,25 +342,89 @@ class CallbackBroker:
             except TimeoutError:
                 break
 
-        msg = b"".join(fragments)
+        if fragments:
+            self.process_message(b"".join(fragments), mod_name)
+
+    def process_message(self, msg: bytes, mod_name: str):
+        """
+        Process data received from a module and route all completed callbacks.
+
+        The data is added to the module's reassembly buffer, so callbacks which
+        are split across reads are joined and several callbacks arriving in a
+        single read are all routed, in order. Callbacks are terminated by `;`.
+
+        Parameters
+        ----------
+        msg : bytes
+            The raw data as read from the module's socket.
+        mod_name : str
+            The name of the module associated with the socket.
+        """
+        parser = self._parsers.get(mod_name, None)
+        if parser is None:
+            parser = FrameParser(name=mod_name)
+            self._parsers[mod_name] = parser
+
+        for frame in parser.feed(msg):
+            self.route_callback(frame, mod_name)
+
+        # `UP` is answered with a plain `1` without a terminator, the parser
+        # picks these up at the start of frames
+        if n := parser.take_acks():
+            self._record_up_ack(mod_name, n)
+
+        # replies without a terminator, e.g. to `GET_PCOMMS`, are handed to
+        # whoever waits for them instead of being joined with the next frame
+        waiter = getattr(self.mod_connections.get(mod_name), "reply_waiter", None)
+        if waiter is not None and parser.buffer:
+            waiter.put(parser.take_unterminated())
+
+    def _record_up_ack(self, mod_name: str, n: int = 1):
+        mod_connection = self.mod_connections.get(mod_name, None)
+        if mod_connection is not None:
+            with self.up_ack_cond:
+                mod_connection.record_up_ack(n)
+                self.up_ack_cond.notify_all()
+
+    def route_callback(self, msg: bytes, mod_name: str):
+        """
+        Route a single callback to its target module.
+
+        If a valid callback message is received, it is forwarded to the
+        appropriate target module. The method handles message formatting and
+        validation.
+
+        Parameters
+        ----------
+        msg : bytes
+            A single callback without the `;` terminator.
+        mod_name : str
+            The name of the module the callback was received from.
+
+        Notes
+        -----
+        This method ignores fully blank messages and common start bytes.
+        """
 
         # ignore fully black messages and common start bytes
-        msg = msg.replace(b"\r\n", b"")
-        msg = msg.replace(b"\xc2", b"")
+        if b"\r\n" in msg:
+            msg = msg.replace(b"\r\n", b"")
+        if b"\xc2" in msg:
+            msg = msg.replace(b"\xc2", b"")
 
+        # `UP` acknowledgements are already taken from the frames by the
+        # FrameParser, see `process_message`
         if msg != b"":
-            # The `UP` command is answered with a plain `1` by the module
-            # servers. This is a liveness acknowledgement and not a callback to
-            # be routed to another module.
-            msg = self._consume_up_acks(msg, mod_name)
-            if msg == b"":
-                return
-
             logger.debug(f"Received callback {msg=}")
             msg_arr = msg.decode("ascii").split("|")
             logger.info(f"{msg_arr=}")
 
             if len(msg_arr) != 3:
+                # not a callback, but possibly the reply to a sent pcomm
+                latency = getattr(self.mod_connections.get(mod_name), "latency", None)
+                if latency is not None and latency.replied(msg):
+                    logger.debug(f"Received reply {msg=} from {mod_name}")
+                    return
                 logger.error(
                     "CallbackBroker requires messages of the format:\n"
                     "<target_module_name>|<PCOMM>|{payload}\n"
@@ -186,4 +452,54 @@ class CallbackBroker:
                         payload = make_ao_payload_from_json(payload)
 
                     cmd = pcomm + "|" + payload
-                    trg_mod.send_message(cmd.encode())
+                    self.forward(trg_mod, cmd.encode())
+
+    def forward(self, trg_mod: ControlRoomModuleConnection, cmd: bytes):
+        """Send a routed callback to its target module.
+
+        The command is queued, so a slow target does not block the routing.
+        """
+        trg_mod.enqueue_message(cmd)
+
+
+def start_callback_broker(
+    connections: list[ControlRoomModuleConnection],
+) -> tuple[CallbackBroker, threading.Thread]:
+    """
+    Create a CallbackBroker for the given connections and run it in a thread.
+
+    Parameters
+    ----------
+    connections : list[ControlRoomModuleConnection]
+        The module connections to listen to for callbacks.
+
+    Returns
+    -------
+    tuple[CallbackBroker, threading.Thread]
+        The broker and the (daemon) thread running its listening loop.
+    """
+    logger.debug("Starting CallbackBroker thread")
+
+    # prepare the connection socket timeouts to be quicker. The broker only
+    # reads sockets which are ready, but a short timeout keeps the direct
+    # reads (e.g. in `is_up`) from blocking.
+    for c in connections:
+        if (
+            c.communicator
+            and isinstance(c.communicator, SocketCommunicator)
+            and c.communicator.socket_c
+        ):
+            c.communicator.socket_c.settimeout(0.001)
+
+    cbb = CallbackBroker(
+        mod_connections={c.name: c for c in connections},
+        stop_event=threading.Event(),
+    )
+    logger.info(
+        f"CallbackBroker has following modules connected: {list(cbb.mod_connections.keys())}"
+    )
+    # daemon, so a hanging broker can never keep the interpreter alive
+    cbb_th = threading.Thread(target=cbb.listen_for_callbacks, daemon=True)
+    cbb_th.start()
+
+    return cbb, cbb_th
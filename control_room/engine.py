@@ -0,0 +1,461 @@
+# An asyncio based engine for the connections to the modules.
+#
+# All module sockets are served by a single event loop running in a background
+# thread. Startup, pcomm discovery, liveness checks and the routing of
+# callbacks are coroutines on that loop, instead of a thread or a polling loop
+# per concern. The AsyncModuleConnection provides a synchronous facade, so the
+# Dash callbacks can keep using the ControlRoomModuleConnection interface.
+
+import asyncio
+import threading
+from collections.abc import Coroutine
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+from dareplane_utils.module_handling.communication import Communicator
+
+from control_room.callbacks import CallbackBroker
+from control_room.utils.config import dependency_layers
+from control_room.utils.logging import logger
+from control_room.utils.modules import (
+    ControlRoomModuleConnection,
+    initialize_modules,
+)
+from control_room.utils.startup import (
+    StartupReport,
+    apply_module_scheduling,
+    log_startup_report,
+    not_ready_dependencies,
+    record_phase,
+)
+
+
+@dataclass
+class ModuleLink:
+    """The stream pair and state of a single module's connection."""
+
+    name: str
+    ip: str
+    port: int
+    retry_after_s: float = 1
+    max_connect_retries: int = 3
+
+    reader: asyncio.StreamReader | None = field(default=None, repr=False)
+    writer: asyncio.StreamWriter | None = field(default=None, repr=False)
+    read_task: asyncio.Task | None = field(default=None, repr=False)
+    # future waiting for a reply without terminator, e.g. to `GET_PCOMMS`
+    reply: asyncio.Future | None = field(default=None, repr=False)
+    dropped: int = 0
+
+    @property
+    def is_connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+
+@dataclass
+class EngineCallbackBroker(CallbackBroker):
+    """CallbackBroker writing routed callbacks directly on the engine's loop."""
+
+    engine: "AsyncModuleEngine | None" = None
+
+    # callbacks received while the modules are started, None if not holding
+    _held: list[tuple[bytes, str]] | None = field(default=None, repr=False)
+
+    def hold(self):
+        """Hold back callbacks until `release`.
+
+        While modules are started, a target might not be connected or its
+        pcomms might not be known yet, so callbacks for it would be dropped.
+        """
+        if self._held is None:
+            self._held = []
+
+    def release(self):
+        """Route all held callbacks, in the order they were received."""
+        held, self._held = self._held or [], None
+        for msg, mod_name in held:
+            self.route_callback(msg, mod_name)
+
+    def route_callback(self, msg: bytes, mod_name: str):
+        if self._held is not None:
+            self._held.append((msg, mod_name))
+        else:
+            super().route_callback(msg, mod_name)
+
+    def forward(self, trg_mod: ControlRoomModuleConnection, cmd: bytes):
+        if self.engine is None:
+            super().forward(trg_mod, cmd)
+        else:
+            # the communicator schedules the write on the engine's loop, so
+            # this does not block. Going via the connection registers the
+            # command for the latency measurement.
+            trg_mod.send_message(cmd)
+
+    def take_unterminated(self, mod_name: str) -> bytes:
+        """Remove and return data which is not (yet) terminated by `;`."""
+        parser = self._parsers.get(mod_name, None)
+        return parser.take_unterminated() if parser is not None else b""
+
+
+class AsyncModuleEngine:
+    """
+    Serve the connections to all modules from a single asyncio event loop.
+
+    Parameters
+    ----------
+    max_write_buffer : int
+        Maximum number of bytes buffered for a module which does not read. If
+        exceeded, further messages to that module are dropped.
+    banner_timeout_s : float
+        Time to wait for the greeting a module's server sends upon connection.
+    """
+
+    def __init__(self, max_write_buffer: int = 2**20, banner_timeout_s: float = 1):
+        self.max_write_buffer = max_write_buffer
+        self.banner_timeout_s = banner_timeout_s
+        self.loop = asyncio.new_event_loop()
+        self.links: dict[str, ModuleLink] = {}
+        self.broker = EngineCallbackBroker(
+            mod_connections={}, stop_event=threading.Event(), engine=self
+        )
+        self._ack_cond = asyncio.Condition()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def thread(self) -> threading.Thread | None:
+        """The thread running the engine's loop."""
+        return self._thread
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="module_engine", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout_s: float = 3):
+        if self._thread is None:
+            return
+        try:
+            self.run(self.disconnect_all(), timeout=timeout_s)
+        except Exception as e:
+            logger.error(f"Error while disconnecting the modules: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=timeout_s)
+        if self._thread.is_alive():
+            # closing a running loop raises, the daemon thread is left behind
+            logger.warning(f"Engine loop did not stop within {timeout_s}s")
+        else:
+            self.loop.close()
+        self._thread = None
+
+    def run(self, coro: Coroutine, timeout: float | None = None) -> Any:
+        """Run a coroutine on the engine's loop and wait for its result."""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Engine.run() would block the engine's own loop")
+        fut = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return fut.result(timeout)
+        except TimeoutError:
+            fut.cancel()
+            raise
+
+    def communicator_factory(self):
+        """Factory for `initialize_modules` creating communicators of this engine."""
+        return partial(AsyncSocketCommunicator, engine=self)
+
+    def register(self, conn: ControlRoomModuleConnection):
+        self.broker.mod_connections[conn.name] = conn
+
+    # ------------------------------------------------------------------------
+    # Coroutines - only to be run on the engine's loop
+    # ------------------------------------------------------------------------
+    async def connect(self, name: str):
+        link = self.links[name]
+        for i in range(link.max_connect_retries):
+            try:
+                link.reader, link.writer = await asyncio.open_connection(
+                    link.ip, link.port
+                )
+                break
+            except ConnectionRefusedError:
+                logger.debug(
+                    f"Connection refused for {name} at {link.ip}:{link.port}, "
+                    f"retrying in {link.retry_after_s}s"
+                )
+                if i + 1 < link.max_connect_retries:
+                    await asyncio.sleep(link.retry_after_s)
+        else:
+            raise ConnectionRefusedError(
+                f"Connection refused after {link.max_connect_retries} tries: "
+                f"{link.ip=}, {link.port=}"
+            )
+
+        # the default server greets with a single line
+        try:
+            banner = await asyncio.wait_for(
+                link.reader.readline(), self.banner_timeout_s
+            )
+            logger.debug(f"connection returned: {banner.decode(errors='replace')}")
+        except TimeoutError:
+            logger.debug(f"No response upon connection for {name=}")
+
+        link.read_task = self.loop.create_task(self._read_loop(link))
+
+    async def disconnect(self, name: str):
+        link = self.links.get(name, None)
+        if link is None:
+            return
+        if link.read_task is not None:
+            link.read_task.cancel()
+            link.read_task = None
+        if link.writer is not None:
+            link.writer.close()
+            try:
+                await link.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        link.reader, link.writer = None, None
+
+    async def disconnect_all(self):
+        await asyncio.gather(*[self.disconnect(n) for n in self.links])
+
+    async def _read_loop(self, link: ModuleLink):
+        conn = self.broker.mod_connections.get(link.name, None)
+        while True:
+            try:
+                data = await link.reader.read(4096)  # type: ignore
+            except (ConnectionError, OSError) as e:
+                logger.warning(f"Lost the connection to {link.name}: {e}")
+                data = b""
+
+            if data == b"":
+                logger.debug(f"{link.name} closed the connection")
+                if link.writer is not None:
+                    link.writer.close()
+                return
+
+            n_acked = conn.up_acked if conn else 0
+            self.broker.process_message(data, link.name)
+
+            if link.reply is not None and not link.reply.done():
+                reply = self.broker.take_unterminated(link.name)
+                if reply:
+                    link.reply.set_result(reply)
+
+            if conn is not None and conn.up_acked != n_acked:
+                async with self._ack_cond:
+                    self._ack_cond.notify_all()
+
+    def write(self, name: str, data: bytes):
+        """Write to a module without blocking. Only call on the engine's loop."""
+        link = self.links.get(name, None)
+        if link is None or not link.is_connected:
+            logger.warning(f"Cannot send {data=} to {name}, it is not connected")
+            return
+
+        transport = link.writer.transport  # type: ignore
+        if transport.get_write_buffer_size() > self.max_write_buffer:
+            link.dropped += 1
+            logger.warning(f"{name} does not read, dropping {data=}")
+            return
+        link.writer.write(data)  # type: ignore
+
+    async def request_pcomms(self, name: str, timeout_s: float = 1) -> list[str]:
+        link = self.links[name]
+        link.reply = self.loop.create_future()
+        try:
+            self.write(name, b"GET_PCOMMS;")
+            reply = await asyncio.wait_for(link.reply, timeout_s)
+        finally:
+            link.reply = None
+        decoded = reply.decode().strip()
+        return decoded.split("|") if decoded else []
+
+    async def is_up(self, name: str, timeout_s: float = 0.1) -> bool:
+        link = self.links.get(name, None)
+        conn = self.broker.mod_connections.get(name, None)
+        if link is None or conn is None or not link.is_connected:
+            return False
+
+        # written via the connection, which numbers the `UP`s in the order
+        # they are written
+        seq = conn.send_up()
+        try:
+            async with self._ack_cond:
+                await asyncio.wait_for(
+                    self._ack_cond.wait_for(lambda: conn.up_acked >= seq),
+                    timeout_s,
+                )
+            return True
+        except TimeoutError:
+            return False
+
+    async def start_module(
+        self,
+        conn: ControlRoomModuleConnection,
+        dependencies: list[asyncio.Task] | None = None,
+    ) -> StartupReport:
+        """Launch a module once its dependencies are ready, connect to it and discover its pcomms."""
+        report = StartupReport(name=conn.name)
+
+        if dependencies:
+            with record_phase(report, "deps"):
+                report.error = not_ready_dependencies(
+                    list(await asyncio.gather(*dependencies))
+                )
+            if report.error:
+                logger.error(f"Module {conn.name} is not started: {report.error}")
+                return report
+
+        try:
+            with record_phase(report, "launch"):
+                logger.debug(f"Launching and connecting to {conn.name=}")
+                # launching blocks, e.g. while spawning the process
+                await self.loop.run_in_executor(None, conn.launch_module)
+                apply_module_scheduling(conn)
+
+            with record_phase(report, "connect"):
+                try:
+                    await self.connect(conn.name)
+                except ConnectionRefusedError:
+                    process = getattr(conn.launcher, "process", None)
+                    if process is not None and process.poll() is not None:
+                        raise ConnectionRefusedError(
+                            f"Cannot connect to module {conn.name=}. Host process not running."
+                        )
+                    raise
+
+            with record_phase(report, "pcomms"):
+                if isinstance(conn, AsyncModuleConnection):
+                    conn.pcomms = await self.request_pcomms(conn.name)
+                else:
+                    # e.g. connection only modules, which use the pcomms from the config
+                    conn.get_pcommands()
+
+            report.ready = True
+        except Exception as e:
+            report.error = repr(e)
+            logger.error(f"Module {conn.name} did not become ready: {e!r}")
+
+        return report
+
+    async def start_modules(
+        self, connections: list[ControlRoomModuleConnection]
+    ) -> list[StartupReport]:
+        by_name = {c.name: c for c in connections}
+        tasks: dict[str, asyncio.Task] = {}
+        self.broker.hold()
+        try:
+            for layer in dependency_layers({c.name: c.depends_on for c in connections}):
+                for name in layer:
+                    conn = by_name[name]
+                    tasks[name] = self.loop.create_task(
+                        self.start_module(conn, [tasks[d] for d in conn.depends_on])
+                    )
+
+            reports = await asyncio.gather(*[tasks[c.name] for c in connections])
+        finally:
+            # all modules are connected and know their pcomms now
+            self.broker.release()
+        log_startup_report(reports)
+        return reports
+
+
+class AsyncSocketCommunicator(Communicator):
+    """Synchronous Communicator interface to a module link of an engine."""
+
+    def __init__(
+        self,
+        ip: str,
+        port: int,
+        name: str,
+        engine: AsyncModuleEngine,
+        retry_after_s: float = 1,
+        max_connect_retries: int = 3,
+        logger=None,
+    ):
+        self.ip = ip
+        self.port = port
+        self.name = name
+        self.engine = engine
+        self.retry_after_s = retry_after_s
+        self.max_connect_retries = max_connect_retries
+        self.link = ModuleLink(
+            name=name,
+            ip=ip,
+            port=port,
+            retry_after_s=retry_after_s,
+            max_connect_retries=max_connect_retries,
+        )
+        engine.links[name] = self.link
+
+    def connect(self) -> None:
+        timeout = self.max_connect_retries * (self.retry_after_s + 1) + 1
+        self.engine.run(self.engine.connect(self.name), timeout=timeout)
+
+    def disconnect(self) -> None:
+        if self.engine.loop.is_closed() or not self.link.is_connected:
+            return
+        self.engine.run(self.engine.disconnect(self.name), timeout=3)
+
+    def send(self, data: bytes) -> None:
+        self.engine.loop.call_soon_threadsafe(self.engine.write, self.name, data)
+
+    def receive(self, size: int) -> bytes:
+        raise NotImplementedError(
+            "Replies are read by the engine, use the coroutines of AsyncModuleEngine"
+        )
+
+
+@dataclass
+class AsyncModuleConnection(ControlRoomModuleConnection):
+    """ControlRoomModuleConnection served by an AsyncModuleEngine.
+
+    Pcomm discovery and the `UP` check wait on the engine's loop for the
+    reply, instead of sleeping and polling the socket.
+    """
+
+    def _engine(self) -> AsyncModuleEngine | None:
+        if isinstance(self.communicator, AsyncSocketCommunicator):
+            return self.communicator.engine
+        return None
+
+    def get_pcommands(self, timeout_s: float = 1) -> None:
+        engine = self._engine()
+        if engine is None or not self.communicator.link.is_connected:  # type: ignore
+            return
+        try:
+            self.pcomms = engine.run(
+                engine.request_pcomms(self.name, timeout_s), timeout=timeout_s + 1
+            )
+        except TimeoutError:
+            logger.warning(f"Timeout while getting pcomms for {self.name}")
+        except Exception as e:
+            logger.error(f"Failed to get pcomms for {self.name}: {e}")
+
+    def is_up(self, timeout_s: float = 0.1) -> bool:
+        engine = self._engine()
+        if engine is None:
+            return False
+        try:
+            return engine.run(engine.is_up(self.name, timeout_s), timeout=timeout_s + 1)
+        except Exception as e:
+            logger.debug(f"Module {self.name} did not respond to UP: {e}")
+            return False
+
+
+def initialize_engine_modules(
+    cfg: dict[str, Any], cfg_file: Path, engine: AsyncModuleEngine
+) -> list[ControlRoomModuleConnection]:
+    """Create the module connections of a config, served by the given engine."""
+    connections = initialize_modules(
+        cfg,
+        cfg_file,
+        communicator_cls=engine.communicator_factory(),
+        connection_cls=AsyncModuleConnection,
+    )
+    for conn in connections:
+        engine.register(conn)
+    return connections
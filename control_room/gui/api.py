@@ -0,0 +1,53 @@
+# JSON endpoints served by the flask server underlying the dash app
+from typing import Any
+
+from dash import Dash
+from flask import Response, jsonify, request, stream_with_context
+
+from control_room.gui.events import EventHub
+
+
+def add_telemetry_api(app: Dash, telemetry: Any) -> Dash:
+    """
+    Serve the module telemetry at `/api/telemetry`.
+
+    Query parameters are `n`, the number of latest samples to return, and
+    `module`, to only return the history of a single module.
+    """
+
+    @app.server.route("/api/telemetry")
+    def get_telemetry():
+        last_n = request.args.get("n", default=None, type=int)
+        snapshot = telemetry.snapshot(last_n=last_n)
+
+        module = request.args.get("module", None)
+        if module is not None:
+            if module not in snapshot:
+                return jsonify({"error": f"No telemetry for {module=}"}), 404
+            snapshot = {module: snapshot[module]}
+
+        return jsonify(snapshot)
+
+    return app
+
+
+def add_event_stream(app: Dash, hub: EventHub) -> Dash:
+    """
+    Serve the GUI updates of the hub as server-sent events at `/events`.
+
+    If the hub has no capacity left, 503 is returned and the browser keeps
+    polling instead.
+    """
+
+    @app.server.route("/events")
+    def get_events():
+        client = hub.subscribe()
+        if client is None:
+            return Response("Too many event clients", status=503)
+        return Response(
+            stream_with_context(hub.stream(client)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    return app
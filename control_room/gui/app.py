@@ -1,11 +1,32 @@
+from typing import Any
+
 from dash import Dash
 
+from control_room.gui.api import add_event_stream, add_telemetry_api
 from control_room.gui.callbacks import add_callbacks
+from control_room.gui.events import EventHub
 from control_room.gui.layout import get_layout
+from control_room.utils.lsl_discovery import StreamDiscovery
+from control_room.utils.lsl_monitor import StreamMonitor
+from control_room.utils.lsl_preview import StreamPreviews
+from control_room.utils.macros import MacroExecutor
 from control_room.utils.modules import ControlRoomModuleConnection
+from control_room.utils.protocol import Protocol
+from control_room.utils.signal_quality import SignalQualityChecker
 
 
-def build_app(modules: list[ControlRoomModuleConnection], macros: dict | None) -> Dash:
+def build_app(
+    modules: list[ControlRoomModuleConnection],
+    macros: dict | None,
+    telemetry: Any = None,
+    lsl_discovery: StreamDiscovery | None = None,
+    lsl_monitor: StreamMonitor | None = None,
+    signal_quality: SignalQualityChecker | None = None,
+    lsl_previews: StreamPreviews | None = None,
+    events: EventHub | None = None,
+    macro_executor: MacroExecutor | None = None,
+    protocols: dict[str, Protocol] | None = None,
+) -> Dash:
     """
     Build and configure a Dash web application for the control room.
 
@@ -20,6 +41,28 @@ def build_app(modules: list[ControlRoomModuleConnection], macros: dict | None) -
     macros : dict | None
         A dictionary containing macro definitions to be used in the application.
         If None, no macros are used.
+    telemetry : Any
+        Source of the module telemetry, providing `snapshot(last_n)` like the
+        TelemetrySampler. If None, no telemetry is shown.
+    lsl_discovery : StreamDiscovery | None
+        The running discovery service providing the LSL streams to show.
+    lsl_monitor : StreamMonitor | None
+        Monitors the streams selected in the LSL tile. If None, streams
+        can not be selected.
+    signal_quality : SignalQualityChecker | None
+        Provides the channel quality of the monitored streams. If None, no
+        quality heatmap is shown.
+    lsl_previews : StreamPreviews | None
+        Provides decimated previews of the monitored streams, plotted in the
+        LSL tile.
+    events : EventHub | None
+        Hub of the pushed GUI updates, served at `/events`. If None, the
+        browsers poll for all updates.
+    macro_executor : MacroExecutor | None
+        Sends the commands of the macros. If None, one is created with the
+        macro callbacks.
+    protocols : dict[str, Protocol] | None
+        Timelines of commands which can be started from the GUI.
 
     Returns
     -------
@@ -27,9 +70,31 @@ def build_app(modules: list[ControlRoomModuleConnection], macros: dict | None) -
         The configured Dash application.
     """
     app = Dash(__name__, external_stylesheets=["assets/styles.css"])
-    app.layout = get_layout(modules, macros=macros)
+    app.layout = get_layout(
+        modules,
+        macros=macros,
+        telemetry=telemetry is not None,
+        signal_quality=signal_quality is not None,
+        protocols=protocols,
+    )
 
     # attach callbacks
-    app = add_callbacks(app, modules=modules, macros=macros)
+    app = add_callbacks(
+        app,
+        modules=modules,
+        macros=macros,
+        telemetry=telemetry,
+        lsl_discovery=lsl_discovery,
+        lsl_monitor=lsl_monitor,
+        signal_quality=signal_quality,
+        lsl_previews=lsl_previews,
+        events=events,
+        macro_executor=macro_executor,
+        protocols=protocols,
+    )
+    if telemetry is not None:
+        app = add_telemetry_api(app, telemetry)
+    if events is not None:
+        app = add_event_stream(app, events)
 
     return app
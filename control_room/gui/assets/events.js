@@ -0,0 +1,81 @@
+// Apply the GUI updates pushed by the server at /events, see
+// control_room/gui/events.py. While the event stream is connected, the
+// polling of the pushed parts is paused.
+(function () {
+  if (!window.EventSource) {
+    return; // keep polling
+  }
+
+  const FALLBACK_INTERVALS = [
+    "interval_modules",
+    "interval_log",
+    "interval_streams",
+    "interval_macros",
+  ];
+  let logLines = [];
+
+  function setProps(id, props) {
+    // intervals and stores have no DOM element, so this is not checked
+    window.dash_clientside.set_props(id, props);
+  }
+
+  function setPolling(enabled) {
+    for (const id of FALLBACK_INTERVALS) {
+      setProps(id, { disabled: !enabled });
+    }
+  }
+
+  function on(source, event, handler) {
+    source.addEventListener(event, (e) => handler(JSON.parse(e.data)));
+  }
+
+  function connect() {
+    const source = new EventSource("/events");
+
+    source.onopen = () => setPolling(false);
+    source.onerror = () => {
+      setPolling(true);
+      if (source.readyState === EventSource.CLOSED) {
+        // e.g. too many clients, the browser does not retry by itself
+        setTimeout(connect, 10000);
+      }
+    };
+
+    // the hashes of the polled content no longer describe what is shown
+    on(source, "modules", (d) => {
+      for (const [id, className] of Object.entries(d.classes)) {
+        setProps(id, { className: className });
+      }
+      setProps("module_state_hash", { data: null });
+    });
+    on(source, "log", (d) => {
+      // newest line first, as in the polled log
+      logLines = (d.reset ? d.lines : d.lines.concat(logLines)).slice(
+        0,
+        d.max_lines,
+      );
+      setProps("logfile_data", { children: logLines });
+      setProps("logfile_state", { data: { seq: d.seq, count: logLines.length } });
+    });
+    on(source, "streams", (d) => {
+      setProps("lsl_streams_select", { options: d.options });
+      setProps("lsl_streams_hash", { data: null });
+    });
+    on(source, "macros", (d) => {
+      setProps("macro_runs", { children: d.runs });
+      setProps("macro_runs_hash", { data: null });
+    });
+    on(source, "command", (d) => setProps("last_command_div", { children: d.text }));
+  }
+
+  // connect once the dash renderer is up, so no replayed state is lost
+  function waitForLayout() {
+    const clientside = window.dash_clientside;
+    if (clientside && clientside.set_props && document.getElementById("control_room_app")) {
+      connect();
+    } else {
+      setTimeout(waitForLayout, 200);
+    }
+  }
+  waitForLayout();
+})();
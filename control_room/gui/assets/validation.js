@@ -0,0 +1,17 @@
+// Clientside callbacks, registered in control_room/gui/callbacks.py
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+  control_room: Object.assign({}, (window.dash_clientside || {}).control_room, {
+    // color an input by whether it holds valid json, empty inputs are kept
+    validate_json: function (value) {
+      if (value === undefined || value === null || value === "") {
+        return window.dash_clientside.no_update;
+      }
+      try {
+        JSON.parse(value);
+        return "valid_json_input";
+      } catch (e) {
+        return "invalid_json_input";
+      }
+    },
+  }),
+});
@@ -0,0 +1,25 @@
+// Poll less often while the page is hidden, e.g. in a background tab. The
+// intervals are restored once the page is visible again.
+(function () {
+  // the intervals defined in control_room/gui/layout.py
+  const INTERVALS_MS = {
+    interval_3s: 3000,
+    interval_preview: 1000,
+    interval_modules: 1000,
+    interval_log: 2000,
+    interval_streams: 3000,
+    interval_macros: 1000,
+  };
+  const HIDDEN_INTERVAL_MS = 30000;
+
+  document.addEventListener("visibilitychange", () => {
+    const clientside = window.dash_clientside;
+    if (!clientside || !clientside.set_props) {
+      return;
+    }
+    for (const [id, ms] of Object.entries(INTERVALS_MS)) {
+      const interval = document.hidden ? Math.max(ms, HIDDEN_INTERVAL_MS) : ms;
+      clientside.set_props(id, { interval: interval });
+    }
+  });
+})();
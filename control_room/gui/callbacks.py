@@ -1,31 +1,46 @@
-import ast
+import hashlib
 import json
-import re
-from pathlib import Path
-from time import sleep
-
-import pylsl
-from dash import Dash, ctx, html
-from dash.dependencies import Input, Output, State
-
+from dataclasses import replace
+from types import MappingProxyType
+from typing import Any
+
+import numpy as np
+from dash import Dash, Patch, ctx, dcc, html, no_update
+from dash.dependencies import ALL, MATCH, ClientsideFunction, Input, Output, State
+from plotly.utils import PlotlyJSONEncoder
+
+from control_room.gui.events import EventHub
+from control_room.gui.ids import (
+    macro_button_id,
+    macro_control_id,
+    macro_input_id,
+    macro_sent_id,
+    pcomm_button_id,
+    pcomm_input_id,
+    pcomm_latency_id,
+    pcomm_sent_id,
+    protocol_button_id,
+    protocol_sent_id,
+)
 from control_room.utils.logging import logger
 from control_room.utils.logserver import logfile as log_file_path
-from control_room.utils.modules import ControlRoomModuleConnection
-
-
-def is_ao_module(module_name: str) -> bool:
-    """
-    Helper function for as long as there is a special treatment for the AO modules
-    ie. until the TCP servers are built properly.
-
-    Have a separate function as this logic might be extended
-    """
-
-    return "dp-ao-comm" in module_name
-
-
-class PayloadError(KeyError):
-    pass
+from control_room.utils.logtail import LogLine, LogTailer
+from control_room.utils.lsl_discovery import StreamDiscovery, StreamEntry
+from control_room.utils.lsl_monitor import StreamMetrics, StreamMonitor
+from control_room.utils.lsl_preview import StreamPreviews
+from control_room.utils.macros import (
+    RUN_CONTROLS,
+    MacroCommand,
+    MacroConfigError,
+    MacroExecutor,
+    MacroPlan,
+    MacroRun,
+    MacroStep,
+    evaluate_templates,
+)
+from control_room.utils.modules import ControlRoomModuleConnection, is_ao_module
+from control_room.utils.protocol import Protocol
+from control_room.utils.signal_quality import QUALITY_METRICS, SignalQualityChecker
 
 
 def get_module_endpoint(module: ControlRoomModuleConnection) -> str:
@@ -38,19 +53,47 @@ def get_module_endpoint(module: ControlRoomModuleConnection) -> str:
 
 
 def add_callbacks(
-    app: Dash, modules: list[ControlRoomModuleConnection], macros: dict | None = None
+    app: Dash,
+    modules: list[ControlRoomModuleConnection],
+    macros: dict | None = None,
+    telemetry: Any = None,
+    lsl_discovery: StreamDiscovery | None = None,
+    lsl_monitor: StreamMonitor | None = None,
+    signal_quality: SignalQualityChecker | None = None,
+    lsl_previews: StreamPreviews | None = None,
+    events: EventHub | None = None,
+    macro_executor: MacroExecutor | None = None,
+    protocols: dict[str, Protocol] | None = None,
 ) -> Dash:
     """Add callbacks to a given app"""
     logfile = log_file_path
 
-    # Stats update will refresh the log content, lsl stream and module state
-    app = add_stats_update(app, logfile, modules)
+    # polled separately, each only sends its outputs if they changed
+    app = add_module_state_update(app, modules)
+    app = add_lsl_streams_update(app, lsl_discovery, lsl_monitor)
+    if lsl_monitor is not None:
+        app = add_lsl_monitor_selection(app, lsl_monitor)
+    if signal_quality is not None:
+        app = add_signal_quality_update(app, signal_quality)
+    if lsl_previews is not None:
+        app = add_lsl_preview_update(app, lsl_previews)
+    app = add_log_update(app, LogTailer(logfile))
+    if telemetry is not None:
+        app = add_telemetry_update(app, modules, telemetry)
     app = add_json_verification_cb(app, modules=modules, macros=macros)
-    app = add_pcomm_sender(app, modules)
-
+    app = add_pcomm_sender(app, modules, events)
+    if any(len(m.gui_pcomms) > 0 for m in modules):
+        app = add_pcomm_latency_update(app, modules)
+
+    if macros is not None or protocols:
+        if macro_executor is None:
+            macro_executor = MacroExecutor()
+        app = add_macro_runs_update(app, macro_executor)
     if macros is not None:
-        app = add_macros_sender(app, modules, macros)
+        app = add_macros_sender(app, modules, macros, events, macro_executor)
         logger.debug("Added macros callback")
+    if protocols:
+        app = add_protocol_runner(app, modules, protocols, events, macro_executor)
         # macro_buttons = {f"{mc['name']}":
         #                  Input(f"{mc['name']}|button", 'n_clicks')
         #                  for mc in macros.values()}
@@ -64,11 +107,12 @@ def add_json_verification_cb(
     app: Dash, modules: list[ControlRoomModuleConnection], macros: dict | None
 ) -> Dash:
     """
-    Add a callback to the Dash app to verify JSON strings in input fields.
+    Add callbacks to the Dash app to verify JSON strings in input fields.
 
-    This function sets up a callback that checks whether the input values in specified
-    input fields are valid JSON strings. It updates the class names of the input fields
-    based on the validity of the JSON, which should result in a color change.
+    The validation runs in the browser (`assets/validation.js`). The inputs
+    are matched by pattern, so each keystroke only validates its own field
+    and updates its class name, which results in a color change, without a
+    request to the server.
 
     Parameters
     ----------
@@ -86,61 +130,156 @@ def add_json_verification_cb(
     Dash
         The Dash application with the added callback.
     """
-    model_input_ids = []
-    for m in modules:
-        if len(m.gui_pcomms) > 0:
-            for pcomm in m.gui_pcomms:
-                model_input_ids.append(f"{m.name}|{pcomm}|input")
-            else:
-                model_input_ids.append(f"{m.name}|input")
+    validate = ClientsideFunction(
+        namespace="control_room", function_name="validate_json"
+    )
+
+    if any(len(m.gui_pcomms) > 0 for m in modules):
+        input_id = pcomm_input_id(MATCH, MATCH)
+        app.clientside_callback(
+            validate,
+            Output(input_id, "className"),
+            Input(input_id, "value"),
+        )
 
     if macros is not None:
-        macros_input_ids = [
-            f"{mc['name']}|input" for k, mc in macros.items() if k != "globals"
-        ]
-        all_ids = model_input_ids + macros_input_ids
-    else:
-        all_ids = model_input_ids
-
-    outputs = [Output(op, "className") for op in all_ids]
-    inputs = [Input(op, "value") for op in all_ids]
-    states = [State(op, "className") for op in all_ids]
-
-    @app.callback(output=outputs, inputs=inputs, state=states)
-    def check_jsonifyable(*args):
-        rets = [v for v in ctx.states.values()]  # states
-
-        # Only check the triggering input
-        inp_name = ctx.triggered[0]["prop_id"]
-        inp = ctx.inputs.get(inp_name, None)
-
-        if inp is None:
-            return rets
-
-        # get the index of the changing also in the output - only possible
-        # as inputs and outputs are generated with the same order
-        idxinp = list(ctx.inputs.keys()).index(inp_name)
-
-        if inp is not None and inp != "":
-            try:
-                json.loads(str(inp))
-                rets[idxinp] = "valid_json_input"
-                # logger.debug(f"{inp=} is valid")
-            # except Exception as e:
-            # print(f">>>>> {e=}")
-            except json.JSONDecodeError:
-                rets[idxinp] = "invalid_json_input"
-                # logger.debug(f"{inp=} is invalid")
-
-        return rets
+        input_id = macro_input_id(MATCH)
+        app.clientside_callback(
+            validate,
+            Output(input_id, "className"),
+            Input(input_id, "value"),
+        )
 
     return app
 
 
+def json_payload_str(payload: dict) -> str:
+    return json.dumps(payload).replace("'", '"')
+
+
+def ao_payload_str(payload: dict) -> str:
+    # TODO: Properly refactor the AO module that this extra
+    # handling is no longer needed!
+    return make_ao_payload_from_json(json_payload_str(payload))
+
+
+def make_macro_command(
+    module: ControlRoomModuleConnection,
+    pcomm: str,
+    mappings: tuple[tuple[str, str], ...] = (),
+) -> MacroCommand:
+    """A command to a module, with the module's payload encoding"""
+    is_ao = is_ao_module(module.name)
+    return MacroCommand(
+        target=module,
+        pcomm=pcomm,
+        mappings=mappings,
+        encode=ao_payload_str if is_ao else json_payload_str,
+        # keep the old message structure for the AO module until it is
+        # properly integrated, others get a semi-colon to separate commands
+        terminator="" if is_ao else ";",
+    )
+
+
+def compile_macros(
+    macros: dict, modules: list[ControlRoomModuleConnection]
+) -> dict[str, MacroPlan]:
+    """
+    Compile the macros of a config into plans.
+
+    Each entry of a macro's `cmds` is either a single command or a list of
+    commands, which form a group. The commands of a group are sent
+    together, groups are sent one after another. With `wait_ack = true` in
+    the macro's config, each group is a barrier, i.e. the next group is
+    only sent once all modules of the group acknowledged.
+
+    Parameters
+    ----------
+    macros : dict
+        The `macros` section of the config.
+    modules : list[ControlRoomModuleConnection]
+        The modules the commands are sent to.
+
+    Returns
+    -------
+    dict[str, MacroPlan]
+        The plans by the names of the macros.
+
+    Raises
+    ------
+    MacroConfigError
+        If a command refers to an unknown module or uses the reserved `;`.
+    """
+    modules_dict = {module.name: module for module in modules}
+    globals = macros.get("globals", None)
+    sleep_s = globals.get("sleep_s", None) if globals else None
+
+    plans = {}
+    for key, mc in macros.items():
+        if key == "globals":
+            continue
+
+        default_json = mc.get("default_json", None)
+        defaults = dict(default_json) if default_json else {}
+
+        groups = []
+        missing = []
+        for cmd in mc["cmds"].values():
+            # a group is a list of commands, each of which is a list
+            group = cmd if isinstance(cmd[0], list) else [cmd]
+            commands = []
+            for cm_list in group:
+                mod_name, pcomm, *mapping_strs = cm_list
+                if mod_name not in modules_dict:
+                    raise MacroConfigError(
+                        f"Macro {key!r} sends to unknown module {mod_name!r}."
+                        f" Known modules: {list(modules_dict)}"
+                    )
+                if ";" in pcomm:
+                    raise MacroConfigError(
+                        f"Macro {key!r} uses the reserved character `;` in {pcomm!r}"
+                    )
+                # kwargs missing in the `default_json` can still be provided
+                # in the macro's input field, so they are checked per run
+                mappings = tuple(tuple(m.split("=")) for m in mapping_strs)
+                missing += [
+                    f"{mod_name} {pcomm} {'='.join(m)}"
+                    for m in mappings
+                    if m[-1] not in defaults
+                ]
+
+                commands.append(
+                    make_macro_command(modules_dict[mod_name], pcomm, mappings)
+                )
+            groups.append(tuple(commands))
+
+        if missing:
+            logger.warning(
+                f"Macro {key!r} maps kwargs which are not in its default_json,"
+                f" they have to be provided in its input field: {missing}"
+            )
+
+        plans[mc["name"]] = MacroPlan(
+            name=mc["name"],
+            groups=tuple(groups),
+            # as rendered in the macro's input field
+            default_input=json.dumps(default_json) if default_json else "",
+            default_kwargs=MappingProxyType(evaluate_templates(defaults)),
+            sleep_s=sleep_s,
+            delay_s=mc.get("delay_s", 0.0),
+            wait_ack=mc.get("wait_ack", False),
+            ack_timeout_s=mc.get("ack_timeout_s", 1.0),
+        )
+
+    return plans
+
+
 def add_macros_sender(
     app: Dash,
     modules: list[ControlRoomModuleConnection],
     macros: dict,
+    events: EventHub | None = None,
+    executor: MacroExecutor | None = None,
 ) -> Dash:
     """
     Add a callbacks to dynamically to macro sections on a Dash app.
@@ -150,6 +289,11 @@ def add_macros_sender(
     over all macro sections and given their configs, add the appropriate
     callback to execute the macro commands.
 
+    The macros are compiled once, so errors in their config are raised
+    here instead of on a click. The commands are only scheduled by the
+    callback and sent by the `executor`, so delays between them do not
+    block the server's workers.
+
 
     Parameters
     ----------
@@ -160,123 +304,234 @@ def add_macros_sender(
         in the application.
     macros : dict
         A dictionary containing macro definitions to be used in the application.
+    events : EventHub | None
+        If given, the sent macro is published to all browsers.
+    executor : MacroExecutor | None
+        Sends the macro commands. If None, an executor is created.
 
     Returns
     -------
     Dash
         The Dash application with the added callback.
     """
-    modules_dict = {module.name: module for module in modules}
-    macro_name_key_map = {v["name"]: k for k, v in macros.items() if k != "globals"}
-    macro_buttons = {
-        f"{mc['name']}": Input(f"{mc['name']}|button", "n_clicks")
-        for k, mc in macros.items()
-        if k != "globals"
-    }
-
-    globals = macros.get("globals", None)
-    sleep_s = globals.get("sleep_s", None) if globals else None
-
-    logger.debug(f"{macro_buttons=}")
+    plans = compile_macros(macros, modules)
+    executor = executor if executor is not None else MacroExecutor()
 
+    # matched per macro, so a click only sends the payload of its own input
     @app.callback(
-        output=Output("last_macro_sent_div", "children"),
-        inputs={"all_buttons": macro_buttons},
-        state={
-            "all_states": {
-                f"{mc['name']}": State(f"{mc['name']}|input", "value")
-                for k, mc in macros.items()
-                if k != "globals"
-            }
-        },
+        Output(macro_sent_id(MATCH), "children"),
+        Input(macro_button_id(MATCH), "n_clicks"),
+        State(macro_input_id(MATCH), "value"),
+        prevent_initial_call=True,
     )
-    def send_macro(all_buttons, all_states):
-        logger.debug(f"Send macro activated: {all_buttons=}")
-        button_id = ctx.triggered_id if not None else "No clicks yet"
-        msgs = ""
-
-        if ctx.triggered_id is not None:
-            m_name, _ = button_id.split("|")
-            mc = macros[macro_name_key_map[m_name]]
-            if "delay_s" in mc.keys():
-                sleep(mc["delay_s"])
+    def send_macro(n_clicks, json_input):
+        logger.debug(f"Send macro activated: {ctx.triggered_id=}")
+        if ctx.triggered_id is None:
+            return ""
+
+        plan = plans[ctx.triggered_id["macro"]]
+        m_kwargs = plan.kwargs(json_input)
+        logger.debug(f"Macro details: {plan.name=}, {m_kwargs=}")
+
+        run_id = executor.submit(
+            plan.name,
+            plan.steps(m_kwargs),
+            delay_s=plan.delay_s,
+            ack_timeout_s=plan.ack_timeout_s,
+        )
+        publish_command(events, f"{plan.name}: run {run_id} started")
 
-            if all_states[m_name] != "":
-                json_dict = ast.literal_eval(all_states[m_name])
-                m_kwargs = evaluate_templates(json_dict)
-            else:
-                m_kwargs = {}
+        return run_id
 
-            logger.debug(f"Macro details: {m_name=}, {mc=}, {m_kwargs=}")
+    return app
 
-            for cmn, cm_list in mc["cmds"].items():
-                if sleep_s:
-                    logger.debug(f"Sleeping for {sleep_s=}")
-                    sleep(sleep_s)
 
-                module = modules_dict[cm_list[0]]
+def add_protocol_runner(
+    app: Dash,
+    modules: list[ControlRoomModuleConnection],
+    protocols: dict[str, Protocol],
+    events: EventHub | None = None,
+    executor: MacroExecutor | None = None,
+) -> Dash:
+    """
+    Add a callback starting the protocols on a Dash app.
 
-                msg = cm_list[1]
+    The events of a protocol are converted to steps once, a click submits
+    them to the `executor`, which sends them at their offsets.
 
-                json_payload = {}
-                for mapping in cm_list[2:]:
-                    k2, k1 = mapping.split("=")
-                    if k1 not in m_kwargs.keys():
-                        error_msg = f"Key '{k1}' not in provided payload"
-                        logger.error(error_msg)
-                        raise PayloadError(error_msg)
+    Parameters
+    ----------
+    app : Dash
+        The Dash application to which the callback will be added.
+    modules : list[ControlRoomModuleConnection]
+        The modules the events are sent to.
+    protocols : dict[str, Protocol]
+        The protocols by name.
+    events : EventHub | None
+        If given, the started protocol is published to all browsers.
+    executor : MacroExecutor | None
+        Sends the events. If None, an executor is created.
 
-                    json_payload[k2] = m_kwargs[k1]
+    Returns
+    -------
+    Dash
+        The Dash application with the added callback.
+    """
+    steps = {name: protocol_steps(p, modules) for name, p in protocols.items()}
+    executor = executor if executor is not None else MacroExecutor()
 
-                if json_payload != {}:
-                    payload_str = json.dumps(json_payload).replace("'", '"')
+    @app.callback(
+        Output(protocol_sent_id(MATCH), "children"),
+        Input(protocol_button_id(MATCH), "n_clicks"),
+        prevent_initial_call=True,
+    )
+    def start_protocol(n_clicks):
+        if ctx.triggered_id is None:
+            return ""
+        name = ctx.triggered_id["protocol"]
+        # the steps record their send times, so each run gets its own copies
+        run_id = executor.submit(name, [replace(s) for s in steps[name]])
+        publish_command(events, f"Protocol {name}: run {run_id} started")
+        return run_id
 
-                    # TODO: Properly refactor the AO module that this extra
-                    # handling is no longer needed!
-                    if json_payload is not None and is_ao_module(module.name):
-                        payload_str = make_ao_payload_from_json(payload_str)
+    return app
 
-                    msg = msg + "|" + payload_str
 
-                logger.debug(f"Sending {msg=} to {get_module_endpoint(module)}")
-                if ";" in msg:
-                    logger.error(
-                        f"Found a semi-colon in {msg=} - this is a reserved character please use characters other than `;`"
-                    )
-                if is_ao_module(module.name):
-                    # keep the old message structure until the AO module
-                    # is properly integrated
-                    module.send_message(msg.encode())
-                    msg = msg + ";"
-                else:
-                    msg = msg + ";"  # add semi-colon to separate commands
-                    module.send_message(msg.encode())
+def protocol_steps(
+    protocol: Protocol, modules: list[ControlRoomModuleConnection]
+) -> list[MacroStep]:
+    """
+    The steps of a protocol's events.
 
-                msgs += msg
+    Events at the same offset form a group, which is sent together.
 
-        return msgs
+    Raises
+    ------
+    MacroConfigError
+        If an event is sent to an unknown module.
+    """
+    modules_dict = {module.name: module for module in modules}
+    unknown = protocol.modules - modules_dict.keys()
+    if unknown:
+        raise MacroConfigError(
+            f"Protocol {protocol.name!r} sends to unknown modules {sorted(unknown)}."
+            f" Known modules: {list(modules_dict)}"
+        )
 
-    return app
+    steps = []
+    group = -1
+    for i, ev in enumerate(protocol.events):
+        if i == 0 or ev.t_offset_s != protocol.events[i - 1].t_offset_s:
+            group += 1
+        payload = dict(ev.payload) if ev.payload else {}
+        cmd = make_macro_command(
+            modules_dict[ev.module], ev.pcomm, tuple((k, k) for k in payload)
+        )
+        steps.append(
+            MacroStep(
+                target=cmd.target,
+                message=cmd.message(payload),
+                offset_s=ev.t_offset_s,
+                group=group,
+            )
+        )
+    return steps
 
 
-def evaluate_templates(d: dict) -> dict:
+def add_macro_runs_update(app: Dash, executor: MacroExecutor) -> Dash:
     """
-    If a dictionary contains $<some_name> templates in its values,
-    replace them with the variable
+    Add callbacks showing the runs of macros and protocols and controlling them.
+
+    Parameters
+    ----------
+    app : Dash
+        The Dash application to which the callbacks will be added.
+    executor : MacroExecutor
+        Executes the runs.
+
+    Returns
+    -------
+    Dash
+        The Dash application with the added callbacks.
     """
-    for k, v in d.items():
-        if isinstance(v, str):
-            keys = re.findall(r"\$<([^>]*)>", v)
 
-            for kk in keys:
-                v = v.replace(f"$<{kk}>", str(d[kk]))
+    @app.callback(
+        Input(macro_control_id(ALL, ALL), "n_clicks"),
+        prevent_initial_call=True,
+    )
+    def control_macro_run(n_clicks):
+        # also triggered when the buttons are rendered, without a click
+        if ctx.triggered_id is None or not ctx.triggered[0]["value"]:
+            return
+        action = ctx.triggered_id["action"]
+        if action in RUN_CONTROLS:
+            getattr(executor, action)(ctx.triggered_id["run"])
+
+    @app.callback(
+        Output("macro_runs", "children"),
+        Output("macro_runs_hash", "data"),
+        Input("interval_macros", "n_intervals"),
+        State("macro_runs_hash", "data"),
+    )
+    def update_macro_runs(n, last_hash):
+        view = macro_runs_view(executor.runs())
+        h = content_hash(view)
+        if h == last_hash:
+            return no_update, no_update
+        return view, h
 
-            d[k] = v
+    return app
+
+
+def macro_runs_view(
+    runs: list[MacroRun], max_runs: int = 5, max_steps: int = 8
+) -> list[html.Div]:
+    """The progress and step timing of the latest macro runs"""
+    rows = []
+    for run in runs[:max_runs]:
+        header = [
+            html.Span(f"{run.name} [{run.run_id}] {run.state}"),
+            html.Span(f" {run.n_sent}/{len(run.steps)}"),
+        ]
+        if run.is_active:
+            actions = ["resume" if run.state == "paused" else "pause", "cancel"]
+            header += [
+                html.Button(
+                    action,
+                    id=macro_control_id(run.run_id, action),
+                    className="macro_control",
+                )
+                for action in actions
+            ]
+        steps = []
+        # long runs, e.g. protocols, only show the steps around their progress
+        first = max(0, min(run.n_sent - max_steps // 2, len(run.steps) - max_steps))
+        for step in run.steps[first : first + max_steps]:
+            text = f"{step.group}: {step.target.name}"
+            text += f" {step.message.decode(errors='replace')}"
+            text += f" @{step.offset_s:.2f}s"
+            if step.lateness_ms is not None:
+                text += f" (+{step.lateness_ms:.1f}ms)"
+            if step.error is not None:
+                text += f" failed: {step.error}"
+            steps.append(html.Div(text, className="macro_step"))
+        rows.append(
+            html.Div([html.Div(header), *steps], className=f"macro_run {run.state}")
+        )
+    return rows
 
-    return d
 
+def publish_command(events: EventHub | None, text: str):
+    if events is not None:
+        data = {"text": text}
+        events.publish("command", data, state=data)
 
-def add_pcomm_sender(app: Dash, modules: list[ControlRoomModuleConnection]) -> Dash:
+
+def add_pcomm_sender(
+    app: Dash,
+    modules: list[ControlRoomModuleConnection],
+    events: EventHub | None = None,
+) -> Dash:
     """
     Add a callback to the Dash app to send pcomm commands to modules.
 
@@ -291,6 +546,8 @@ def add_pcomm_sender(app: Dash, modules: list[ControlRoomModuleConnection]) -> D
     modules : list[ControlRoomModuleConnection]
         A list of ControlRoomModuleConnection objects representing the modules to be included
         in the application.
+    events : EventHub | None
+        If given, the sent command is published to all browsers.
 
     Returns
     -------
@@ -299,39 +556,19 @@ def add_pcomm_sender(app: Dash, modules: list[ControlRoomModuleConnection]) -> D
     """
     modules_dict = {module.name: module for module in modules}
 
+    # matched per pcomm, so a click only sends the payload of its own input
     @app.callback(
-        output=Output("last_pcomm_sent_div", "children"),
-        inputs={
-            "all_buttons": {
-                f"{mconn.name}|{pcomm}": Input(
-                    f"{mconn.name}|{pcomm}|button", "n_clicks"
-                )
-                for mconn in modules
-                for pcomm in mconn.gui_pcomms
-            }
-        },
-        state={
-            "all_states": {
-                f"{mconn.name}|{pcomm}": State(f"{mconn.name}|{pcomm}|input", "value")
-                for mconn in modules
-                for pcomm in mconn.gui_pcomms
-            }
-        },
+        Output(pcomm_sent_id(MATCH, MATCH), "children"),
+        Input(pcomm_button_id(MATCH, MATCH), "n_clicks"),
+        State(pcomm_input_id(MATCH, MATCH), "value"),
+        prevent_initial_call=True,
     )
-    def send_pcomm(all_buttons, all_states):
-        button_id = (
-            ctx.triggered_id if ctx.triggered_id is not None else "No clicks yet"
-        )
+    def send_pcomm(n_clicks, json_payload):
         msg = ""
 
         if ctx.triggered_id is not None:
-            logger.debug(f"Send pcomm activated: {all_buttons=}")
-            try:
-                mod_name, pcomm_name, _ = button_id.split("|")
-            except ValueError:
-                logger.error(f"Unexpected triggered button id format: {button_id!r}")
-                return msg
-
+            mod_name = ctx.triggered_id["module"]
+            pcomm_name = ctx.triggered_id["pcomm"]
             module = modules_dict[mod_name]
             msg = pcomm_name
 
@@ -340,9 +577,6 @@ def add_pcomm_sender(app: Dash, modules: list[ControlRoomModuleConnection]) -> D
             logger.debug(f"module: {module}")
             logger.debug(f"messages to send: {msg=}")
 
-            logger.debug(f"All states: {all_states=}")
-            # TODO - think of a way to validate the string (potentially a different callback) which is triggered upon entering the text values # noqa
-            json_payload = all_states[f"{mod_name}|{pcomm_name}"]
             logger.debug(f"module button {json_payload=}")
 
             if json_payload is not None and is_ao_module(module.name):
@@ -355,61 +589,406 @@ def add_pcomm_sender(app: Dash, modules: list[ControlRoomModuleConnection]) -> D
 
             logger.debug(f"Sending {msg=} to {get_module_endpoint(module)}")
             module.send_message(msg.encode())
+            publish_command(events, f"{mod_name}: {msg}")
 
         return msg
 
     return app
 
 
-# TODO: rework this
-def add_stats_update(
-    app: Dash, logfile: Path, modules: list[ControlRoomModuleConnection]
+def pcomm_latency_text(stats: dict | None) -> tuple[str, str]:
+    """The label and hover text of a pcomm's latency stats"""
+    if not stats:
+        return "", "no round trip measured yet"
+    return (
+        f"{stats['p50_ms']:.1f} | {stats['p99_ms']:.1f} ms",
+        f"round trip until processed, p50 {stats['p50_ms']:.2f} ms,"
+        f" p99 {stats['p99_ms']:.2f} ms, n={stats['n']}",
+    )
+
+
+def add_pcomm_latency_update(
+    app: Dash, modules: list[ControlRoomModuleConnection]
 ) -> Dash:
-    mod_outputs = [Output(f"{m.name}_check_box", "className") for m in modules]
+    """
+    Show the p50 and p99 round-trip latency next to each pcomm button.
+
+    The latencies are tracked by the module connections, see
+    `control_room.utils.latency.PcommLatency`.
+    """
+    modules_dict = {module.name: module for module in modules}
 
     @app.callback(
-        output=[
-            Output("lsl_streams_list", "children"),
-            Output("logfile_data", "children"),
+        Output(pcomm_latency_id(ALL, ALL), "children"),
+        Output(pcomm_latency_id(ALL, ALL), "title"),
+        Output("pcomm_latency_hash", "data"),
+        Input("interval_3s", "n_intervals"),
+        State("pcomm_latency_hash", "data"),
+    )
+    def update_pcomm_latency(n, last_hash):
+        summaries = {name: m.latency_summary() for name, m in modules_dict.items()}
+        h = content_hash(summaries)
+        if h == last_hash:
+            return no_update, no_update, no_update
+
+        # in the order of the matched components
+        texts = [
+            pcomm_latency_text(summaries[o["id"]["module"]].get(o["id"]["pcomm"]))
+            for o in ctx.outputs_list[0]
         ]
-        + mod_outputs,
-        inputs=[Input("interval_3s", "n_intervals")],
+        return [t[0] for t in texts], [t[1] for t in texts], h
+
+    return app
+
+
+def log_line_p(line: LogLine) -> html.P:
+    return html.P(line.text, className=line.level)
+
+
+def add_log_update(app: Dash, tailer: LogTailer) -> Dash:
+    """
+    Show the latest lines of the log file.
+
+    Only the lines a browser has not seen yet are sent and prepended to the
+    shown lines, the oldest lines are removed to keep `tailer.max_lines`.
+    The log panel displays in reverse order, i.e. the newest line is first.
+    """
+
+    @app.callback(
+        Output("logfile_data", "children"),
+        Output("logfile_state", "data"),
+        Input("interval_log", "n_intervals"),
+        State("logfile_state", "data"),
+    )
+    def update_log(n, state):
+        tailer.poll()
+        # `seq` is None until the browser shows a list of lines, even an empty
+        # one, as there is nothing to prepend to before
+        first = state["seq"] is None
+        lines, reset = tailer.lines_since(-1 if first else state["seq"])
+
+        if reset or first:
+            if not lines and not tailer.path.exists():
+                return f"No logfile at {tailer.path}", {"seq": None, "count": 0}
+            children = [log_line_p(ln) for ln in reversed(lines)]
+            return children, {"seq": tailer.last_seq, "count": len(children)}
+
+        if not lines:
+            return no_update, no_update
+
+        patch = Patch()
+        for ln in lines:
+            patch.prepend(log_line_p(ln))
+        count = state["count"] + len(lines)
+        for _ in range(max(0, count - tailer.max_lines)):
+            del patch[-1]
+
+        return patch, {"seq": lines[-1].seq, "count": min(count, tailer.max_lines)}
+
+    return app
+
+
+def module_state_class(module: ControlRoomModuleConnection) -> str:
+    """The css class of a module's check box in the header"""
+    # the up state is kept current by the HealthMonitor, a module which
+    # missed its last heartbeat is considered down
+    if module.health.restarting:
+        return "module_check_box restarting_module_check_box"
+    if module.health.is_up:
+        return "module_check_box running_module_check_box"
+    return "module_check_box"
+
+
+def content_hash(content: Any) -> str:
+    """Short hash of the json representation, e.g. of a callback's outputs"""
+    encoded = json.dumps(content, cls=PlotlyJSONEncoder, sort_keys=True)
+    return hashlib.blake2b(encoded.encode(), digest_size=8).hexdigest()
+
+
+def add_module_state_update(
+    app: Dash, modules: list[ControlRoomModuleConnection]
+) -> Dash:
+    """Refresh the check boxes of the modules, only if a state changed"""
+    mod_outputs = [Output(f"{m.name}_check_box", "className") for m in modules]
+
+    @app.callback(
+        output=mod_outputs + [Output("module_state_hash", "data")],
+        inputs=[Input("interval_modules", "n_intervals")],
+        state=[State("module_state_hash", "data")],
+    )
+    def update_module_states(n, last_hash):
+        mod_class_names = [module_state_class(m) for m in modules]
+        h = content_hash(mod_class_names)
+        if h == last_hash:
+            return [no_update] * (len(modules) + 1)
+        return mod_class_names + [h]
+
+    return app
+
+
+def add_lsl_streams_update(
+    app: Dash,
+    lsl_discovery: StreamDiscovery | None = None,
+    lsl_monitor: StreamMonitor | None = None,
+) -> Dash:
+    """Refresh the options of the LSL stream list, only if they changed"""
+
+    @app.callback(
+        Output("lsl_streams_select", "options"),
+        Output("lsl_streams_hash", "data"),
+        Input("interval_streams", "n_intervals"),
+        State("lsl_streams_hash", "data"),
     )
-    def print_setting(n):
-        lsl_stream_msg = [html.P("> " + s.name()) for s in pylsl.resolve_streams()]
-
-        # there is far mre officient ways of reading tail
-        # but for now this is sufficient (500us at 100k)
-        if logfile.exists():
-            # The version with paragraphs to a list failed - stop it for now
-            # as it would only add color to the GUI
-            log_str_msg = []
-
-            with open(logfile, "r") as logf:
-                # logger.debug("Trying to add colored log")
-                lines = logf.readlines()[-25:]
-                for logline in lines:
-                    llevel = re.search(r"(DEBUG|INFO|WARNING|ERROR)", logline)
-                    log_level = llevel.group(1) if llevel else "DEBUG"
-
-                    # log_level is used for coloring with css, use DEBUG as default
-                    log_str_msg.append(html.P(logline, className=f"{log_level}"))
-
-            log_str_msg = log_str_msg[::-1]
+    def update_lsl_streams(n, last_hash):
+        # the inventory is kept by the discovery service, nothing is resolved here
+        if lsl_discovery is None:
+            options = [
+                {
+                    "label": "LSL stream discovery is not running",
+                    "value": "",
+                    "disabled": True,
+                }
+            ]
         else:
-            log_str_msg = f"No logfile at {logfile}"
-
-        # check current up state - a module which does not reply to `UP` in
-        # time is considered down
-        classes = {
-            "success": "module_check_box running_module_check_box",
-            "fail": "module_check_box",
-        }
-        mod_class_names = [
-            classes["success"] if m.is_up() else classes["fail"] for m in modules
+            metrics = lsl_monitor.metrics() if lsl_monitor is not None else {}
+            options = [
+                lsl_stream_option(e, metrics.get(e.key, None))
+                for e in lsl_discovery.streams()
+            ]
+
+        h = content_hash(options)
+        if h == last_hash:
+            return no_update, no_update
+        return options, h
+
+    return app
+
+
+def lsl_stream_option(entry: StreamEntry, metrics: StreamMetrics | None) -> dict:
+    """An option of the LSL stream checklist, with the metrics if monitored"""
+    label = [html.Span(f"> {entry}")]
+    if metrics is not None:
+        label.append(html.Span(str(metrics), className="lsl_stream_metrics"))
+    return {"label": html.Span(label), "value": entry.key}
+
+
+def add_lsl_monitor_selection(app: Dash, lsl_monitor: StreamMonitor) -> Dash:
+    """Monitor the streams checked in the LSL tile"""
+
+    @app.callback(Input("lsl_streams_select", "value"))
+    def select_streams(keys):
+        # only recorded, the inlets are opened by the monitor's thread
+        lsl_monitor.select([k for k in keys or [] if k])
+
+    return app
+
+
+def envelope_figure(t: np.ndarray, env: np.ndarray) -> dict:
+    """
+    Min/max envelopes of the channels, stacked with a unit offset each.
+
+    Each channel is scaled to its range within the window, the min and max
+    of every bin are drawn as a vertical stroke of a single line trace.
+    """
+    lo, hi = env[:, :, 0].min(axis=0), env[:, :, 1].max(axis=0)
+    scale = np.where(hi > lo, hi - lo, 1)
+    # (n_channels, 2 * n_bins) with min and max interleaved per bin
+    y = (env - lo[None, :, None]) / scale[None, :, None] * 0.8
+    y = y.transpose(1, 0, 2).reshape(env.shape[1], -1)
+    y = y - np.arange(env.shape[1])[:, None]
+    x = np.repeat(t, 2).round(3).tolist()
+
+    return {
+        "data": [
+            {
+                "x": x,
+                "y": yc.round(3).tolist(),
+                "mode": "lines",
+                "line": {"width": 1, "color": "#5999ff"},
+                "hoverinfo": "skip",
+            }
+            for yc in y
+        ],
+        "layout": {
+            "margin": {"l": 0, "r": 0, "t": 0, "b": 15},
+            "height": 20 + 15 * env.shape[1],
+            "showlegend": False,
+            "paper_bgcolor": "rgba(0,0,0,0)",
+            "plot_bgcolor": "rgba(0,0,0,0)",
+            "font": {"size": 9, "color": "#aaaaaa"},
+            "xaxis": {"fixedrange": True, "ticksuffix": "s"},
+            "yaxis": {"visible": False, "fixedrange": True},
+        },
+    }
+
+
+def add_lsl_preview_update(app: Dash, previews: StreamPreviews) -> Dash:
+    """Plot the decimated previews of the selected streams, only if they changed"""
+
+    @app.callback(
+        Output("lsl_previews", "children"),
+        Output("lsl_previews_hash", "data"),
+        Input("interval_preview", "n_intervals"),
+        State("lsl_streams_select", "value"),
+        State("lsl_previews_hash", "data"),
+    )
+    def update_previews(n, keys, last_hash):
+        graphs = []
+        for key in keys or []:
+            preview = previews.preview(key)
+            if preview is None or len(preview[0]) == 0:
+                continue
+            stream = previews.monitor.streams.get(key, None)
+            graphs += [
+                html.Div(
+                    stream.entry.name if stream else key, className="preview_label"
+                ),
+                dcc.Graph(
+                    figure=envelope_figure(*preview),
+                    className="lsl_preview",
+                    config={"displayModeBar": False, "staticPlot": True},
+                ),
+            ]
+
+        h = content_hash(graphs)
+        if h == last_hash:
+            return no_update, no_update
+        return graphs, h
+
+    return app
+
+
+def quality_heatmap(rows: list[tuple[str, Any]]) -> dict:
+    """
+    Heatmap of the quality scores, one row per stream and metric.
+
+    `rows` are the stream names and their QualityReports. Streams with fewer
+    channels are padded with gaps.
+    """
+    n_ch = max((r.values.shape[1] for _, r in rows), default=0)
+    z, text, labels = [], [], []
+    for name, report in rows:
+        scores = report.scores
+        pad = [None] * (n_ch - scores.shape[1])
+        for i, metric in enumerate(QUALITY_METRICS):
+            labels.append(f"{name} {metric}")
+            z.append(scores[i].round(3).tolist() + pad)
+            text.append([f"{v:.3g}" for v in report.values[i]] + pad)
+
+    return {
+        "data": [
+            {
+                "type": "heatmap",
+                "z": z,
+                "y": labels,
+                "text": text,
+                "hovertemplate": "ch %{x}: %{text}<extra>%{y}</extra>",
+                "zmin": 0,
+                "zmax": 1,
+                "colorscale": [[0, "#2af985"], [0.5, "#ffd166"], [1, "#ef476f"]],
+                "showscale": False,
+                "xgap": 1,
+                "ygap": 1,
+            }
+        ],
+        "layout": {
+            "margin": {"l": 160, "r": 0, "t": 0, "b": 20},
+            "height": 40 + 15 * len(labels),
+            "paper_bgcolor": "rgba(0,0,0,0)",
+            "plot_bgcolor": "rgba(0,0,0,0)",
+            "font": {"size": 9, "color": "#aaaaaa"},
+            "yaxis": {"autorange": "reversed", "fixedrange": True},
+            "xaxis": {"fixedrange": True},
+        },
+    }
+
+
+def add_signal_quality_update(app: Dash, checker: SignalQualityChecker) -> Dash:
+    """Refresh the quality heatmap from the checker's latest reports, if changed"""
+
+    @app.callback(
+        Output("signal_quality_graph", "figure"),
+        Output("signal_quality_hash", "data"),
+        Input("interval_3s", "n_intervals"),
+        State("signal_quality_hash", "data"),
+    )
+    def update_signal_quality(n, last_hash):
+        streams = checker.monitor.streams
+        rows = [
+            (streams[k].entry.name, r)
+            for k, r in list(checker.reports.items())
+            if k in streams
+        ]
+        figure = quality_heatmap(rows)
+
+        h = content_hash(figure)
+        if h == last_hash:
+            return no_update, no_update
+        return figure, h
+
+    return app
+
+
+def sparkline_figure(cpu: list[float], rss: list[float]) -> dict:
+    """A minimal figure of the cpu (left axis) and memory (right axis) history."""
+    hidden = {"visible": False, "fixedrange": True}
+    return {
+        "data": [
+            {"y": cpu, "mode": "lines", "line": {"width": 1, "color": "#2af985"}},
+            {
+                "y": rss,
+                "mode": "lines",
+                "yaxis": "y2",
+                "line": {"width": 1, "color": "#5999ff"},
+            },
+        ],
+        "layout": {
+            "margin": {"l": 0, "r": 0, "t": 0, "b": 0},
+            "height": 40,
+            "showlegend": False,
+            "paper_bgcolor": "rgba(0,0,0,0)",
+            "plot_bgcolor": "rgba(0,0,0,0)",
+            "xaxis": hidden,
+            "yaxis": hidden | {"rangemode": "tozero"},
+            "yaxis2": hidden | {"overlaying": "y", "rangemode": "tozero"},
+        },
+    }
+
+
+def add_telemetry_update(
+    app: Dash, modules: list[ControlRoomModuleConnection], telemetry: Any
+) -> Dash:
+    """Refresh the telemetry sparklines from `telemetry.snapshot()`, if changed"""
+    outputs = []
+    for m in modules:
+        outputs += [
+            Output(f"{m.name}_telemetry_graph", "figure"),
+            Output(f"{m.name}_telemetry_text", "children"),
         ]
 
-        return [lsl_stream_msg, log_str_msg] + mod_class_names
+    @app.callback(
+        outputs + [Output("telemetry_hash", "data")],
+        Input("interval_3s", "n_intervals"),
+        State("telemetry_hash", "data"),
+    )
+    def update_telemetry(n, last_hash):
+        snapshot = telemetry.snapshot(last_n=120)
+        ret = []
+        for m in modules:
+            hist = snapshot.get(m.name, None)
+            if not hist or not hist["t"]:
+                ret += [sparkline_figure([], []), "no process"]
+                continue
+            ret += [
+                sparkline_figure(hist["cpu_percent"], hist["rss_mb"]),
+                f"{hist['cpu_percent'][-1]:.0f}% cpu | {hist['rss_mb'][-1]:.0f} MB"
+                f" | {hist['num_threads'][-1]:.0f} threads",
+            ]
+
+        h = content_hash(ret)
+        if h == last_hash:
+            return [no_update] * (len(outputs) + 1)
+        return ret + [h]
 
     return app
 
@@ -0,0 +1,128 @@
+# Fan-out of GUI updates to all connected browsers via server-sent events
+import json
+import queue
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+from plotly.utils import PlotlyJSONEncoder
+
+from control_room.utils.logging import logger
+
+
+def format_sse(event: str, data: dict) -> str:
+    # PlotlyJSONEncoder also serializes dash components, e.g. in labels
+    return f"event: {event}\ndata: {json.dumps(data, cls=PlotlyJSONEncoder)}\n\n"
+
+
+@dataclass
+class EventClient:
+    """The queue of encoded events of a single browser connection."""
+
+    messages: queue.Queue = field(default_factory=lambda: queue.Queue(maxsize=256))
+    dropped: bool = False
+
+
+@dataclass
+class EventHub:
+    """
+    Publish GUI updates once and fan them out to all clients.
+
+    Each event is encoded once in `publish`, clients only receive the
+    encoded string. For events describing a state, the latest state is
+    kept and sent to clients when they connect, so they start from a
+    complete picture and only receive deltas afterwards.
+
+    Clients which do not keep up are dropped. They reconnect and start
+    from the latest state again.
+
+    Attributes
+    ----------
+    max_clients : int
+        Maximum number of simultaneous connections. Each connection occupies
+        a worker thread of the server.
+    heartbeat_s : float
+        Time after which a comment is sent on an idle connection.
+    max_age_s : float
+        Time after which a connection is closed, the browser reconnects
+        right away. This frees server workers of abandoned connections.
+    """
+
+    max_clients: int = 4
+    heartbeat_s: float = 15.0
+    max_age_s: float = 300.0
+
+    _clients: list[EventClient] = field(default_factory=list, repr=False)
+    _states: dict[str, str] = field(default_factory=dict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def n_clients(self) -> int:
+        return len(self._clients)
+
+    def publish(self, event: str, data: dict, state: dict | None = None):
+        """
+        Send an event to all clients.
+
+        Parameters
+        ----------
+        event : str
+            Name of the event.
+        data : dict
+            Payload sent to the connected clients.
+        state : dict | None
+            The full state after this event, sent as `event` to clients
+            connecting later. If None, the event is not replayed.
+        """
+        msg = format_sse(event, data)
+        with self._lock:
+            if state is not None:
+                self._states[event] = msg if state is data else format_sse(event, state)
+            for client in list(self._clients):
+                try:
+                    client.messages.put_nowait(msg)
+                except queue.Full:
+                    logger.warning("Dropping a GUI event client which fell behind")
+                    client.dropped = True
+                    self._clients.remove(client)
+
+    def subscribe(self) -> EventClient | None:
+        """A new client starting with the latest states, None if too many."""
+        with self._lock:
+            if len(self._clients) >= self.max_clients:
+                return None
+            client = EventClient()
+            for msg in self._states.values():
+                client.messages.put_nowait(msg)
+            self._clients.append(client)
+            return client
+
+    def unsubscribe(self, client: EventClient):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def close(self):
+        """End all streams, e.g. on shutdown."""
+        with self._lock:
+            for client in self._clients:
+                client.dropped = True
+                try:
+                    client.messages.put_nowait(": closing\n\n")  # wakes it up
+                except queue.Full:
+                    pass
+            self._clients.clear()
+
+    def stream(self, client: EventClient) -> Iterator[str]:
+        """The encoded events for a client, until `max_age_s` passed."""
+        tstart = time.monotonic()
+        try:
+            yield "retry: 2000\n\n"
+            while not client.dropped and time.monotonic() - tstart < self.max_age_s:
+                try:
+                    yield client.messages.get(timeout=self.heartbeat_s)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe(client)
@@ -0,0 +1,46 @@
+# Ids of components which are addressed by pattern-matching callbacks. The
+# parts can also be MATCH or ALL to build the patterns.
+from typing import Any
+
+
+def pcomm_input_id(mod_name: Any, pcomm_name: Any) -> dict:
+    return {"type": "pcomm_input", "module": mod_name, "pcomm": pcomm_name}
+
+
+def macro_input_id(macro_name: Any) -> dict:
+    return {"type": "macro_input", "macro": macro_name}
+
+
+def pcomm_button_id(mod_name: Any, pcomm_name: Any) -> dict:
+    return {"type": "pcomm", "module": mod_name, "pcomm": pcomm_name}
+
+
+def pcomm_sent_id(mod_name: Any, pcomm_name: Any) -> dict:
+    # hidden, holds the last message sent by the pcomm's button
+    return {"type": "pcomm_sent", "module": mod_name, "pcomm": pcomm_name}
+
+
+def pcomm_latency_id(mod_name: Any, pcomm_name: Any) -> dict:
+    # shows the round-trip latency of the pcomm
+    return {"type": "pcomm_latency", "module": mod_name, "pcomm": pcomm_name}
+
+
+def macro_button_id(macro_name: Any) -> dict:
+    return {"type": "macro", "macro": macro_name}
+
+
+def macro_sent_id(macro_name: Any) -> dict:
+    return {"type": "macro_sent", "macro": macro_name}
+
+
+def macro_control_id(run_id: Any, action: Any) -> dict:
+    # pauses, resumes or cancels a run of a macro or protocol
+    return {"type": "macro_control", "run": run_id, "action": action}
+
+
+def protocol_button_id(protocol_name: Any) -> dict:
+    return {"type": "protocol", "protocol": protocol_name}
+
+
+def protocol_sent_id(protocol_name: Any) -> dict:
+    return {"type": "protocol_sent", "protocol": protocol_name}
@@ -3,14 +3,31 @@ import json
 from dash import dcc, html
 
 from control_room.callbacks import is_ao_module
+from control_room.gui.ids import (
+    macro_button_id,
+    macro_input_id,
+    macro_sent_id,
+    pcomm_button_id,
+    pcomm_input_id,
+    pcomm_latency_id,
+    pcomm_sent_id,
+    protocol_button_id,
+    protocol_sent_id,
+)
 
 # from control_room.utils.logging import logger
 from control_room.utils.logserver import logfile as log_file_path
 from control_room.utils.modules import ControlRoomModuleConnection
+from control_room.utils.protocol import Protocol
+from control_room.utils.scheduling import describe_scheduling
 
 
 def get_layout(
-    modules: list[ControlRoomModuleConnection], macros: dict | None
+    modules: list[ControlRoomModuleConnection],
+    macros: dict | None,
+    telemetry: bool = False,
+    signal_quality: bool = False,
+    protocols: dict[str, Protocol] | None = None,
 ) -> html.Div:
     """
     Generate the layout for the control room application.
@@ -27,6 +44,13 @@ def get_layout(
     macros : dict | None
         A dictionary containing macro definitions to be used in the application.
         If None, no macros are used.
+    telemetry : bool
+        If True, a tile with the resource usage of the modules is added.
+    signal_quality : bool
+        If True, a tile with the channel quality of the monitored LSL streams
+        is added.
+    protocols : dict[str, Protocol] | None
+        The protocols which can be started from the macro tile.
 
     Returns
     -------
@@ -35,7 +59,11 @@ def get_layout(
     """
     logfile = log_file_path.stem + log_file_path.suffix
 
-    module_tiles = [] if macros is None else [create_macro_tile(macros)]
+    module_tiles = (
+        [create_macro_tile(macros or {}, protocols)]
+        if macros is not None or protocols
+        else []
+    )
     module_tiles += [get_module_tile_layout(mod) for mod in modules]
 
     return html.Div(
@@ -54,6 +82,8 @@ def get_layout(
                         children=[create_module_server_info(m) for m in modules],
                         id="module_server_check_boxes",
                     ),
+                    # the last command sent from any browser, pushed by the server
+                    html.Div(id="last_command_div", className="last_command"),
                 ],
             ),
             html.Div(
@@ -65,8 +95,10 @@ def get_layout(
                         className="lsl_and_log",
                         children=[
                             get_lsl_streams_tile(),
-                            get_log_stream_tile(logfile),
-                        ],
+                        ]
+                        + ([get_signal_quality_tile()] if signal_quality else [])
+                        + [get_log_stream_tile(logfile)]
+                        + ([get_telemetry_tile(modules)] if telemetry else []),
                     ),
                     # right side
                     html.Div(
@@ -74,12 +106,23 @@ def get_layout(
                         className="module_tiles",
                         children=module_tiles,
                     ),
-                    # A timer for the log reading and the lsl fetch
+                    # A timer for the telemetry and signal quality
                     dcc.Interval(id="interval_3s", interval=3 * 1000, n_intervals=0),
+                    dcc.Store(id="pcomm_latency_hash"),
+                    # Polling of the module states, log and lsl streams, each
+                    # at its own cadence. Only used while no events are pushed
+                    # (see assets/events.js)
+                    dcc.Interval(id="interval_modules", interval=1000, n_intervals=0),
+                    dcc.Interval(id="interval_log", interval=2000, n_intervals=0),
+                    dcc.Interval(id="interval_streams", interval=3000, n_intervals=0),
+                    # hashes of the shown content, unchanged content is not sent
+                    dcc.Store(id="module_state_hash"),
+                    dcc.Store(id="lsl_streams_hash"),
+                    dcc.Store(id="lsl_previews_hash"),
+                    dcc.Store(id="signal_quality_hash"),
+                    dcc.Store(id="telemetry_hash"),
                 ],
             ),
-            html.Div(id="last_pcomm_sent_div", className="hidden_div"),
-            html.Div(id="last_macro_sent_div", className="hidden_div"),
         ],
     )
 
@@ -88,14 +131,20 @@ def create_module_server_info(module: ControlRoomModuleConnection) -> html.Div:
     # this will contain a parent box which is displayed in the header row
     # and some meta info text box, which is displayed only on hover
 
+    meta = [
+        html.Div(str(module)),
+        html.Div(describe_scheduling(module.scheduling_effective)),
+    ]
     return html.Div(
-        children=[html.Div(str(module), className="module_meta")],
+        children=[html.Div(meta, className="module_meta")],
         className="module_check_box",
         id=f"{module.name}_check_box",
     )
 
 
-def create_macro_tile(macros: dict) -> html.Div:
+def create_macro_tile(
+    macros: dict, protocols: dict[str, Protocol] | None = None
+) -> html.Div:
     """
     Create a tile containing buttons for each macro.
 
@@ -109,6 +158,8 @@ def create_macro_tile(macros: dict) -> html.Div:
         A dictionary containing macro definitions. Each key-value pair in the dictionary
         represents a macro, where the key is the macro name and the value is a dictionary
         containing macro-specific configurations.
+    protocols : dict[str, Protocol] | None
+        The protocols, each gets a button starting it.
 
     Returns
     -------
@@ -130,8 +181,13 @@ def create_macro_tile(macros: dict) -> html.Div:
                     get_macro_button_input_pair(mc)
                     for k, mc in macros.items()
                     if k != "globals"
-                ],
+                ]
+                + [get_protocol_button(p) for p in (protocols or {}).values()],
             ),
+            # progress of the latest macro runs
+            html.Div(id="macro_runs"),
+            dcc.Interval(id="interval_macros", interval=1000, n_intervals=0),
+            dcc.Store(id="macro_runs_hash"),
         ],
     )
 
@@ -175,11 +231,32 @@ def get_macro_button_input_pair(mc: dict) -> html.Div:
         children=[
             html.Button(
                 f"{mc['name']}",
-                id=f"{mc['name']}|button",
+                id=macro_button_id(mc["name"]),
                 className="pcomm_button",
                 n_clicks=0,
             ),
-            dcc.Textarea(id=f"{mc['name']}|input", value=default_input),
+            dcc.Textarea(id=macro_input_id(mc["name"]), value=default_input),
+            html.Div(id=macro_sent_id(mc["name"]), className="hidden_div"),
+        ],
+    )
+
+
+def get_protocol_button(protocol: Protocol) -> html.Div:
+    """A button starting a protocol, labeled with its length"""
+    return html.Div(
+        className="pcomm_button_input_row",
+        children=[
+            html.Button(
+                protocol.name,
+                id=protocol_button_id(protocol.name),
+                className="pcomm_button",
+                n_clicks=0,
+            ),
+            html.Div(
+                f"{len(protocol.events)} events, {protocol.duration_s:.1f}s",
+                className="protocol_info",
+            ),
+            html.Div(id=protocol_sent_id(protocol.name), className="hidden_div"),
         ],
     )
 
@@ -207,7 +284,41 @@ def get_lsl_streams_tile() -> html.Div:
                 ],
                 id="lsl_tile_header",
             ),
-            html.Div(id="lsl_streams_list"),
+            html.Div(
+                id="lsl_streams_list",
+                # selected streams are monitored, their metrics are shown in
+                # the labels
+                children=[dcc.Checklist(id="lsl_streams_select", options=[], value=[])],
+            ),
+            # decimated previews of the selected streams
+            html.Div(id="lsl_previews"),
+            dcc.Interval(id="interval_preview", interval=1000, n_intervals=0),
+        ],
+    )
+
+
+def get_signal_quality_tile() -> html.Div:
+    """
+    Create the tile showing the channel quality of the monitored LSL streams
+    """
+    return html.Div(
+        id="signal_quality_tile",
+        className="tile",
+        children=[
+            html.Div(
+                children=[
+                    html.Div(
+                        "Signal quality",
+                        id="signal_quality_title",
+                        className="tile_header",
+                    ),
+                ],
+                id="signal_quality_tile_header",
+            ),
+            dcc.Graph(
+                id="signal_quality_graph",
+                config={"displayModeBar": False},
+            ),
         ],
     )
 
@@ -236,6 +347,53 @@ def get_log_stream_tile(logfile_name: str) -> html.Div:
                 id="log_stream_tile_header",
             ),
             html.Div(id="logfile_data"),
+            # sequence number of the latest line and number of lines shown
+            dcc.Store(id="logfile_state", data={"seq": None, "count": 0}),
+        ],
+    )
+
+
+def get_telemetry_tile(modules: list[ControlRoomModuleConnection]) -> html.Div:
+    """
+    Create the tile showing the resource usage of each module as sparklines
+    """
+    return html.Div(
+        id="telemetry_tile",
+        className="tile",
+        children=[
+            html.Div(
+                children=[
+                    html.Div(
+                        "Telemetry",
+                        id="telemetry_title",
+                        className="tile_header",
+                    ),
+                ],
+                id="telemetry_tile_header",
+            ),
+            html.Div(
+                id="telemetry_list",
+                children=[
+                    html.Div(
+                        className="telemetry_row",
+                        children=[
+                            html.Div(
+                                [
+                                    html.Div(m.name, className="module_name"),
+                                    html.Div("", id=f"{m.name}_telemetry_text"),
+                                ],
+                                className="telemetry_label",
+                            ),
+                            dcc.Graph(
+                                id=f"{m.name}_telemetry_graph",
+                                className="sparkline",
+                                config={"displayModeBar": False, "staticPlot": True},
+                            ),
+                        ],
+                    )
+                    for m in modules
+                ],
+            ),
         ],
     )
 
@@ -284,14 +442,18 @@ def get_pcomm_button_input_pair(
         children=[
             html.Button(
                 f"{pcomm_name}",
-                id=f"{mod_name}|{pcomm_name}|button",
+                id=pcomm_button_id(mod_name, pcomm_name),
                 className="pcomm_button",
                 n_clicks=0,
             ),
             dcc.Textarea(
-                id=f"{mod_name}|{pcomm_name}|input",
+                id=pcomm_input_id(mod_name, pcomm_name),
                 className="module_input",
                 value=defaults,
             ),
+            html.Div(
+                id=pcomm_latency_id(mod_name, pcomm_name), className="pcomm_latency"
+            ),
+            html.Div(id=pcomm_sent_id(mod_name, pcomm_name), className="hidden_div"),
         ],
     )
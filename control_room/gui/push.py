@@ -0,0 +1,157 @@
+# Server side producer of the pushed GUI updates
+import threading
+import time
+from dataclasses import dataclass, field
+
+from control_room.gui.callbacks import (
+    content_hash,
+    log_line_p,
+    lsl_stream_option,
+    macro_runs_view,
+    module_state_class,
+)
+from control_room.gui.events import EventHub
+from control_room.utils.logging import logger
+from control_room.utils.logtail import LogTailer
+from control_room.utils.lsl_discovery import StreamDiscovery
+from control_room.utils.lsl_monitor import StreamMonitor
+from control_room.utils.macros import MacroExecutor
+
+
+@dataclass
+class GuiEventSource:
+    """
+    Detect changes of the GUI state and publish them to the EventHub.
+
+    The state is evaluated once per `interval_s` for all browsers. Only
+    changes are published: modules whose state changed, new log lines and
+    the LSL stream options if the inventory changed and the progress of
+    macro runs. While streams are monitored, the options, which show the
+    stream metrics, are refreshed every `metrics_interval_s`.
+
+    Attributes
+    ----------
+    hub : EventHub
+        Fans the events out to the browsers.
+    modules : list
+        The module connections.
+    tailer : LogTailer
+        Provides the new lines of the log file.
+    lsl_discovery : StreamDiscovery | None
+        Provides the LSL stream inventory.
+    lsl_monitor : StreamMonitor | None
+        Provides the metrics of the selected streams.
+    macro_executor : MacroExecutor | None
+        Provides the progress of the macro runs.
+    interval_s : float
+        Time between two checks for changes.
+    metrics_interval_s : float
+        Time between two refreshes of the stream metrics.
+    """
+
+    hub: EventHub
+    modules: list
+    tailer: LogTailer
+    lsl_discovery: StreamDiscovery | None = None
+    lsl_monitor: StreamMonitor | None = None
+    macro_executor: MacroExecutor | None = None
+    interval_s: float = 0.2
+    metrics_interval_s: float = 1.0
+
+    _module_classes: dict[str, str] = field(default_factory=dict, repr=False)
+    _log_seq: int = field(default=-1, repr=False)
+    _lsl_version: int = field(default=-1, repr=False)
+    _lsl_hash: str | None = field(default=None, repr=False)
+    _last_metrics_t: float = field(default=0.0, repr=False)
+    _macros_hash: str | None = field(default=None, repr=False)
+    _stop_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="gui_events", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout_s: float = 3):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_s):
+            try:
+                self.update()
+            except Exception as e:
+                logger.error(f"Failed to publish GUI events: {e}")
+
+    def update(self):
+        self._update_modules()
+        self._update_log()
+        self._update_streams()
+        self._update_macros()
+
+    def _update_modules(self):
+        classes = {f"{m.name}_check_box": module_state_class(m) for m in self.modules}
+        changed = {k: v for k, v in classes.items() if self._module_classes.get(k) != v}
+        if changed:
+            self._module_classes = classes
+            self.hub.publish(
+                "modules", {"classes": changed}, state={"classes": classes}
+            )
+
+    def _update_log(self):
+        self.tailer.poll()
+        lines, reset = self.tailer.lines_since(self._log_seq)
+        if not lines:
+            return
+        self._log_seq = lines[-1].seq
+
+        kept, _ = self.tailer.lines_since(-1)
+        state = {
+            "reset": True,
+            "seq": self._log_seq,
+            "max_lines": self.tailer.max_lines,
+            "lines": [log_line_p(ln) for ln in reversed(kept)],
+        }
+        data = state | {
+            "reset": reset,
+            "lines": [log_line_p(ln) for ln in reversed(lines)],
+        }
+        self.hub.publish("log", data, state=state)
+
+    def _update_streams(self):
+        if self.lsl_discovery is None:
+            return
+        now = time.monotonic()
+        monitored = self.lsl_monitor is not None and self.lsl_monitor.streams
+        metrics_due = (
+            monitored and now - self._last_metrics_t >= self.metrics_interval_s
+        )
+        if self.lsl_discovery.version == self._lsl_version and not metrics_due:
+            return
+
+        self._lsl_version = self.lsl_discovery.version
+        self._last_metrics_t = now
+        metrics = self.lsl_monitor.metrics() if self.lsl_monitor is not None else {}
+        data = {
+            "options": [
+                lsl_stream_option(e, metrics.get(e.key, None))
+                for e in self.lsl_discovery.streams()
+            ]
+        }
+        h = content_hash(data)
+        if h != self._lsl_hash:
+            self._lsl_hash = h
+            self.hub.publish("streams", data, state=data)
+
+    def _update_macros(self):
+        if self.macro_executor is None:
+            return
+        data = {"runs": macro_runs_view(self.macro_executor.runs())}
+        h = content_hash(data)
+        if h != self._macros_hash:
+            self._macros_hash = h
+            self.hub.publish("macros", data, state=data)
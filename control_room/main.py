@@ -7,17 +7,36 @@ import time
 from pathlib import Path
 
 import psutil
-from dareplane_utils.module_handling.communication import SocketCommunicator
 from fire import Fire
 from waitress import wasyncore
 from waitress.server import create_server
 
-from control_room.callbacks import CallbackBroker
+from control_room.broker_process import BrokerProcess, RemoteTelemetry
+from control_room.callbacks import CallbackBroker, start_callback_broker
+from control_room.engine import AsyncModuleEngine, initialize_engine_modules
 from control_room.gui.app import build_app
+from control_room.gui.events import EventHub
+from control_room.gui.push import GuiEventSource
+from control_room.utils.config import (
+    check_and_transform_legacy_cfg,
+    get_module_dependencies,
+)
+from control_room.utils.health import HEARTBEAT_S, HealthMonitor
 from control_room.utils.logging import logger
+from control_room.utils.logserver import logfile as log_file_path
+from control_room.utils.logtail import LogTailer
+from control_room.utils.lsl_discovery import StreamDiscovery
+from control_room.utils.lsl_monitor import StreamMonitor
+from control_room.utils.lsl_preview import StreamPreviews
+from control_room.utils.macros import MacroExecutor
 from control_room.utils.modules import ControlRoomModuleConnection, initialize_modules
 from control_room.utils.network import wait_for_port
-from control_room.utils.config import check_and_transform_legacy_cfg
+from control_room.utils.protocol import get_protocols
+from control_room.utils.scheduling import apply_to_threads, get_control_room_profiles
+from control_room.utils.signal_quality import SignalQualityChecker
+from control_room.utils.startup import start_modules, stop_modules
+from control_room.utils.supervisor import ProcessSupervisor
+from control_room.utils.telemetry import TelemetrySampler
 
 # --- For backwards compatibility with python < 3.11
 try:
@@ -47,13 +66,18 @@ SETUP_CFG_PATH: str = "./configs/example_cfg.toml"
 
 def close_down_connections(mod_connections: list[ControlRoomModuleConnection]):
     """
-    Close all ControlRoomModuleConnection instances.
+    Close all ControlRoomModuleConnection instances, dependent modules first.
     """
-    for conn in mod_connections:
-        conn.stop()
+    stop_modules(mod_connections)
 
 
-def run_control_room(setup_cfg_path: str = SETUP_CFG_PATH):
+def run_control_room(
+    setup_cfg_path: str = SETUP_CFG_PATH,
+    broker_process: bool = False,
+    use_asyncio: bool = False,
+    heartbeat_s: float = HEARTBEAT_S,
+    telemetry_s: float = 1.0,
+):
     """
     Run the control room application with the given setup configuration.
 
@@ -65,13 +89,32 @@ def run_control_room(setup_cfg_path: str = SETUP_CFG_PATH):
     ----------
     setup_cfg_path : str, optional
         The path to the setup configuration file. Defaults to `setup_cfg_path`.
+    broker_process : bool, optional
+        If True, the module connections and the callback broker are hosted in a
+        dedicated child process, so callback routing is not affected by the
+        load of the GUI. The GUI then reaches the modules via the child.
+        Defaults to False.
+    use_asyncio : bool, optional
+        If True, the connections to all modules are served by a single asyncio
+        event loop (see `control_room.engine`), which also routes the callbacks.
+        Cannot be combined with `broker_process`. Defaults to False.
+    heartbeat_s : float, optional
+        Interval in which the HealthMonitor checks whether the modules are up.
+        Defaults to `HEARTBEAT_S`.
+    telemetry_s : float, optional
+        Interval in which the CPU, memory and IO usage of the module processes
+        is sampled. Set to 0 to disable the telemetry. Defaults to 1.0.
 
     """
+    if broker_process and use_asyncio:
+        raise ValueError("`broker_process` and `use_asyncio` cannot be combined")
 
     cfg_file = Path(setup_cfg_path).resolve()
     cfg = toml_load(cfg_file)
 
     cfg = check_and_transform_legacy_cfg(cfg)
+    get_module_dependencies(cfg)  # fail on cyclic dependencies before launching
+    protocols = get_protocols(cfg, cfg_file)
 
     log_server = psutil.Process(
         subprocess.Popen(
@@ -83,53 +126,120 @@ def run_control_room(setup_cfg_path: str = SETUP_CFG_PATH):
 
     logger.info(f"Opening control room with configuration: {setup_cfg_path}")
     shutdown_requested = threading.Event()
-
-    cbb_th: threading.Thread | None = None  # used in the finally
+    profiles = get_control_room_profiles(cfg)
+
+    cbb: CallbackBroker | None = None  # used in the finally
+    cbb_th: threading.Thread | None = None
+    broker_host: BrokerProcess | None = None
+    engine: AsyncModuleEngine | None = None
+    monitor: HealthMonitor | None = None
+    supervisor: ProcessSupervisor | None = None
+    sampler: TelemetrySampler | None = None
+    telemetry = None  # source of the telemetry shown in the GUI
+    lsl_discovery: StreamDiscovery | None = None
+    lsl_monitor: StreamMonitor | None = None
+    quality_checker: SignalQualityChecker | None = None
+    events: EventHub | None = None
+    gui_events: GuiEventSource | None = None
+    macro_executor: MacroExecutor | None = None
+    connections: list = []
 
     try:
-        connections = initialize_modules(cfg, cfg_file)
-
-        # start and connect to the modules
-        for conn in connections:
-            logger.debug(f"Launching and connecting to {conn.name=}")
-            conn.start()
-
-        time.sleep(2)  # give the servers a moment to start
-
-        # Get the pcomms for each module
-        for conn in connections:
-            conn.get_pcommands()
-
-        # hook up the callback broker
-        logger.debug("Starting CallbackBroker thread")
-        cbb_stop = threading.Event()
-        cbb_stop.clear()
-
-        # prepare the connection socket timeouts to be quicker
-        for c in connections:
-            if (
-                c.communicator
-                and isinstance(c.communicator, SocketCommunicator)
-                and c.communicator.socket_c
-            ):
-                c.communicator.socket_c.settimeout(0.001)
-
-        cbb = CallbackBroker(
-            mod_connections={c.name: c for c in connections},
-            stop_event=cbb_stop,
+        if broker_process:
+            broker_host = BrokerProcess(
+                cfg=cfg,
+                cfg_file=cfg_file,
+                heartbeat_s=heartbeat_s,
+                telemetry_s=telemetry_s,
+            )
+            connections = broker_host.start()
+            if telemetry_s > 0:
+                telemetry = RemoteTelemetry(host=broker_host)
+        elif use_asyncio:
+            engine = AsyncModuleEngine()
+            engine.start()
+            connections = initialize_engine_modules(cfg, cfg_file, engine)
+            engine.run(engine.start_modules(connections))
+            # applied once the modules are launched, so they do not inherit it
+            apply_to_threads(profiles["broker"], [engine.thread], "module engine")
+            monitor = HealthMonitor(
+                connections, broker=engine.broker, interval_s=heartbeat_s
+            )
+            monitor.start()
+            supervisor = ProcessSupervisor(connections, broker=engine.broker)
+            supervisor.start()
+        else:
+            connections = initialize_modules(cfg, cfg_file)
+            start_modules(connections)
+
+            # hook up the callback broker
+            cbb, cbb_th = start_callback_broker(connections)
+            monitor = HealthMonitor(connections, broker=cbb, interval_s=heartbeat_s)
+            monitor.start()
+            supervisor = ProcessSupervisor(connections, broker=cbb)
+            supervisor.start()
+            # started here, as the broker thread would create them lazily and
+            # they would inherit its profile
+            for c in connections:
+                c.outbound.start()
+            apply_to_threads(profiles["broker"], [cbb_th], "callback broker")
+
+        # the module processes are children of this process, unless they
+        # were launched by the broker process
+        if telemetry_s > 0 and broker_host is None:
+            sampler = TelemetrySampler(connections, interval_s=telemetry_s)
+            sampler.start()
+            telemetry = sampler
+
+        lsl_discovery = StreamDiscovery()
+        lsl_discovery.start()
+        lsl_monitor = StreamMonitor(lsl_discovery)
+        # registered before the first stream is opened
+        lsl_previews = StreamPreviews(lsl_monitor)
+        lsl_monitor.start()
+        quality_checker = SignalQualityChecker(
+            lsl_monitor, line_freq=cfg.get("control_room", {}).get("line_freq", 50.0)
         )
-        logger.info(
-            f"CallbackBroker has following modules connected: {list(cbb.mod_connections.keys())}"
+        quality_checker.start()
+
+        # macros are sent from their own thread, not the server's workers
+        macro_executor = MacroExecutor()
+        macro_executor.start()
+
+        # changes are computed once and pushed to all browsers
+        events = EventHub()
+        gui_events = GuiEventSource(
+            events,
+            connections,
+            LogTailer(log_file_path),
+            lsl_discovery=lsl_discovery,
+            lsl_monitor=lsl_monitor,
+            macro_executor=macro_executor,
         )
-        # daemon, so a hanging broker can never keep the interpreter alive
-        cbb_th = threading.Thread(target=cbb.listen_for_callbacks, daemon=True)
-        cbb_th.start()
+        gui_events.start()
 
         # Create the dash app
-        app = build_app(connections, macros=cfg.get("macros", None))
+        app = build_app(
+            connections,
+            macros=cfg.get("macros", None),
+            telemetry=telemetry,
+            lsl_discovery=lsl_discovery,
+            lsl_monitor=lsl_monitor,
+            signal_quality=quality_checker,
+            lsl_previews=lsl_previews,
+            events=events,
+            macro_executor=macro_executor,
+            protocols=protocols,
+        )
 
         logger.info("Serving control room on port 8050")
-        server = create_server(app.server, port=8050)
+        # every connected event stream occupies a worker thread
+        server = create_server(app.server, port=8050, threads=4 + events.max_clients)
+        apply_to_threads(
+            profiles["gui"],
+            [t for t in threading.enumerate() if t.name.startswith("waitress-")],
+            "waitress workers",
+        )
 
         def on_shutdown(*args):
             """Request shutdown from within a signal handler.
@@ -183,11 +293,40 @@ def run_control_room(setup_cfg_path: str = SETUP_CFG_PATH):
     finally:
         logger.info("Shutting down control room...")
 
-        if cbb_th:
+        # stopped first, the modules are not to be restarted during shutdown
+        if supervisor:
+            logger.debug("Stopping process supervisor")
+            supervisor.stop()
+
+        if sampler:
+            sampler.stop()
+
+        if gui_events:
+            gui_events.stop()
+
+        if macro_executor:
+            macro_executor.stop()
+
+        if events:
+            events.close()
+
+        if quality_checker:
+            quality_checker.stop()
+
+        if lsl_monitor:
+            lsl_monitor.stop()
+
+        if lsl_discovery:
+            lsl_discovery.stop()
+
+        if monitor:
+            logger.debug("Stopping health monitor")
+            monitor.stop()
+
+        if cbb and cbb_th:
             try:
                 logger.debug("Stopping callback broker")
-                if cbb_stop:
-                    cbb_stop.set()
+                cbb.stop()
                 cbb_th.join(timeout=3)
             except Exception as e:
                 logger.error(f"Error while stopping CallbackBroker: {e}")
@@ -198,6 +337,17 @@ def run_control_room(setup_cfg_path: str = SETUP_CFG_PATH):
         except Exception as e:
             logger.error(f"Error while closing down connections: {e}")
 
+        if engine:
+            logger.debug("Stopping module engine")
+            engine.stop()
+
+        if broker_host:
+            logger.debug("Stopping broker process")
+            try:
+                broker_host.stop()
+            except Exception as e:
+                logger.error(f"Error while stopping the broker process: {e}")
+
         logger.debug("Terminating log server")
         time.sleep(1)  # give some time to process remaining logs
 
@@ -29,7 +29,10 @@ def check_and_transform_legacy_cfg(cfg: dict):
     exe_cfgs = cfg.get("exe", None)
     warned: bool = False
 
-    new_cfg: dict = {"modules": {}}
+    # keep everything which is not part of the legacy convention, e.g. modules
+    # which are already configured as [modules.<name>]
+    new_cfg: dict = {k: v for k, v in cfg.items() if k not in ["python", "exe"]}
+    new_cfg["modules"] = dict(cfg.get("modules", {}))
     for per_type_cfgs in [exe_cfgs, python_cfgs]:
         if per_type_cfgs is None:
             continue
@@ -56,12 +59,92 @@ def check_and_transform_legacy_cfg(cfg: dict):
         if modules_root:
             new_cfg["modules"]["modules_root"] = modules_root
 
-    if "macros" in cfg.keys():
-        new_cfg["macros"] = cfg["macros"]
-
     return new_cfg
 
 
+def dependency_layers(dependencies: dict[str, list[str]]) -> list[list[str]]:
+    """
+    Sort modules into layers, where each module only depends on modules of
+    previous layers.
+
+    Parameters
+    ----------
+    dependencies : dict[str, list[str]]
+        The names of the modules each module depends on.
+
+    Returns
+    -------
+    list[list[str]]
+        The layers in order of startup. Within a layer, the modules keep the
+        order of `dependencies`.
+
+    Raises
+    ------
+    ValueError
+        If a module depends on an unknown module or the dependencies are cyclic.
+    """
+    for name, deps in dependencies.items():
+        unknown = [d for d in deps if d not in dependencies]
+        if unknown:
+            raise ValueError(
+                f"Module {name!r} depends on unknown module(s) {unknown}. "
+                f"Known modules: {list(dependencies)}"
+            )
+
+    layers: list[list[str]] = []
+    placed: set[str] = set()
+    remaining = list(dependencies)
+    while remaining:
+        layer = [n for n in remaining if all(d in placed for d in dependencies[n])]
+        if not layer:
+            raise ValueError(
+                f"Cyclic dependency between modules: {_find_cycle(dependencies, remaining)}"
+            )
+        layers.append(layer)
+        placed.update(layer)
+        remaining = [n for n in remaining if n not in placed]
+
+    return layers
+
+
+def _find_cycle(dependencies: dict[str, list[str]], candidates: list[str]) -> str:
+    # every remaining module has a remaining dependency, so following them
+    # must eventually revisit a module
+    path = [candidates[0]]
+    while True:
+        nxt = next(d for d in dependencies[path[-1]] if d in candidates)
+        if nxt in path:
+            cycle = path[path.index(nxt) :] + [nxt]
+            return " -> ".join(cycle)
+        path.append(nxt)
+
+
+def get_module_dependencies(cfg: dict) -> dict[str, list[str]]:
+    """
+    Collect the `depends_on` list of each `[modules.<name>]` block.
+
+    The dependencies are validated, i.e. unknown modules and cycles raise
+    a ValueError already when the config is loaded.
+    """
+    modules_cfg = cfg.get("modules", {})
+    dependencies: dict[str, list[str]] = {}
+    for name, module_cfg in modules_cfg.items():
+        if not isinstance(module_cfg, dict):
+            continue  # e.g. modules_root
+        deps = module_cfg.get("depends_on", [])
+        if isinstance(deps, str):
+            deps = [deps]
+        if not isinstance(deps, list):
+            raise TypeError(
+                f"'depends_on' of modules.{name} must be a list of module names, got {deps!r}"
+            )
+        dependencies[name] = [str(d) for d in deps]
+
+    dependency_layers(dependencies)
+
+    return dependencies
+
+
 if __name__ == "__main__":
     cfg_file = Path("./tests/resources/test_legacy_cfg.toml").resolve()
     cfg = toml_load(cfg_file)
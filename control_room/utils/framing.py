@@ -0,0 +1,124 @@
+# Incremental reassembly of `;` terminated messages from a TCP byte stream
+from dataclasses import dataclass, field
+
+from control_room.utils.logging import logger
+
+
+@dataclass
+class FrameParser:
+    """
+    Split a byte stream into frames terminated by `delimiter`.
+
+    TCP provides a byte stream without message boundaries, so a single `recv`
+    can return a partial frame or several frames at once. Data is accumulated
+    in a persistent buffer and every complete frame is returned in order,
+    an incomplete trailing fragment is kept until the rest of it arrives.
+
+    Attributes
+    ----------
+    delimiter : bytes
+        The byte sequence terminating a single frame. Default is b";".
+    max_buffer_size : int
+        Maximum number of bytes kept for an incomplete frame. If exceeded, the
+        buffer is discarded, as it can no longer be a sensible message.
+    ack : bytes
+        Reply which is sent without a delimiter, i.e. the `1` acknowledging
+        `UP`. Repetitions of it at the start of a frame are removed and
+        counted, see `take_acks`. A frame consisting only of it, e.g. `1;`,
+        keeps one, as it is a terminated reply.
+    name : str
+        Name used for log messages, usually the module's name.
+    """
+
+    delimiter: bytes = b";"
+    max_buffer_size: int = 2**16
+    ack: bytes = b"1"
+    name: str = ""
+
+    buffer: bytearray = field(default_factory=bytearray, repr=False)
+    # offset up to which the buffer is known to not contain a delimiter
+    _scan_from: int = field(default=0, repr=False)
+    _n_acks: int = field(default=0, repr=False)
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        Add data to the buffer and return all frames completed by it.
+
+        Parameters
+        ----------
+        data : bytes
+            The data as read from the socket.
+
+        Returns
+        -------
+        list[bytes]
+            The complete frames without the delimiter, in order of arrival.
+        """
+        if not data:
+            return []
+
+        buf = self.buffer
+        # acks are only recognized at the start of a frame
+        at_boundary = not buf
+        buf += data
+
+        frames = []
+        start = 0
+        dlen = len(self.delimiter)
+        end = buf.find(self.delimiter, max(self._scan_from - dlen + 1, 0))
+        if end != -1:
+            # a single copy per frame - slicing the memoryview is free
+            with memoryview(buf) as mv:
+                while end != -1:
+                    frame = bytes(mv[start:end])
+                    if frames or at_boundary:
+                        frame = self._strip_acks(frame)
+                    frames.append(frame)
+                    start = end + dlen
+                    end = buf.find(self.delimiter, start)
+            del buf[:start]
+
+        if frames or at_boundary:
+            # unterminated data at the start of a frame, e.g. `1` or `1B|`
+            n = len(buf) - len(buf.lstrip(self.ack))
+            self._n_acks += n // len(self.ack)
+            del buf[:n]
+
+        self._scan_from = len(buf)
+
+        if len(buf) > self.max_buffer_size:
+            logger.error(
+                f"Discarding {len(buf)} bytes from {self.name} without a "
+                f"{self.delimiter!r} terminator"
+            )
+            self.clear()
+
+        return frames
+
+    def _strip_acks(self, frame: bytes) -> bytes:
+        stripped = frame.lstrip(self.ack)
+        if not stripped and frame:
+            stripped = self.ack  # e.g. `1;`, a reply rather than an ack
+        self._n_acks += (len(frame) - len(stripped)) // len(self.ack)
+        return stripped
+
+    def take_acks(self) -> int:
+        """Return and reset the number of acks consumed since the last call."""
+        n, self._n_acks = self._n_acks, 0
+        return n
+
+    def take_unterminated(self) -> bytes:
+        """
+        Remove and return data which is not (yet) terminated.
+
+        Used for replies which are known to be sent without a delimiter, such
+        as the one to `GET_PCOMMS`, while they are awaited. Otherwise, they
+        would be joined with the next frame.
+        """
+        data = bytes(self.buffer)
+        self.clear()
+        return data
+
+    def clear(self):
+        self.buffer.clear()
+        self._scan_from = 0
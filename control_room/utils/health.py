@@ -0,0 +1,158 @@
+# Background liveness checks of all modules with a cached state per module
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from control_room.utils.logging import logger
+
+# time between two heartbeats
+HEARTBEAT_S: float = 1.0
+
+
+@dataclass
+class ModuleHealth:
+    """
+    Cached liveness state of a module, as updated by the HealthMonitor.
+
+    Attributes
+    ----------
+    name : str
+        Name of the module.
+    last_ack : float
+        Time (`time.time`) of the last acknowledged heartbeat, 0 if none yet.
+    rtt_s : float | None
+        Round trip time of the last acknowledged heartbeat.
+    consecutive_misses : int
+        Number of heartbeats in a row, which were not acknowledged in time.
+    last_check : float
+        Time (`time.time`) of the last completed heartbeat.
+    restarting : bool
+        True while the ProcessSupervisor is restarting the module.
+    restarts : int
+        Number of times the module's process was restarted.
+    """
+
+    name: str
+    last_ack: float = 0.0
+    rtt_s: float | None = None
+    consecutive_misses: int = 0
+    last_check: float = 0.0
+    restarting: bool = False
+    restarts: int = 0
+
+    @property
+    def is_up(self) -> bool:
+        return self.last_ack > 0 and self.consecutive_misses == 0
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class HealthMonitor:
+    """
+    Heartbeat all modules from a single background thread.
+
+    An `UP` is queued for every module at once, the acknowledgements are
+    recorded by the CallbackBroker, which reads the modules' sockets anyway.
+    The results are kept in the `health` record of each connection, so e.g.
+    the GUI can read the state without talking to the modules.
+
+    Attributes
+    ----------
+    connections : list
+        The module connections to monitor.
+    broker : Any
+        The running CallbackBroker recording the acknowledgements.
+    interval_s : float
+        Time between the start of two heartbeats.
+    timeout_s : float
+        Time a module has to acknowledge a heartbeat. Capped at `interval_s`.
+    """
+
+    connections: list
+    broker: Any
+    interval_s: float = HEARTBEAT_S
+    timeout_s: float = 0.5
+
+    _stop_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    @property
+    def table(self) -> dict[str, ModuleHealth]:
+        return {c.name: c.health for c in self.connections}
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="health_monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout_s: float = 3):
+        self._stop_event.set()
+        with self.broker.up_ack_cond:
+            self.broker.up_ack_cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            tstart = time.monotonic()
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Health check failed: {e}")
+            self._stop_event.wait(max(0, self.interval_s - (time.monotonic() - tstart)))
+
+    def heartbeat(self):
+        """Send `UP` to all modules and wait for the acknowledgements."""
+        pending = {}
+        for conn in self.connections:
+            if not conn.heartbeat:
+                # e.g. connection only modules, which do not answer `UP`
+                conn.health.last_ack = conn.health.last_check = time.time()
+                continue
+            if conn.health.restarting:
+                # the supervisor probes the module itself
+                continue
+            sent_at = time.time()
+            try:
+                if conn.enqueue_message(b"UP"):
+                    pending[conn.name] = (conn, sent_at)
+                else:
+                    self._record_miss(conn)
+            except Exception as e:
+                logger.debug(f"Cannot send heartbeat to {conn.name}: {e}")
+                self._record_miss(conn)
+
+        deadline = time.monotonic() + min(self.timeout_s, self.interval_s)
+
+        def acked() -> bool:
+            return all(c.last_up_ack >= t for c, t in pending.values())
+
+        with self.broker.up_ack_cond:
+            while not acked() and not self._stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.broker.up_ack_cond.wait(remaining)
+
+        for conn, sent_at in pending.values():
+            if conn.last_up_ack >= sent_at:
+                health = conn.health
+                health.last_ack = conn.last_up_ack
+                health.rtt_s = conn.last_up_ack - sent_at
+                health.consecutive_misses = 0
+                health.last_check = time.time()
+            else:
+                self._record_miss(conn)
+
+    def _record_miss(self, conn):
+        health = conn.health
+        if health.consecutive_misses == 0 and health.last_ack > 0:
+            logger.warning(f"Module {conn.name} missed a heartbeat")
+        health.consecutive_misses += 1
+        health.last_check = time.time()
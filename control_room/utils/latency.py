@@ -0,0 +1,172 @@
+# Round-trip latencies of the commands sent to a module
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# edges of the latency histograms, log spaced from 10us to 100s
+LATENCY_EDGES_S: np.ndarray = np.logspace(-5, 2, 7 * 20 + 1)
+
+
+@dataclass
+class LatencyHistogram:
+    """
+    Counts of latencies in log spaced bins.
+
+    The quantiles are estimated from the bins, with a resolution of ~12%
+    of the value, in constant memory regardless of the number of samples.
+    """
+
+    counts: np.ndarray = field(
+        default_factory=lambda: np.zeros(len(LATENCY_EDGES_S) + 1, dtype=np.int64)
+    )
+
+    @property
+    def n(self) -> int:
+        return int(self.counts.sum())
+
+    def add(self, latency_s: float):
+        # index 0 and -1 collect the values outside of the edges
+        self.counts[np.searchsorted(LATENCY_EDGES_S, latency_s, side="right")] += 1
+
+    def quantile(self, q: float) -> float | None:
+        """The geometric center of the bin containing the `q` quantile."""
+        n = self.n
+        if n == 0:
+            return None
+        i = int(np.searchsorted(np.cumsum(self.counts), q * n, side="left"))
+        if i == 0:
+            return float(LATENCY_EDGES_S[0])
+        if i == len(LATENCY_EDGES_S):
+            return float(LATENCY_EDGES_S[-1])
+        return float(np.sqrt(LATENCY_EDGES_S[i - 1] * LATENCY_EDGES_S[i]))
+
+
+# compared by identity, as two exchanges can be alike
+@dataclass(eq=False)
+class PcommExchange:
+    """A command and its reply, or the acknowledgement of the `UP` following it."""
+
+    pcomm: str
+    sent_at: float
+    # number of the `UP` following the command, if any
+    up_seq: int | None = None
+    acked_at: float | None = None
+    reply_at: float | None = None
+    reply: bytes | None = None
+
+    @property
+    def latency_s(self) -> float | None:
+        """Time until the reply or, without a reply, the acknowledgement."""
+        done_at = self.reply_at if self.reply_at is not None else self.acked_at
+        return None if done_at is None else done_at - self.sent_at
+
+
+@dataclass
+class PcommLatency:
+    """
+    Correlate the commands sent to a module with its replies.
+
+    The module protocol has no request ids, but a module processes its
+    commands in order. Every command written to the module is registered
+    with `sent`, and each reply frame is paired with the oldest command
+    still waiting for one by `replied`, i.e. in FIFO order.
+
+    Commands which are not replied to are done once the `UP` written after
+    them is acknowledged, if the connection sends one (`latency_up`). The
+    `UP`s of a connection are numbered, so `acked` only needs the number of
+    acknowledgements received so far.
+
+    Attributes
+    ----------
+    max_age_s : float
+        Time after which a command is considered unanswered, e.g. as the
+        module does not reply to it, and no longer matched.
+    history : int
+        Number of completed exchanges which are kept.
+    """
+
+    max_age_s: float = 10.0
+    history: int = 50
+
+    histograms: dict[str, LatencyHistogram] = field(default_factory=dict)
+    recent: deque = field(default_factory=deque, repr=False)
+    _pending: deque = field(default_factory=deque, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def n_pending(self) -> int:
+        with self._lock:
+            self._expire(time.time())
+            return len(self._pending)
+
+    def sent(
+        self, pcomm: str, t: float | None = None, up_seq: int | None = None
+    ) -> PcommExchange:
+        """Register a command, followed by the `UP` numbered `up_seq` if any."""
+        t = time.time() if t is None else t
+        ex = PcommExchange(pcomm=pcomm, sent_at=t, up_seq=up_seq)
+        with self._lock:
+            self._pending.append(ex)
+        return ex
+
+    def discard(self, exchanges: list[PcommExchange]):
+        """Forget commands which were registered but could not be written."""
+        with self._lock:
+            for ex in exchanges:
+                if ex in self._pending:
+                    self._pending.remove(ex)
+
+    def replied(self, body: bytes, t: float | None = None) -> bool:
+        """Pair a reply with the oldest pending command, False if there is none."""
+        t = time.time() if t is None else t
+        with self._lock:
+            self._expire(t)
+            if not self._pending:
+                return False
+            ex = self._pending.popleft()
+            ex.reply_at, ex.reply = t, body
+            self._complete(ex)
+        return True
+
+    def acked(self, n_acked: int, t: float | None = None) -> int:
+        """Complete the commands whose `UP` is among the first `n_acked`."""
+        t = time.time() if t is None else t
+        with self._lock:
+            self._expire(t)
+            done = [
+                ex
+                for ex in self._pending
+                if ex.up_seq is not None and ex.up_seq <= n_acked
+            ]
+            for ex in done:
+                self._pending.remove(ex)
+                ex.acked_at = t
+                self._complete(ex)
+        return len(done)
+
+    def summary(self) -> dict[str, dict]:
+        """Number of samples, median and 99th percentile in ms per pcomm."""
+        with self._lock:
+            return {
+                pcomm: {
+                    "n": h.n,
+                    "p50_ms": h.quantile(0.5) * 1000,
+                    "p99_ms": h.quantile(0.99) * 1000,
+                }
+                for pcomm, h in self.histograms.items()
+                if h.n > 0
+            }
+
+    def _complete(self, ex: PcommExchange):
+        hist = self.histograms.setdefault(ex.pcomm, LatencyHistogram())
+        hist.add(ex.latency_s)
+        self.recent.append(ex)
+        while len(self.recent) > self.history:
+            self.recent.popleft()
+
+    def _expire(self, now: float):
+        while self._pending and now - self._pending[0].sent_at > self.max_age_s:
+            self._pending.popleft()
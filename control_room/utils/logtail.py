@@ -0,0 +1,145 @@
+# Incremental reading of the log file, only the bytes appended since the last
+# read are processed
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+
+LOG_LEVEL_PATTERN = re.compile(r"(DEBUG|INFO|WARNING|ERROR)")
+
+
+@dataclass
+class LogLine:
+    seq: int
+    level: str
+    text: str
+
+
+@dataclass
+class LogTailer:
+    """
+    Follow a log file and keep its last lines.
+
+    The tailer remembers the byte offset up to which the file was read, so
+    each `poll` only reads what was appended in the meantime. On the first
+    read, only the last `initial_bytes` of the file are considered. If the
+    file is truncated or replaced, e.g. by a log rotation, it is read from
+    the start again.
+
+    Every line gets a sequence number, so readers can ask for the lines they
+    have not seen yet via `lines_since`.
+
+    Attributes
+    ----------
+    path : Path
+        The log file.
+    max_lines : int
+        Number of lines kept.
+    initial_bytes : int
+        Number of bytes read from the end of the file on the first read.
+    max_read_bytes : int
+        Upper bound of bytes read by a single `poll`. If more was appended,
+        only the most recent part is read.
+    """
+
+    path: Path
+    max_lines: int = 25
+    initial_bytes: int = 2**16
+    max_read_bytes: int = 2**20
+
+    _lines: deque[LogLine] = field(init=False, repr=False)
+    _next_seq: int = field(default=0, init=False, repr=False)
+    _offset: int | None = field(default=None, init=False, repr=False)
+    _file_id: tuple[int, int] | None = field(default=None, init=False, repr=False)
+    _partial: bytes = field(default=b"", init=False, repr=False)
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        self.path = Path(self.path)
+        self._lines = deque(maxlen=self.max_lines)
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the latest line, -1 if there is none yet."""
+        return self._next_seq - 1
+
+    def poll(self) -> int:
+        """
+        Read what was appended to the file since the last poll.
+
+        Returns
+        -------
+        int
+            Number of new lines.
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._offset = None
+                return 0
+
+            file_id = (stat.st_dev, stat.st_ino)
+            if self._offset is None:
+                # first read -> only look at the end of the file
+                start = max(0, stat.st_size - self.initial_bytes)
+                skip_partial_line = start > 0
+            elif file_id != self._file_id or stat.st_size < self._offset:
+                # rotated or truncated -> start over
+                start, skip_partial_line = 0, False
+                self._partial = b""
+            else:
+                start, skip_partial_line = self._offset, False
+
+            if stat.st_size - start > self.max_read_bytes:
+                start = stat.st_size - self.max_read_bytes
+                skip_partial_line = True
+                self._partial = b""
+
+            with open(self.path, "rb") as f:
+                f.seek(start)
+                data = f.read(stat.st_size - start)
+
+            self._offset = start + len(data)
+            self._file_id = file_id
+
+            if skip_partial_line:
+                data = data[data.find(b"\n") + 1 :] if b"\n" in data else b""
+
+            *complete, self._partial = (self._partial + data).split(b"\n")
+            for raw in complete:
+                self._add_line(raw.decode(errors="replace").rstrip("\r"))
+
+            return len(complete)
+
+    def _add_line(self, text: str):
+        if not text:
+            return
+        match = LOG_LEVEL_PATTERN.search(text)
+        # log_level is used for coloring with css, use DEBUG as default
+        level = match.group(1) if match else "DEBUG"
+        self._lines.append(LogLine(seq=self._next_seq, level=level, text=text))
+        self._next_seq += 1
+
+    def lines_since(self, seq: int) -> tuple[list[LogLine], bool]:
+        """
+        Lines with a sequence number larger than `seq`.
+
+        Returns
+        -------
+        tuple[list[LogLine], bool]
+            The new lines, oldest first, and whether the reader has to reset,
+            as lines were missed or `seq` is unknown. If so, all kept lines
+            are returned.
+        """
+        with self._lock:
+            lines = list(self._lines)
+
+        oldest = lines[0].seq if lines else self._next_seq
+        if seq < oldest - 1 or seq > self.last_seq:
+            return lines, True
+        return [ln for ln in lines if ln.seq > seq], False
@@ -0,0 +1,140 @@
+# Discovery of LSL streams in the background, the GUI only reads the inventory
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+import pylsl
+
+from control_room.utils.logging import logger
+
+
+@dataclass(frozen=True)
+class StreamEntry:
+    """The properties of a discovered LSL stream."""
+
+    uid: str
+    name: str
+    type: str
+    source_id: str
+    hostname: str
+    nominal_srate: float
+    channel_count: int
+    channel_format: int
+
+    @classmethod
+    def from_info(cls, info: pylsl.StreamInfo) -> "StreamEntry":
+        return cls(
+            uid=info.uid(),
+            name=info.name(),
+            type=info.type(),
+            source_id=info.source_id(),
+            hostname=info.hostname(),
+            nominal_srate=info.nominal_srate(),
+            channel_count=info.channel_count(),
+            channel_format=info.channel_format(),
+        )
+
+    @property
+    def key(self) -> str:
+        # the uid is only assigned once a stream is published
+        return self.uid or f"{self.source_id}|{self.name}|{self.hostname}"
+
+    def __str__(self) -> str:
+        srate = (
+            "irregular"
+            if self.nominal_srate == pylsl.IRREGULAR_RATE
+            else f"{self.nominal_srate:g}Hz"
+        )
+        return f"{self.name} [{self.type}, {self.channel_count}ch @ {srate}] {self.hostname}"
+
+
+@dataclass
+class StreamDiscovery:
+    """
+    Keep an inventory of the LSL streams on the network.
+
+    A `pylsl.ContinuousResolver` collects the stream announcements in the
+    background. The inventory is updated from its results every
+    `interval_s`, and listeners are called with `("appeared", entry)` or
+    `("disappeared", entry)` for every change.
+
+    Attributes
+    ----------
+    interval_s : float
+        Time between two updates of the inventory.
+    forget_after_s : float
+        Time after which a stream which is no longer announced is considered
+        gone.
+    version : int
+        Incremented with every change of the inventory.
+    """
+
+    interval_s: float = 1.0
+    forget_after_s: float = 5.0
+    version: int = 0
+
+    _inventory: dict[str, StreamEntry] = field(default_factory=dict, repr=False)
+    _infos: dict[str, pylsl.StreamInfo] = field(default_factory=dict, repr=False)
+    _listeners: list[Callable[[str, StreamEntry], None]] = field(
+        default_factory=list, repr=False
+    )
+    _resolver: pylsl.ContinuousResolver | None = field(default=None, repr=False)
+    _stop_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    def streams(self) -> list[StreamEntry]:
+        """The current inventory, sorted by name. Does not block."""
+        return sorted(self._inventory.values(), key=lambda e: (e.name, e.uid))
+
+    def info(self, key: str) -> pylsl.StreamInfo | None:
+        """The StreamInfo of a stream in the inventory, None if unknown."""
+        return self._infos.get(key, None)
+
+    def add_listener(self, listener: Callable[[str, StreamEntry], None]):
+        self._listeners.append(listener)
+
+    def start(self):
+        self._resolver = pylsl.ContinuousResolver(forget_after=self.forget_after_s)
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="lsl_discovery", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout_s: float = 3):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+            self._thread = None
+        self._resolver = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_s):
+            try:
+                self.update(self._resolver.results())  # type: ignore
+            except Exception as e:
+                logger.error(f"Failed to update the LSL stream inventory: {e}")
+
+    def update(self, infos: list[pylsl.StreamInfo]):
+        """Replace the inventory by the given streams and notify about changes."""
+        entries = [StreamEntry.from_info(info) for info in infos]
+        current = {e.key: e for e in entries}
+        # the infos are needed to open inlets, e.g. by the StreamMonitor
+        self._infos = {e.key: info for e, info in zip(entries, infos)}
+        appeared = [e for k, e in current.items() if k not in self._inventory]
+        disappeared = [e for k, e in self._inventory.items() if k not in current]
+        if not appeared and not disappeared:
+            return
+
+        # swapped as a whole, so readers never see a partial update
+        self._inventory = current
+        self.version += 1
+
+        for event, entries in [("appeared", appeared), ("disappeared", disappeared)]:
+            for entry in entries:
+                logger.info(f"LSL stream {event}: {entry}")
+                for listener in self._listeners:
+                    try:
+                        listener(event, entry)
+                    except Exception as e:
+                        logger.error(f"LSL discovery listener failed on {event}: {e}")
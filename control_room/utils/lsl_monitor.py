@@ -0,0 +1,306 @@
+# Throughput and latency of selected LSL streams
+import math
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+import numpy as np
+import pylsl
+from dareplane_utils.general.ringbuffer import RingBuffer
+from pylsl.util import LostError
+from pylsl.util import TimeoutError as LSLTimeoutError
+
+from control_room.utils.logging import logger
+from control_room.utils.lsl_discovery import StreamDiscovery, StreamEntry
+
+CHANNEL_DTYPES: dict[int, type] = {
+    pylsl.cf_float32: np.float32,
+    pylsl.cf_double64: np.float64,
+    pylsl.cf_int8: np.int8,
+    pylsl.cf_int16: np.int16,
+    pylsl.cf_int32: np.int32,
+    pylsl.cf_int64: np.int64,
+}
+
+# buffer size for streams without a nominal rate
+IRREGULAR_BUFFER_SAMPLES: int = 1024
+
+
+@dataclass
+class StreamMetrics:
+    """
+    Delivery statistics of a monitored stream.
+
+    Attributes
+    ----------
+    nominal_srate : float
+        The rate the stream announced.
+    effective_srate : float
+        Samples received per second over the last `rate_window_s`.
+    dropped : int
+        Estimated number of missing samples, from gaps in the time stamps.
+    jitter_ms : float
+        Standard deviation of the intervals between received chunks.
+    time_offset_ms : float | None
+        The `time_correction()` of the inlet, None until it is available.
+    n_samples : int
+        Number of samples received in total.
+    """
+
+    nominal_srate: float = 0.0
+    effective_srate: float = 0.0
+    dropped: int = 0
+    jitter_ms: float = 0.0
+    time_offset_ms: float | None = None
+    n_samples: int = 0
+
+    def __str__(self) -> str:
+        nominal = (
+            "irr"
+            if self.nominal_srate == pylsl.IRREGULAR_RATE
+            else f"{self.nominal_srate:g}"
+        )
+        offset = "-" if self.time_offset_ms is None else f"{self.time_offset_ms:.1f}ms"
+        return (
+            f"{self.effective_srate:.0f}/{nominal}Hz drop={self.dropped}"
+            f" jitter={self.jitter_ms:.1f}ms offset={offset}"
+        )
+
+
+@dataclass
+class MonitoredStream:
+    """
+    An inlet pulling into preallocated buffers, with the metrics of the stream.
+
+    Chunks are pulled into a fixed chunk array, without allocating, and then
+    added to `buffer`, which holds the last `buffer_s` of data. Listeners
+    are called with the view of each new chunk and its time stamps.
+    """
+
+    entry: StreamEntry
+    inlet: pylsl.StreamInlet
+    buffer_s: float = 10.0
+    rate_window_s: float = 2.0
+    max_chunk: int = 4096
+
+    metrics: StreamMetrics = field(init=False)
+    buffer: RingBuffer | None = field(init=False, repr=False)
+    listeners: list[Callable[[np.ndarray, np.ndarray], None]] = field(
+        default_factory=list, repr=False
+    )
+
+    _chunk: np.ndarray | None = field(init=False, repr=False)
+    # arrival time and number of samples of the last pulls
+    _pull_t: np.ndarray = field(init=False, repr=False)
+    _pull_n: np.ndarray = field(init=False, repr=False)
+    _pull_i: int = field(default=0, init=False, repr=False)
+    _last_ts: float | None = field(default=None, init=False, repr=False)
+    _last_correction_t: float = field(default=0.0, init=False, repr=False)
+
+    def __post_init__(self):
+        self.metrics = StreamMetrics(nominal_srate=self.entry.nominal_srate)
+        dtype = CHANNEL_DTYPES.get(self.entry.channel_format, None)
+        n_ch = self.entry.channel_count
+        if dtype is None:
+            # e.g. string markers, only the metrics are kept
+            self.buffer, self._chunk = None, None
+        else:
+            srate = self.entry.nominal_srate
+            n = (
+                math.ceil(srate * self.buffer_s)
+                if srate > 0
+                else IRREGULAR_BUFFER_SAMPLES
+            )
+            self.buffer = RingBuffer(shape=(n, n_ch), dtype=dtype)
+            self._chunk = np.zeros((self.max_chunk, n_ch), dtype=dtype)
+
+        self._pull_t = np.zeros(256)
+        self._pull_n = np.zeros(256, dtype=np.int64)
+
+    @property
+    def n_buffered(self) -> int:
+        """Number of valid samples in `buffer`."""
+        if self.buffer is None:
+            return 0
+        return min(self.metrics.n_samples, self.buffer.buffer.shape[0])
+
+    def latest(self, n: int) -> np.ndarray:
+        """A copy of the last `n` buffered samples, oldest first."""
+        if self.buffer is None:
+            return np.zeros((0, self.entry.channel_count))
+        n = min(n, self.n_buffered)
+        buf, i = self.buffer.buffer, self.buffer.curr_i
+        if n <= i:
+            return buf[i - n : i].copy()
+        return np.concatenate([buf[len(buf) - (n - i) :], buf[:i]])
+
+    def pull(self, now: float | None = None) -> int:
+        """Pull what is available without blocking and update the metrics."""
+        now = time.monotonic() if now is None else now
+        if self._chunk is not None:
+            data, ts = self.inlet.pull_chunk(
+                timeout=0.0, max_samples=self.max_chunk, dest_obj=self._chunk
+            )
+        else:
+            data, ts = self.inlet.pull_chunk(timeout=0.0, max_samples=self.max_chunk)
+
+        n = len(ts)
+        if n > 0:
+            ts = np.asarray(ts)
+            if self._chunk is not None:
+                chunk = self._chunk[:n]
+                self.buffer.add_samples(chunk, ts)  # type: ignore
+            else:
+                chunk = np.asarray(data, dtype=object)
+            self._update_metrics(now, ts)
+            for listener in self.listeners:
+                listener(chunk, ts)
+
+        return n
+
+    def _update_metrics(self, now: float, ts: np.ndarray):
+        m = self.metrics
+        m.n_samples += len(ts)
+
+        self._pull_t[self._pull_i] = now
+        self._pull_n[self._pull_i] = len(ts)
+        self._pull_i = (self._pull_i + 1) % len(self._pull_t)
+
+        recent = self._pull_t > now - self.rate_window_s
+        t, n = self._pull_t[recent], self._pull_n[recent]
+        if len(t) > 1:
+            first = np.argmin(t)
+            # the samples of the first pull arrived before the window started
+            elapsed = max(now - t[first], 1e-3)
+            m.effective_srate = float((n.sum() - n[first]) / elapsed)
+        if len(t) > 2:
+            m.jitter_ms = float(np.std(np.diff(np.sort(t))) * 1000)
+
+        srate = self.entry.nominal_srate
+        if srate > 0:
+            if self._last_ts is not None:
+                ts = np.concatenate(([self._last_ts], ts))
+            d = np.diff(ts)
+            gaps = d[d > 1.5 / srate]
+            m.dropped += int(np.sum(np.round(gaps * srate) - 1))
+        self._last_ts = float(ts[-1])
+
+    def update_time_correction(self, now: float, every_s: float = 5.0):
+        if now - self._last_correction_t < every_s:
+            return
+        self._last_correction_t = now
+        try:
+            offset = self.inlet.time_correction(timeout=0.05)
+            self.metrics.time_offset_ms = offset * 1000
+        except LSLTimeoutError:
+            pass  # estimated in the background, retried with the next call
+
+
+@dataclass
+class StreamMonitor:
+    """
+    Watch the LSL streams selected in the GUI.
+
+    The selection is only recorded by `select`, the inlets are opened and
+    closed by the monitor's thread, which also pulls from all inlets without
+    blocking every `poll_s`. So neither the GUI nor one slow stream block the
+    monitoring of the others.
+
+    Attributes
+    ----------
+    discovery : StreamDiscovery
+        Provides the StreamInfo to open an inlet for a selected stream.
+    poll_s : float
+        Time between two pulls of all streams.
+    buffer_s : float
+        Seconds of data kept per stream.
+    streams : dict[str, MonitoredStream]
+        The monitored streams by their key.
+    """
+
+    discovery: StreamDiscovery
+    poll_s: float = 0.01
+    buffer_s: float = 10.0
+    streams: dict[str, MonitoredStream] = field(default_factory=dict)
+
+    # called with every newly opened MonitoredStream, e.g. to add listeners
+    on_open: list[Callable[[MonitoredStream], None]] = field(
+        default_factory=list, repr=False
+    )
+
+    _selected: set[str] = field(default_factory=set, repr=False)
+    _stop_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    def select(self, keys: list[str]):
+        """Set the streams to monitor, does not block."""
+        self._selected = set(keys)
+
+    def metrics(self) -> dict[str, StreamMetrics]:
+        return {k: s.metrics for k, s in list(self.streams.items())}
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="lsl_monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout_s: float = 3):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+            self._thread = None
+        for key in list(self.streams):
+            self._close(key)
+
+    def _open(self, key: str):
+        info = self.discovery.info(key)
+        if info is None:
+            return  # not (yet) discovered
+        entry = StreamEntry.from_info(info)
+        try:
+            inlet = pylsl.StreamInlet(
+                info, max_buflen=max(1, math.ceil(self.buffer_s)), as_numpy=True
+            )
+            inlet.open_stream(timeout=1)
+        except Exception as e:
+            logger.warning(f"Cannot open an inlet for {entry}: {e}")
+            return
+
+        stream = MonitoredStream(entry=entry, inlet=inlet, buffer_s=self.buffer_s)
+        for callback in self.on_open:
+            callback(stream)
+        self.streams[key] = stream
+        logger.info(f"Monitoring LSL stream {entry}")
+
+    def _close(self, key: str):
+        stream = self.streams.pop(key, None)
+        if stream is not None:
+            stream.inlet.close_stream()
+            logger.info(f"Stopped monitoring LSL stream {stream.entry}")
+
+    def _reconcile(self):
+        selected = self._selected
+        for key in list(self.streams):
+            if key not in selected:
+                self._close(key)
+        for key in selected:
+            if key not in self.streams:
+                self._open(key)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            tstart = time.monotonic()
+            self._reconcile()
+            for key, stream in list(self.streams.items()):
+                try:
+                    stream.pull(tstart)
+                    stream.update_time_correction(tstart)
+                except LostError:
+                    logger.warning(f"Lost LSL stream {stream.entry}")
+                    self._close(key)
+                except Exception as e:
+                    logger.error(f"Failed to pull from {stream.entry}: {e}")
+            self._stop_event.wait(max(0, self.poll_s - (time.monotonic() - tstart)))
@@ -0,0 +1,161 @@
+# Decimated previews of the monitored LSL streams for plotting in the GUI
+import math
+from dataclasses import dataclass, field
+
+import numpy as np
+from dareplane_utils.general.ringbuffer import RingBuffer
+
+from control_room.utils.lsl_monitor import MonitoredStream, StreamMonitor
+
+
+@dataclass
+class EnvelopeDecimator:
+    """
+    Min/max envelope of a stream, computed incrementally per chunk.
+
+    Every `bin_size` samples are reduced to their minimum and maximum per
+    channel. Complete bins are computed from all full bins of a chunk at
+    once, the samples of a started bin are kept as running min/max until
+    the bin is complete.
+
+    Attributes
+    ----------
+    n_channels : int
+        Number of channels of the stream.
+    bin_size : int
+        Number of samples per bin.
+    n_bins : int
+        Number of bins kept.
+    n_added : int
+        Number of complete bins added so far.
+    """
+
+    n_channels: int
+    bin_size: int
+    n_bins: int
+    n_added: int = 0
+
+    # (n_bins, n_channels, 2) with the min and the max of each bin
+    buffer: RingBuffer = field(init=False, repr=False)
+    _acc: np.ndarray = field(init=False, repr=False)
+    _acc_n: int = field(default=0, init=False, repr=False)
+
+    def __post_init__(self):
+        self.buffer = RingBuffer(
+            shape=(self.n_bins, self.n_channels, 2), dtype=np.float32
+        )
+        self._acc = np.zeros((self.n_channels, 2), dtype=np.float32)
+
+    @classmethod
+    def for_stream(
+        cls, stream: MonitoredStream, window_s: float, n_points: int
+    ) -> "EnvelopeDecimator":
+        """A decimator showing `window_s` of the stream with `n_points` bins."""
+        srate = stream.entry.nominal_srate
+        bin_size = max(1, math.ceil(srate * window_s / n_points)) if srate > 0 else 1
+        return cls(
+            n_channels=stream.entry.channel_count, bin_size=bin_size, n_bins=n_points
+        )
+
+    def add(self, chunk: np.ndarray, ts: np.ndarray):
+        n = len(ts)
+        i = 0
+
+        # complete the started bin first
+        if self._acc_n > 0:
+            i = min(n, self.bin_size - self._acc_n)
+            self._accumulate(chunk[:i])
+            if self._acc_n == self.bin_size:
+                self._push(self._acc[None].copy(), ts[i - 1 : i])
+                self._acc_n = 0
+
+        n_full = (n - i) // self.bin_size
+        if n_full > 0:
+            j = i + n_full * self.bin_size
+            bins = chunk[i:j].reshape(n_full, self.bin_size, self.n_channels)
+            env = np.stack([bins.min(axis=1), bins.max(axis=1)], axis=-1)
+            self._push(env, ts[i + self.bin_size - 1 : j : self.bin_size])
+            i = j
+
+        if i < n:
+            self._accumulate(chunk[i:])
+
+    def _accumulate(self, samples: np.ndarray):
+        if len(samples) == 0:
+            return
+        lo, hi = samples.min(axis=0), samples.max(axis=0)
+        if self._acc_n == 0:
+            self._acc[:, 0], self._acc[:, 1] = lo, hi
+        else:
+            np.minimum(self._acc[:, 0], lo, out=self._acc[:, 0])
+            np.maximum(self._acc[:, 1], hi, out=self._acc[:, 1])
+        self._acc_n += len(samples)
+
+    def _push(self, env: np.ndarray, t: np.ndarray):
+        self.buffer.add_samples(env, t)
+        self.n_added += len(env)
+
+    def unfold(self) -> tuple[np.ndarray, np.ndarray]:
+        """The times and envelopes of the complete bins, oldest first."""
+        n = min(self.n_added, self.n_bins)
+        if n == 0:
+            return np.zeros(0), np.zeros((0, self.n_channels, 2))
+        return self.buffer.unfold_buffer_t()[-n:], self.buffer.unfold_buffer()[-n:]
+
+
+@dataclass
+class StreamPreviews:
+    """
+    Keep an EnvelopeDecimator for every numeric stream opened by the monitor.
+
+    The decimators are fed from the monitor's thread as chunks arrive, so
+    reading a preview only touches `n_points` bins, independent of the rate
+    of the stream.
+
+    Attributes
+    ----------
+    monitor : StreamMonitor
+        The monitor whose streams are previewed.
+    window_s : float
+        Time span of a preview.
+    n_points : int
+        Number of bins per preview.
+    """
+
+    monitor: StreamMonitor
+    window_s: float = 10.0
+    n_points: int = 200
+    decimators: dict[str, EnvelopeDecimator] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.monitor.on_open.append(self._attach)
+
+    def _attach(self, stream: MonitoredStream):
+        if stream.buffer is None:
+            return  # e.g. string markers
+        dec = EnvelopeDecimator.for_stream(stream, self.window_s, self.n_points)
+        stream.listeners.append(dec.add)
+        self.decimators[stream.entry.key] = dec
+
+    def preview(
+        self, key: str, max_channels: int = 8
+    ) -> tuple[np.ndarray, np.ndarray] | None:
+        """
+        The envelope of the first `max_channels` channels of a monitored stream.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray] | None
+            The bin times relative to the latest bin and the envelopes of shape
+            (n_bins, n_channels, 2), None if the stream is not monitored.
+        """
+        if key not in self.monitor.streams:
+            self.decimators.pop(key, None)
+            return None
+        dec = self.decimators.get(key, None)
+        if dec is None:
+            return None
+        t, env = dec.unfold()
+        if len(t):
+            t = t - t[-1]
+        return t, env[:, :max_channels]
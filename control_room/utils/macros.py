@@ -0,0 +1,657 @@
+# Execution of macros on a dedicated thread, off the GUI's request threads
+import ast
+import functools
+import heapq
+import itertools
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any
+
+from control_room.utils.logging import logger
+
+# states of a MacroRun
+RUN_STATES: tuple[str, ...] = (
+    "scheduled",
+    "running",
+    "waiting",  # for the acknowledgements of a barrier
+    "paused",
+    "done",
+    "cancelled",
+    "failed",
+)
+ACTIVE_STATES: tuple[str, ...] = ("scheduled", "running", "waiting", "paused")
+# methods of the MacroExecutor controlling a run
+RUN_CONTROLS: tuple[str, ...] = ("pause", "resume", "cancel")
+
+
+@dataclass
+class MacroStep:
+    """
+    A single message of a macro run.
+
+    Attributes
+    ----------
+    target : Any
+        The module connection to send to, providing `name` and
+        `enqueue_message`, and `send_up` and `wait_up_ack` for barriers.
+    message : bytes
+        The message as sent.
+    offset_s : float
+        Planned send time, relative to the start of the run. Barriers which
+        waited for acknowledgements postpone all later steps.
+    group : int
+        Steps of the same group and offset are sent together, without
+        waiting for each other. Groups are sent in order.
+    wait_ack : bool
+        If True, the next group is only sent once all targets of this step's
+        group acknowledged an `UP` sent after the group's messages.
+    sent_s : float | None
+        Time the message was handed to the target's writer thread, relative
+        to the start of the run.
+    planned_s : float | None
+        Send time the step was scheduled for, i.e. `offset_s` plus the time
+        the run was held by barriers.
+    error : str | None
+        Set if sending failed.
+    """
+
+    target: Any
+    message: bytes
+    offset_s: float = 0.0
+    group: int = 0
+    wait_ack: bool = False
+    sent_s: float | None = None
+    planned_s: float | None = None
+    error: str | None = None
+
+    @property
+    def lateness_ms(self) -> float | None:
+        if self.sent_s is None:
+            return None
+        planned_s = self.offset_s if self.planned_s is None else self.planned_s
+        return (self.sent_s - planned_s) * 1000
+
+    def to_dict(self) -> dict:
+        return {
+            "target": getattr(self.target, "name", str(self.target)),
+            "message": self.message.decode(errors="replace"),
+            "offset_s": self.offset_s,
+            "group": self.group,
+            "sent_s": self.sent_s,
+            "lateness_ms": self.lateness_ms,
+            "error": self.error,
+        }
+
+
+@dataclass
+class MacroRun:
+    """
+    A submitted macro and the progress of sending its steps.
+
+    Attributes
+    ----------
+    run_id : str
+        Identifies the run, e.g. to cancel it.
+    name : str
+        Name of the macro.
+    steps : list[MacroStep]
+        The steps, ordered by their `group` and `offset_s`.
+    t_start : float
+        `time.monotonic()` at which the run starts, the steps are scheduled
+        relative to it, so delays do not add up.
+    ack_timeout_s : float
+        Time a barrier waits for the acknowledgements before the run fails.
+    state : str
+        One of RUN_STATES.
+    n_sent : int
+        Number of steps sent so far.
+    hold_s : float
+        Time by which barriers and pauses postponed the remaining steps.
+    """
+
+    run_id: str
+    name: str
+    steps: list[MacroStep]
+    t_start: float
+    ack_timeout_s: float = 1.0
+    state: str = "scheduled"
+    n_sent: int = 0
+    hold_s: float = 0.0
+
+    # targets of the current barrier, the steps of the barrier's group and
+    # the errors of the targets which did not acknowledge, None while they
+    # are awaited
+    _acks: dict[str, Any] = field(default_factory=dict, repr=False)
+    _barrier: list[MacroStep] = field(default_factory=list, repr=False)
+    _ack_deadline: float = field(default=0.0, repr=False)
+    _missing: dict[str, str] | None = field(default=None, repr=False)
+    # the tie breaker of the run's valid entry in the executor's queue
+    _entry: int = field(default=-1, repr=False)
+    # state before pausing and the `time.monotonic()` of the pause
+    _paused: tuple[str, float] | None = field(default=None, repr=False)
+
+    @property
+    def is_active(self) -> bool:
+        return self.state in ACTIVE_STATES
+
+    def deadline(self, i: int) -> float:
+        return self.t_start + self.hold_s + self.steps[i].offset_s
+
+    def next_group(self) -> list[MacroStep]:
+        """The steps of the group which is sent next."""
+        first = self.steps[self.n_sent]
+        return list(
+            itertools.takewhile(
+                lambda s: (s.group, s.offset_s) == (first.group, first.offset_s),
+                self.steps[self.n_sent :],
+            )
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "name": self.name,
+            "state": self.state,
+            "n_sent": self.n_sent,
+            "steps": [s.to_dict() for s in self.steps],
+        }
+
+
+@dataclass
+class MacroExecutor:
+    """
+    Send the steps of macro runs at their deadlines from a single thread.
+
+    `submit` only schedules a run and returns its id right away. The
+    executor's thread sleeps until the earliest deadline of all runs, sends
+    the due group of steps and schedules the next group of the same run.
+    Deadlines are absolute `time.monotonic()` values, so the time spent
+    sending does not delay the following steps.
+
+    All steps of a group are queued to the writer threads of their targets
+    back to back within a single wake-up, so the modules of a group receive
+    their commands with minimal skew, and a module which does not read does
+    not delay the other runs. The skew of each group is logged. If the group
+    is a barrier (`wait_ack`), a thread per barrier sends an `UP` to each of
+    its targets after the commands and waits until all targets acknowledged
+    their `UP`. Earlier `UP`s, e.g. of the HealthMonitor, do not count. The
+    thread hands the run back to the executor once all acknowledgements
+    arrived or `ack_timeout_s` passed.
+
+    To send close to the deadline, the thread wakes up `spin_s` early and
+    spins for the remaining time, as waiting on the condition alone can
+    overshoot by a millisecond or more.
+
+    Attributes
+    ----------
+    history : int
+        Number of finished runs which are kept, e.g. to be shown in the GUI.
+    spin_s : float
+        Time before a deadline from which the thread spins instead of
+        waiting on the condition. 0 disables spinning.
+    """
+
+    history: int = 20
+    spin_s: float = 0.001
+
+    _runs: OrderedDict[str, MacroRun] = field(default_factory=OrderedDict, repr=False)
+    # (deadline, tie breaker, run_id) of the next step of each active run
+    _queue: list[tuple[float, int, str]] = field(default_factory=list, repr=False)
+    _seq: itertools.count = field(default_factory=itertools.count, repr=False)
+    _cond: threading.Condition = field(default_factory=threading.Condition, repr=False)
+    _stop: bool = field(default=False, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stop = False
+            self._thread = threading.Thread(
+                target=self._run, name="macro_executor", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout_s: float = 3):
+        """Stop the thread, runs which did not finish are cancelled."""
+        with self._cond:
+            self._stop = True
+            for run in self._runs.values():
+                if run.is_active:
+                    run.state = "cancelled"
+            self._queue.clear()
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+            self._thread = None
+
+    def submit(
+        self,
+        name: str,
+        steps: list[MacroStep],
+        delay_s: float = 0.0,
+        ack_timeout_s: float = 1.0,
+    ) -> str:
+        """
+        Schedule a run of the steps, starting in `delay_s`.
+
+        `ack_timeout_s` limits the time barriers of the run wait for the
+        acknowledgements of their targets.
+
+        Returns
+        -------
+        str
+            The id of the run.
+        """
+        self.start()  # started with the first run
+        run = MacroRun(
+            run_id=uuid.uuid4().hex[:8],
+            name=name,
+            steps=sorted(steps, key=lambda s: (s.group, s.offset_s)),
+            t_start=time.monotonic() + delay_s,
+            ack_timeout_s=ack_timeout_s,
+        )
+        with self._cond:
+            self._runs[run.run_id] = run
+            if run.steps:
+                self._schedule(run, 0)
+            else:
+                run.state = "done"
+            self._forget_finished()
+            self._cond.notify_all()
+
+        logger.info(f"Scheduled macro {name} as run {run.run_id}")
+        return run.run_id
+
+    def cancel(self, run_id: str) -> bool:
+        """Cancel a run, returns False if it is unknown or no longer active."""
+        with self._cond:
+            run = self._runs.get(run_id, None)
+            if run is None or not run.is_active:
+                return False
+            run.state = "cancelled"
+            # its entry in the queue is skipped once it is due
+            self._cond.notify_all()
+
+        logger.info(f"Cancelled macro run {run_id} ({run.name})")
+        return True
+
+    def pause(self, run_id: str) -> bool:
+        """Hold a run before its next step, returns False if it is not active."""
+        with self._cond:
+            run = self._runs.get(run_id, None)
+            if run is None or not run.is_active or run.state == "paused":
+                return False
+            run._paused = (run.state, time.monotonic())
+            run.state = "paused"
+            run._entry = -1  # its entry in the queue is skipped
+
+        logger.info(f"Paused macro run {run_id} ({run.name})")
+        return True
+
+    def resume(self, run_id: str) -> bool:
+        """
+        Continue a paused run.
+
+        The remaining steps are postponed by the duration of the pause, so
+        they keep their spacing.
+        """
+        with self._cond:
+            run = self._runs.get(run_id, None)
+            if run is None or run.state != "paused" or run._paused is None:
+                return False
+            state, t_paused = run._paused
+            run._paused = None
+            run.state = state
+            if state == "waiting":
+                run._ack_deadline += time.monotonic() - t_paused
+                self._push(time.monotonic(), run)
+            else:
+                run.hold_s += time.monotonic() - t_paused
+                self._schedule(run, run.n_sent)
+            self._cond.notify_all()
+
+        logger.info(f"Resumed macro run {run_id} ({run.name})")
+        return True
+
+    def runs(self) -> list[MacroRun]:
+        """The kept runs, newest first."""
+        with self._cond:
+            return list(reversed(self._runs.values()))
+
+    def get(self, run_id: str) -> MacroRun | None:
+        return self._runs.get(run_id, None)
+
+    def _schedule(self, run: MacroRun, i: int):
+        deadline = run.deadline(i)
+        run.steps[i].planned_s = deadline - run.t_start
+        self._push(deadline, run)
+
+    def _push(self, deadline: float, run: MacroRun):
+        run._entry = next(self._seq)
+        heapq.heappush(self._queue, (deadline, run._entry, run.run_id))
+
+    def _forget_finished(self):
+        finished = [k for k, r in self._runs.items() if not r.is_active]
+        for k in finished[: max(0, len(finished) - self.history)]:
+            del self._runs[k]
+
+    def _next_due(self) -> MacroRun | None:
+        """Wait for the next due step, None if stopped."""
+        with self._cond:
+            while not self._stop:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                deadline, entry, run_id = self._queue[0]
+                wait_s = deadline - time.monotonic()
+                if wait_s > self.spin_s:
+                    # woken up early by new runs, cancellations or stop
+                    self._cond.wait(wait_s - self.spin_s)
+                    continue
+                if wait_s > 0:
+                    self._cond.release()
+                    try:
+                        while time.monotonic() < deadline:
+                            pass
+                    finally:
+                        self._cond.acquire()
+                    continue
+                heapq.heappop(self._queue)
+                run = self._runs.get(run_id, None)
+                if run is not None and run.is_active and run._entry == entry:
+                    if run.state != "waiting":
+                        run.state = "running"
+                    return run
+            return None
+
+    def _run(self):
+        while (run := self._next_due()) is not None:
+            if run.state == "waiting":
+                self._check_acks(run)
+            else:
+                self._send_group(run)
+
+    def _send_group(self, run: MacroRun):
+        group = run.next_group()
+        for step in group:
+            step.planned_s = group[0].planned_s
+            try:
+                if not step.target.enqueue_message(step.message):
+                    raise ConnectionError("the outbound queue dropped the message")
+            except Exception as e:
+                logger.error(
+                    f"Macro run {run.run_id} ({run.name}) failed to send"
+                    f" {step.message!r} to {getattr(step.target, 'name', '?')}: {e}"
+                )
+                step.error = str(e)
+            step.sent_s = time.monotonic() - run.t_start
+
+        for step in group:
+            if step.error is None:
+                logger.info(
+                    f"Macro run {run.run_id} ({run.name}) sent {step.message!r} to"
+                    f" {getattr(step.target, 'name', '?')} at {step.sent_s:.4f}s,"
+                    f" planned {step.planned_s:.4f}s ({step.lateness_ms:+.3f}ms)"
+                )
+        if len(group) > 1:
+            sent = [s.sent_s for s in group if s.sent_s is not None]
+            logger.info(
+                f"Macro run {run.run_id} ({run.name}) queued a group of"
+                f" {len(group)} steps with a skew of"
+                f" {(max(sent) - min(sent)) * 1000:.3f}ms"
+            )
+
+        # the `UP` follows the commands on the same connection, so its
+        # acknowledgement implies the commands were received
+        acks = {}
+        if any(s.wait_ack for s in group):
+            acks = {
+                s.target.name: s.target
+                for s in group
+                # e.g. connection only modules do not answer `UP`
+                if getattr(s.target, "heartbeat", True)
+            }
+
+        with self._cond:
+            run.n_sent += sum(1 for s in group if s.error is None)
+            if any(s.error is not None for s in group):
+                run.state = "failed"
+                return
+            if run.state != "running":
+                return  # cancelled while sending
+            if acks:
+                run.state = "waiting"
+                run._acks = acks
+                run._barrier = group
+                run._ack_deadline = time.monotonic() + run.ack_timeout_s
+                self._await_acks(run, acks)
+            else:
+                self._advance(run)
+
+    def _await_acks(self, run: MacroRun, acks: dict[str, Any]):
+        """Send the `UP`s and wait for the acknowledgements on a thread of its own."""
+        run._missing = None
+        threading.Thread(
+            target=self._wait_for_acks,
+            args=(run, acks, run._ack_deadline),
+            name=f"macro_acks_{run.run_id}",
+            daemon=True,
+        ).start()
+
+    def _wait_for_acks(self, run: MacroRun, acks: dict[str, Any], deadline: float):
+        # `send_up` waits for the queued commands to be written, and a proxy
+        # of a broker process waits for the reply of the broker, so this must
+        # not hold the lock
+        missing, seqs = {}, {}
+        for name, target in acks.items():
+            try:
+                seqs[name] = target.send_up()
+            except Exception as e:
+                missing[name] = f"failed to send UP: {e}"
+
+        for name, seq in seqs.items():
+            try:
+                acked = acks[name].wait_up_ack(
+                    seq, max(0.0, deadline - time.monotonic())
+                )
+            except Exception as e:
+                logger.debug(f"Cannot wait for the acknowledgement of {name}: {e}")
+                acked = False
+            if not acked:
+                missing[name] = "no acknowledgement"
+
+        with self._cond:
+            if run.state not in ("waiting", "paused") or run._missing is not None:
+                return  # cancelled or failed in the meantime
+            run._missing = missing
+            if run.state == "waiting":
+                self._push(time.monotonic(), run)
+                self._cond.notify_all()
+
+    def _check_acks(self, run: MacroRun):
+        with self._cond:
+            if run.state != "waiting" or run._missing is None:
+                return  # paused, cancelled or still waiting
+            missing = run._missing
+            now = time.monotonic()
+            if not missing:
+                run._acks, run._barrier, run._missing = {}, [], None
+                run.state = "running"
+                if run.n_sent < len(run.steps):
+                    # the barrier postpones the remaining steps if it took
+                    # longer than planned
+                    run.hold_s += max(0.0, now - run.deadline(run.n_sent))
+                self._advance(run)
+            elif now > run._ack_deadline or any(
+                e != "no acknowledgement" for e in missing.values()
+            ):
+                logger.error(
+                    f"Macro run {run.run_id} ({run.name}) got no acknowledgement"
+                    f" within {run.ack_timeout_s}s: {missing}"
+                )
+                run.state = "failed"
+                for step in run._barrier:
+                    if step.target.name in missing:
+                        step.error = missing[step.target.name]
+            else:
+                # the deadline was postponed by a pause
+                self._await_acks(
+                    run, {n: t for n, t in run._acks.items() if n in missing}
+                )
+
+    def _advance(self, run: MacroRun):
+        """Schedule the next group of a run, or finish it."""
+        if run.n_sent < len(run.steps):
+            self._schedule(run, run.n_sent)
+        else:
+            run.state = "done"
+            logger.debug(f"Macro run {run.run_id} ({run.name}) is done")
+
+
+TEMPLATE_PATTERN = re.compile(r"\$<([^>]*)>")
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(value: str) -> tuple[str, ...]:
+    """
+    Split a string with `$<name>` templates into its parts.
+
+    Even indices are literal text, odd indices are the names of the
+    referenced values, e.g. `'../$<a>/x'` -> `('../', 'a', '/x')`.
+    """
+    return tuple(TEMPLATE_PATTERN.split(value))
+
+
+def render_template(parts: tuple[str, ...], values: Mapping) -> str:
+    return "".join(p if i % 2 == 0 else str(values[p]) for i, p in enumerate(parts))
+
+
+def evaluate_templates(d: dict) -> dict:
+    """
+    If a dictionary contains $<some_name> templates in its values,
+    replace them with the variable
+    """
+    for k, v in d.items():
+        if isinstance(v, str):
+            parts = compile_template(v)
+            if len(parts) > 1:
+                d[k] = render_template(parts, d)
+
+    return d
+
+
+class MacroConfigError(ValueError):
+    pass
+
+
+class PayloadError(KeyError):
+    pass
+
+
+@dataclass(frozen=True)
+class MacroCommand:
+    """
+    A single command of a macro, resolved when the config is loaded.
+
+    Attributes
+    ----------
+    target : Any
+        The module connection the command is sent to.
+    pcomm : str
+        The primary command.
+    encode : Callable[[dict], str]
+        Serializes the payload for the target.
+    mappings : tuple[tuple[str, str], ...]
+        Pairs of (payload key, kwarg name), the payload is built from the
+        kwargs of a macro run.
+    terminator : str
+        Appended to the message.
+    """
+
+    target: Any
+    pcomm: str
+    encode: Callable[[dict], str]
+    mappings: tuple[tuple[str, str], ...] = ()
+    terminator: str = ";"
+
+    def message(self, kwargs: Mapping) -> bytes:
+        if not self.mappings:
+            return (self.pcomm + self.terminator).encode()
+
+        payload = {}
+        for key, name in self.mappings:
+            if name not in kwargs:
+                error_msg = f"Key '{name}' not in provided payload"
+                logger.error(error_msg)
+                raise PayloadError(error_msg)
+            payload[key] = kwargs[name]
+        msg = self.pcomm + "|" + self.encode(payload)
+        if ";" in msg:
+            logger.error(
+                f"Found a semi-colon in {msg=} - this is a reserved character please use characters other than `;`"
+            )
+        return (msg + self.terminator).encode()
+
+
+@dataclass(frozen=True)
+class MacroPlan:
+    """
+    A macro compiled from its config, executing it only binds the kwargs.
+
+    Attributes
+    ----------
+    name : str
+        Name of the macro, as shown on its button.
+    groups : tuple[tuple[MacroCommand, ...], ...]
+        The commands, in groups which are sent together.
+    default_input : str
+        The default kwargs as shown in the macro's input field.
+    default_kwargs : Mapping
+        The default kwargs with their templates evaluated.
+    sleep_s : float | None
+        Spacing of the groups.
+    delay_s : float
+        Delay before the first group is sent.
+    wait_ack : bool
+        Whether each group waits for the acknowledgements of its modules.
+    ack_timeout_s : float
+        Time to wait for the acknowledgements.
+    """
+
+    name: str
+    groups: tuple[tuple[MacroCommand, ...], ...]
+    default_input: str = ""
+    default_kwargs: Mapping = field(default_factory=lambda: MappingProxyType({}))
+    sleep_s: float | None = None
+    delay_s: float = 0.0
+    wait_ack: bool = False
+    ack_timeout_s: float = 1.0
+
+    def kwargs(self, text: str | None) -> dict:
+        """The kwargs of the macro's input field."""
+        if not text:
+            return {}
+        if text == self.default_input:
+            return dict(self.default_kwargs)
+        return evaluate_templates(ast.literal_eval(text))
+
+    def steps(self, kwargs: Mapping) -> list[MacroStep]:
+        """The steps of a run with the given kwargs."""
+        return [
+            MacroStep(
+                target=cmd.target,
+                message=cmd.message(kwargs),
+                offset_s=(i + 1) * self.sleep_s if self.sleep_s else 0.0,
+                group=i,
+                wait_ack=self.wait_ack,
+            )
+            for i, group in enumerate(self.groups)
+            for cmd in group
+        ]
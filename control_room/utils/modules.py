@@ -1,10 +1,17 @@
+import queue
+import socket
 import sys
+import threading
 import time
+from collections.abc import Callable
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any
+from typing import Any, ClassVar
 
-from dareplane_utils.module_handling.communication import SocketCommunicator
+from dareplane_utils.module_handling.communication import (
+    Communicator,
+    SocketCommunicator,
+)
 from dareplane_utils.module_handling.launcher import (
     ExeLauncher,
     PythonLauncher,
@@ -12,7 +19,13 @@ from dareplane_utils.module_handling.launcher import (
 )
 from dareplane_utils.module_handling.module_connection import ModuleConnection
 
+from control_room.utils.config import get_module_dependencies
+from control_room.utils.health import ModuleHealth
+from control_room.utils.latency import PcommExchange, PcommLatency
 from control_room.utils.logging import logger
+from control_room.utils.outbound import OutboundQueue, PartialWriteError
+from control_room.utils.scheduling import SchedulingProfile
+from control_room.utils.supervisor import RestartPolicy
 
 # infrastructure pcomms reported by every module, but not meant to be
 # triggered manually from the GUI
@@ -35,10 +48,55 @@ class ControlRoomModuleConnection(ModuleConnection):
 
     pcomms: list[str] = field(default_factory=list)
     pcomms_defaults: dict | None = None  # PCOMMS stemming from the config
+    # names of the modules which must be ready before this one is started
+    depends_on: list[str] = field(default_factory=list)
+    # what the ProcessSupervisor does if the module's process exits
+    restart_policy: RestartPolicy = field(default_factory=RestartPolicy)
+    # affinity, niceness and policy for the module's process tree, and the
+    # settings which were actually applied after launching
+    scheduling: SchedulingProfile = field(default_factory=SchedulingProfile)
+    scheduling_effective: dict[str, Any] = field(default_factory=dict)
 
     # time of the last `UP` acknowledgement, set by the CallbackBroker which
     # reads from the same socket as `is_up`
     last_up_ack: float = 0.0
+    # Number of `UP`s written to the module and acknowledgements received.
+    # The module answers in order, so the n-th `UP` is acknowledged once
+    # `up_acked` reaches n, see `send_up` and `wait_up_ack`.
+    up_sent: int = 0
+    up_acked: int = 0
+
+    # frames queued via `enqueue_message` are sent by a writer thread of this
+    # connection, so the sender never blocks on the module's TCP window
+    outbound_maxsize: int = 1024
+    # time after which a send to a module which does not read is given up
+    send_timeout_s: float = 5.0
+    outbound: OutboundQueue = field(init=False, repr=False)
+    # liveness as seen by the HealthMonitor, read e.g. by the GUI
+    health: ModuleHealth = field(init=False, repr=False)
+    # round-trip latencies of the sent pcomms, see `_register_frames`
+    latency: PcommLatency = field(init=False, repr=False)
+    # Opt-in: follow every command by an `UP`, whose acknowledgement ends the
+    # round trip of commands the module does not reply to. It changes what
+    # is sent to the module, so it is not used for modules which do not
+    # answer `UP` or parse their input differently, i.e. AO modules.
+    latency_up: bool = False
+    # whether the module answers the `UP` heartbeats of the HealthMonitor
+    heartbeat: ClassVar[bool] = True
+    # set while an unterminated reply, e.g. to `GET_PCOMMS`, is awaited. The
+    # CallbackBroker hands it over if it reads the reply from the socket.
+    reply_waiter: queue.SimpleQueue | None = field(default=None, init=False, repr=False)
+    # serializes the writer thread and direct `send_message` calls, as
+    # concurrent sends could otherwise interleave partial frames
+    _send_lock: threading.RLock = field(
+        default_factory=threading.RLock, init=False, repr=False
+    )
+    # remainder of a partial write, see `_write`, and the socket written last
+    _unsent: bytes = field(default=b"", init=False, repr=False)
+    _write_socket: socket.socket | None = field(default=None, init=False, repr=False)
+    _up_ack_cond: threading.Condition = field(
+        default_factory=threading.Condition, init=False, repr=False
+    )
 
     @property
     def gui_pcomms(self) -> list[str]:
@@ -50,19 +108,36 @@ class ControlRoomModuleConnection(ModuleConnection):
         """
         return [pc for pc in self.pcomms if pc not in GUI_HIDDEN_PCOMMS]
 
-    def get_pcommands(self) -> None:
+    def get_pcommands(self, timeout_s: float = 1.0) -> None:
+        """
+        Query the module's pcomms via `GET_PCOMMS`.
+
+        The reply is awaited for up to `timeout_s`, once data arrived, it is
+        read until the module pauses sending.
+
+        Parameters
+        ----------
+        timeout_s : float
+            Time to wait for the first part of the reply.
+        """
         try:
             if not self.communicator:
                 logger.warning(
                     f"Cannot get pcomms for {self.name} because it has no communicator"
                 )
                 return
-            self.communicator.send(b"GET_PCOMMS;")
-            time.sleep(0.1)
-            msg = self.communicator.receive(2048 * 8)
-            decoded = msg.decode().strip()
+            self.reply_waiter = queue.SimpleQueue()
+            try:
+                self.communicator.send(b"GET_PCOMMS;")
+                msg = self._receive_reply(timeout_s)
+            finally:
+                self.reply_waiter = None
+            # acknowledgements of previous `UP` checks could precede the reply
+            decoded = msg.lstrip(b"1").decode().strip()
             if decoded:
                 self.pcomms = decoded.split("|")
+            else:
+                logger.warning(f"Timeout while getting pcomms for {self.name}")
         except TimeoutError:
             logger.warning(f"Timeout while getting pcomms for {self.name}")
         except UnicodeDecodeError:
@@ -70,6 +145,47 @@ class ControlRoomModuleConnection(ModuleConnection):
         except Exception as e:
             logger.error(f"Failed to get pcomms for {self.name}: {e}")
 
+    def _receive_reply(self, timeout_s: float, pause_s: float = 0.01) -> bytes:
+        """
+        Read a reply which is not terminated, i.e. until the module pauses.
+
+        If the CallbackBroker reads the socket, it hands the reply over via
+        `reply_waiter` instead.
+        """
+        if not isinstance(self.communicator, SocketCommunicator):
+            time.sleep(0.1)
+            return self.communicator.receive(2048 * 8)  # type: ignore
+
+        msocket = self.communicator.socket_c
+        if msocket is None:
+            return b""
+
+        prev_timeout = msocket.gettimeout()
+        fragments = []
+        deadline = time.monotonic() + timeout_s
+        try:
+            msocket.settimeout(pause_s)
+            while not fragments and time.monotonic() < deadline:
+                if self.reply_waiter is not None:
+                    try:
+                        return self.reply_waiter.get_nowait()
+                    except queue.Empty:
+                        pass
+                try:
+                    fragments.append(msocket.recv(2048 * 8))
+                except TimeoutError:
+                    pass
+
+            while fragments and fragments[-1]:
+                try:
+                    fragments.append(msocket.recv(2048 * 8))
+                except TimeoutError:
+                    break
+        finally:
+            msocket.settimeout(prev_timeout)
+
+        return b"".join(fragments)
+
     def is_up(self, timeout_s: float = 0.1) -> bool:
         """
         Check whether the module's server is responsive.
@@ -77,7 +193,7 @@ class ControlRoomModuleConnection(ModuleConnection):
         Sends the `UP` command and waits for the module's `1` acknowledgement.
         The reply is not read here directly: while the CallbackBroker is running
         it reads from the same socket, so the acknowledgement is recorded by the
-        broker via `last_up_ack`. If no broker is running, the reply is read
+        broker via `record_up_ack`. If no broker is running, the reply is read
         from the socket instead. A missing acknowledgement within `timeout_s`
         is interpreted as the module being down.
 
@@ -95,18 +211,19 @@ class ControlRoomModuleConnection(ModuleConnection):
             return False
 
         try:
-            sent_at = time.time()
-            self.send_message(b"UP")
+            seq = self.send_up()
 
-            deadline = sent_at + timeout_s
+            deadline = time.time() + timeout_s
             while time.time() < deadline:
-                if self.last_up_ack >= sent_at:
+                if self.up_acked >= seq:
                     return True
 
                 # no broker consuming the socket -> read the reply ourselves
                 try:
-                    if b"1" in self.communicator.receive(16):
-                        return True
+                    reply = self.communicator.receive(16)
+                    if b"1" in reply:
+                        self.record_up_ack(reply.count(b"1"))
+                        continue
                 except Exception:
                     pass
 
@@ -117,14 +234,202 @@ class ControlRoomModuleConnection(ModuleConnection):
             logger.debug(f"Module {self.name} did not respond to UP: {e}")
             return False
 
+    def send_message(self, msg: bytes):
+        """
+        Send a message to the module.
+
+        The time it is written is registered, the module's next reply ends
+        its round trip, see `latency`. With `latency_up`, the command is
+        followed by an `UP`, whose acknowledgement ends it as well.
+        """
+        msg = self._frame(msg)
+        if self.communicator:
+            self._write(msg)
+        else:
+            raise ConnectionError(
+                f"Cannot send message to module {self.name=} because it has no communicator"
+            )
+
+    def send_up(self) -> int:
+        """Send an `UP` and return its number, see `wait_up_ack`.
+
+        The frames queued before are written first, so the acknowledgement
+        implies that the module received them.
+        """
+        self.outbound.flush(timeout_s=self.send_timeout_s)
+        # reentrant, the number is taken before another `UP` is written
+        with self._send_lock:
+            n_sent = self.up_sent
+            self.send_message(b"UP")
+            if self.up_sent == n_sent:
+                raise ConnectionError(f"Cannot send UP to {self.name}, no socket")
+            return self.up_sent
+
+    def record_up_ack(self, n: int = 1, t: float | None = None):
+        """Record `n` acknowledgements of `UP`s, received at `t`."""
+        t = time.time() if t is None else t
+        with self._up_ack_cond:
+            self.last_up_ack = t
+            self.up_acked += n
+            n_acked = self.up_acked
+            self._up_ack_cond.notify_all()
+        self.latency.acked(n_acked, t=t)
+
+    def wait_up_ack(self, seq: int, timeout_s: float) -> bool:
+        """Wait until the `UP` numbered `seq` is acknowledged."""
+        with self._up_ack_cond:
+            return self._up_ack_cond.wait_for(
+                lambda: self.up_acked >= seq, timeout=timeout_s
+            )
+
+    def enqueue_message(self, msg: bytes) -> bool:
+        """
+        Queue a message to be sent by the connection's writer thread.
+
+        In contrast to `send_message`, this returns immediately. Messages
+        queued shortly after each other are coalesced into a single send.
+
+        Returns
+        -------
+        bool
+            False if the message was dropped as the outbound queue is full.
+        """
+        return self.outbound.put(self._frame(msg))
+
+    def _frame(self, msg: bytes) -> bytes:
+        if not msg.endswith(b";"):
+            msg += b";"
+        if self.latency_up and msg != b"UP;":
+            msg += b"UP;"
+        return msg
+
+    def _write(self, data: bytes):
+        """Write to the module while holding the send lock.
+
+        Sockets of the control room use a very short timeout, so a plain
+        `sendall` would fail as soon as the module's receive window is full.
+        The data is therefore sent in parts until everything is written or
+        `send_timeout_s` has passed. If the time runs out after a part was
+        written, the unsent remainder is kept and written before any further
+        data, as the module would otherwise read the rest of a later frame as
+        the end of the truncated one. The outbound queue retries the remainder
+        if nothing else is sent.
+        """
+        with self._send_lock:
+            # registered before writing, as the reply can arrive right away
+            n_up, exchanges = self._register_frames(data)
+            try:
+                written = self._write_registered(data)
+            except PartialWriteError:
+                self.up_sent += n_up
+                raise
+            except Exception:
+                self.latency.discard(exchanges)
+                raise
+            if written:
+                self.up_sent += n_up
+            else:
+                self.latency.discard(exchanges)
+
+    def _write_registered(self, data: bytes) -> bool:
+        """Write the data, returns False if there is nothing to write to."""
+        if not isinstance(self.communicator, SocketCommunicator):
+            if self.communicator:
+                self.communicator.send(data)
+            return bool(self.communicator)
+
+        msocket = self.communicator.socket_c
+        if msocket is None:
+            return False
+
+        if self._write_socket is not msocket:
+            # a remainder for a previous socket is meaningless to a new
+            # one, and `UP`s sent to it will not be acknowledged anymore
+            self._write_socket = msocket
+            self._unsent = b""
+            with self._up_ack_cond:
+                self.up_acked = self.up_sent
+        n_unsent = len(self._unsent)
+        data, self._unsent = self._unsent + data, b""
+
+        deadline = time.monotonic() + self.send_timeout_s
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[msocket.send(view) :]
+            except TimeoutError:
+                if time.monotonic() <= deadline:
+                    continue
+                n_written = len(data) - len(view)
+                msg = (
+                    f"Could not send to {self.name} within {self.send_timeout_s}s,"
+                    f" {len(view)} of {len(data)} bytes remaining"
+                )
+                if n_written == n_unsent:
+                    # nothing of the new data is on the wire, drop it
+                    raise TimeoutError(msg)
+
+                # finish the truncated frame first. If not even the
+                # previous remainder got out, the new data is dropped.
+                end = n_unsent if n_written < n_unsent else len(data)
+                self._unsent = data[n_written:end]
+                self.outbound.retry()
+                if n_written < n_unsent:
+                    raise TimeoutError(msg)
+                raise PartialWriteError(msg)
+        return True
+
+    def _register_frames(self, data: bytes) -> tuple[int, list[PcommExchange]]:
+        """Register the commands of a write and count its `UP`s.
+
+        A command directly followed by an `UP` is done once the `UP` is
+        acknowledged, see `latency_up`.
+        """
+        t = time.time()
+        prev = None
+        n_up = 0
+        exchanges = []
+        for frame in data.split(b";"):
+            if frame == b"UP":
+                n_up += 1
+                if prev is not None:
+                    prev.up_seq = self.up_sent + n_up
+                prev = None
+            elif frame:
+                pcomm = frame.split(b"|", 1)[0].decode(errors="replace")
+                # e.g. the reply to `GET_PCOMMS` is awaited by `get_pcommands`
+                if pcomm in GUI_HIDDEN_PCOMMS:
+                    prev = None
+                    continue
+                prev = self.latency.sent(pcomm, t)
+                exchanges.append(prev)
+        return n_up, exchanges
+
+    def latency_summary(self) -> dict[str, dict]:
+        return self.latency.summary()
+
+    def stop(self):
+        # the queue does not exist if the initialization failed
+        if hasattr(self, "outbound"):
+            self.outbound.stop()
+        super().stop()
+
     def __post_init__(self):
-        # Populate the pcommands with what we get from the server
-        self.get_pcommands()
+        self.outbound = OutboundQueue(
+            name=self.name, write=self._write, maxsize=self.outbound_maxsize
+        )
+        self.health = ModuleHealth(name=self.name)
+        self.latency = PcommLatency()
+        if self.latency_up and (not self.heartbeat or is_ao_module(self.name)):
+            logger.warning(f"{self.name} does not answer `UP`, ignoring latency_up")
+            self.latency_up = False
 
 
 # Needed for connections which are not managing any processes but are network conncetions only
 @dataclass
 class ControlRoomModuleConnectionConnectOnly(ControlRoomModuleConnection):
+    heartbeat: ClassVar[bool] = False
+
     def get_pcommands(self):
         self.pcomms = list(self.pcomms_defaults.keys())
 
@@ -132,6 +437,17 @@ class ControlRoomModuleConnectionConnectOnly(ControlRoomModuleConnection):
         return True
 
 
+def is_ao_module(module_name: str) -> bool:
+    """
+    Helper function for as long as there is a special treatment for the AO modules
+    ie. until the TCP servers are built properly.
+
+    Have a separate function as this logic might be extended
+    """
+
+    return "dp-ao-comm" in module_name
+
+
 def _resolve_cfg_path(path_value: str, cfg_file: Path) -> Path:
     path = Path(path_value).expanduser()
     if path.is_absolute():
@@ -157,14 +473,41 @@ def _get_required_field(dict, key) -> Any:
 
 
 def initialize_modules(
-    cfg: dict[str, Any], cfg_file: Path
+    cfg: dict[str, Any],
+    cfg_file: Path,
+    communicator_cls: Callable[..., Communicator] = SocketCommunicator,
+    connection_cls: type[ControlRoomModuleConnection] = ControlRoomModuleConnection,
 ) -> list[ControlRoomModuleConnection]:
+    """
+    Create the module connections as configured in the `[modules]` section.
+
+    Parameters
+    ----------
+    cfg : dict[str, Any]
+        The config, as returned by `check_and_transform_legacy_cfg`.
+    cfg_file : Path
+        Path of the config file, used to resolve relative paths.
+    communicator_cls : Callable[..., Communicator]
+        Factory for the communicators of socket connected modules, called with
+        the arguments of `SocketCommunicator`.
+    connection_cls : type[ControlRoomModuleConnection]
+        Class used for modules which are launched by the control room.
+
+    Returns
+    -------
+    list[ControlRoomModuleConnection]
+        The (not yet started) connections, in order of the config. The
+        `depends_on` list of a module's config is stored on its connection.
+    """
     connections: list[ControlRoomModuleConnection] = []
 
     modules_cfg = cfg.get("modules", {})
     if not isinstance(modules_cfg, dict):
         raise TypeError("Config key 'modules' must be a table/object")
 
+    # validated before any connection is created, to fail on cycles early
+    dependencies = get_module_dependencies(cfg)
+
     modules_root = modules_cfg.get("modules_root", None)
     modules = [m for m in modules_cfg.items() if isinstance(m[1], dict)]  # type: ignore
 
@@ -236,7 +579,7 @@ def initialize_modules(
             port = int(conn_port)
             retry_after_s = float(connection_cfg.get("retry_after_s", 1.0))
             max_connect_retries = int(connection_cfg.get("max_connect_retries", 3))
-            communicator = SocketCommunicator(
+            communicator = communicator_cls(
                 ip=ip,
                 port=port,
                 name=name,
@@ -265,14 +608,19 @@ def initialize_modules(
                 launcher=launcher,
                 communicator=communicator,
                 pcomms_defaults=cfg_pcomms,
+                depends_on=dependencies[name],
             )
 
         else:
-            connection = ControlRoomModuleConnection(
+            connection = connection_cls(
                 name=name,
                 launcher=launcher,
                 communicator=communicator,
                 pcomms_defaults=cfg_pcomms,
+                depends_on=dependencies[name],
+                restart_policy=RestartPolicy.from_cfg(module_cfg),
+                scheduling=SchedulingProfile.from_cfg(module_cfg),
+                latency_up=bool(module_cfg.get("latency_up", False)),
             )
 
         connections.append(connection)
@@ -0,0 +1,196 @@
+# Bounded outbound queue per module, drained by a dedicated writer thread
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from control_room.utils.logging import logger
+
+
+class PartialWriteError(TimeoutError):
+    """
+    Raised by a write which ran out of time after part of the data was sent.
+
+    The writer keeps the unsent remainder and sends it before any further
+    data, so the frames count as handed over. `OutboundQueue.retry` makes
+    sure the remainder is sent even if no further frame is queued.
+    """
+
+
+@dataclass
+class OutboundQueue:
+    """
+    A bounded queue of frames which are written to a module by its own thread.
+
+    Producers, e.g. the CallbackBroker, only append to the queue and never
+    block on the peer's TCP window. The writer thread takes everything queued
+    at once and hands it to `write` as a single buffer, so a burst of frames
+    results in a single send.
+
+    Attributes
+    ----------
+    name : str
+        Name of the module the queue belongs to, used for logging and the
+        writer thread's name.
+    write : Callable[[bytes], None]
+        Function writing the coalesced frames to the module.
+    maxsize : int
+        Maximum number of queued frames. Frames put to a full queue are dropped.
+    max_batch_bytes : int
+        Upper bound of bytes coalesced into a single write.
+    sent : int
+        Number of frames handed to `write`.
+    dropped : int
+        Number of frames dropped, either because the queue was full or
+        stopped, or the write failed.
+    retry_after_s : float
+        Delay before an empty write is issued after `retry`, which lets the
+        writer send the remainder of a partial write.
+    """
+
+    name: str
+    write: Callable[[bytes], None] = field(repr=False)
+    maxsize: int = 1024
+    max_batch_bytes: int = 2**16
+    sent: int = 0
+    dropped: int = 0
+    retry_after_s: float = 0.05
+
+    _frames: deque[bytes] = field(default_factory=deque, repr=False)
+    _cond: threading.Condition = field(default_factory=threading.Condition, repr=False)
+    _in_flight: int = field(default=0, repr=False)
+    _retry_at: float | None = field(default=None, repr=False)
+    _stop_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    @property
+    def depth(self) -> int:
+        """Number of frames waiting to be written."""
+        return len(self._frames)
+
+    def put(self, frame: bytes) -> bool:
+        """
+        Queue a frame for sending, starting the writer thread if necessary.
+
+        Returns
+        -------
+        bool
+            False if the frame was dropped as the queue is full or stopped.
+        """
+        with self._cond:
+            if self._stop_event.is_set():
+                self.dropped += 1
+                logger.warning(
+                    f"Outbound queue of {self.name} is stopped, dropping {frame=}"
+                )
+                return False
+            if len(self._frames) >= self.maxsize:
+                self.dropped += 1
+                logger.warning(
+                    f"Outbound queue of {self.name} is full, dropping {frame=}"
+                )
+                return False
+
+            self._frames.append(frame)
+            self._cond.notify_all()
+
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+
+        return True
+
+    def retry(self):
+        """Issue an empty write after `retry_after_s`, unless frames are sent before."""
+        with self._cond:
+            if self._stop_event.is_set():
+                return
+            self._retry_at = time.monotonic() + self.retry_after_s
+            self._cond.notify_all()
+
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+
+    def start(self):
+        """Start the writer thread. A stopped queue is not started again."""
+        with self._cond:
+            if self._stop_event.is_set() or (
+                self._thread is not None and self._thread.is_alive()
+            ):
+                return
+            self._thread = threading.Thread(
+                target=self._run, name=f"{self.name}_writer", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout_s: float = 1.0):
+        """Stop the writer thread, frames still queued or put later are discarded."""
+        with self._cond:
+            self._stop_event.set()
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+            self._thread = None
+        with self._cond:
+            self.dropped += len(self._frames)
+            self._frames.clear()
+
+    def flush(self, timeout_s: float | None = None) -> bool:
+        """
+        Wait until all queued frames are written.
+
+        Returns
+        -------
+        bool
+            False if frames were still pending when the timeout expired.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._frames and self._in_flight == 0, timeout=timeout_s
+            )
+
+    def _take_batch(self) -> list[bytes]:
+        batch = [self._frames.popleft()]
+        nbytes = len(batch[0])
+        while self._frames and nbytes + len(self._frames[0]) <= self.max_batch_bytes:
+            frame = self._frames.popleft()
+            nbytes += len(frame)
+            batch.append(frame)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._frames and not self._stop_event.is_set():
+                    if self._retry_at is None:
+                        self._cond.wait()
+                    elif (wait_s := self._retry_at - time.monotonic()) > 0:
+                        self._cond.wait(wait_s)
+                    else:
+                        break
+                if self._stop_event.is_set():
+                    return
+                # any write sends the remainder first, so the retry is covered
+                self._retry_at = None
+                batch = self._take_batch() if self._frames else []
+                self._in_flight = len(batch)
+
+            written = False
+            try:
+                self.write(b"".join(batch))
+                written = True
+            except PartialWriteError as e:
+                logger.warning(f"Partial write to {self.name}, retrying: {e}")
+                written = True
+            except Exception as e:
+                logger.error(
+                    f"Failed to send {len(batch)} frame(s) to {self.name}: {e}"
+                )
+            finally:
+                with self._cond:
+                    if written:
+                        self.sent += len(batch)
+                    else:
+                        self.dropped += len(batch)
+                    self._in_flight = 0
+                    self._cond.notify_all()
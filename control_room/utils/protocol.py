@@ -0,0 +1,183 @@
+# Timelines of commands sent at fixed offsets, e.g. for block design experiments
+import csv
+import json
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+
+from control_room.utils.config import toml_load
+from control_room.utils.modules import _resolve_cfg_path
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ProtocolEvent:
+    """
+    A command of a protocol.
+
+    Attributes
+    ----------
+    t_offset_s : float
+        Send time relative to the start of the protocol.
+    module : str
+        Name of the target module.
+    pcomm : str
+        The primary command.
+    payload : Mapping | None
+        Sent as json alongside the command.
+    """
+
+    t_offset_s: float
+    module: str
+    pcomm: str
+    payload: Mapping | None = None
+
+
+@dataclass(frozen=True)
+class Protocol:
+    """
+    A timeline of commands, ordered by their offsets.
+
+    Attributes
+    ----------
+    name : str
+        Name of the protocol, as shown in the GUI.
+    events : tuple[ProtocolEvent, ...]
+        The events, with repetitions already expanded.
+    """
+
+    name: str
+    events: tuple[ProtocolEvent, ...]
+
+    @property
+    def duration_s(self) -> float:
+        return self.events[-1].t_offset_s if self.events else 0.0
+
+    @property
+    def modules(self) -> set[str]:
+        return {ev.module for ev in self.events}
+
+
+def _event(t_offset_s, module, pcomm, payload=None, source="") -> ProtocolEvent:
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload) if payload.strip() else None
+        except json.JSONDecodeError as e:
+            raise ProtocolError(
+                f"Invalid json payload of {pcomm!r} at {t_offset_s}s in {source}: {e}"
+            )
+    if payload is not None and not isinstance(payload, Mapping):
+        raise ProtocolError(f"Payload of {pcomm!r} at {t_offset_s}s is not a table")
+    if ";" in pcomm:
+        raise ProtocolError(f"Found the reserved character `;` in {pcomm!r}")
+    return ProtocolEvent(
+        t_offset_s=float(t_offset_s),
+        module=str(module),
+        pcomm=str(pcomm),
+        payload=MappingProxyType(dict(payload)) if payload else None,
+    )
+
+
+def repeat_events(
+    events: list[ProtocolEvent], repeat: int, period_s: float | None
+) -> list[ProtocolEvent]:
+    """Repeat a block of events `repeat` times, every `period_s`."""
+    if repeat <= 1:
+        return events
+    block_s = max((ev.t_offset_s for ev in events), default=0.0)
+    if period_s is None or period_s <= block_s:
+        raise ProtocolError(
+            f"Repeating a protocol requires a period_s longer than its last"
+            f" offset of {block_s}s, got {period_s=}"
+        )
+    return [
+        _event(ev.t_offset_s + i * period_s, ev.module, ev.pcomm, ev.payload)
+        for i in range(repeat)
+        for ev in events
+    ]
+
+
+def load_protocol(file: Path, name: str | None = None) -> Protocol:
+    """
+    Load a protocol from a toml or csv file.
+
+    A toml file lists the events as `[[events]]` tables with the keys `t`,
+    `module`, `pcomm` and optionally `payload`. The block of events can be
+    repeated with `repeat` and `period_s` at the top level. A csv file has
+    the columns `t_offset`, `module`, `pcomm` and optionally `payload`, given
+    as json.
+
+    Parameters
+    ----------
+    file : Path
+        The toml or csv file.
+    name : str | None
+        Name of the protocol, defaults to the `name` in a toml file or to
+        the file name.
+
+    Returns
+    -------
+    Protocol
+        The protocol, with its events ordered by their offsets.
+    """
+    file = Path(file)
+    if file.suffix == ".csv":
+        with open(file, newline="") as f:
+            rows = list(csv.DictReader(f))
+        try:
+            events = [
+                _event(
+                    r["t_offset"],
+                    r["module"],
+                    r["pcomm"],
+                    r.get("payload", None),
+                    # the header is the first line
+                    source=f"{file}, line {i + 2}",
+                )
+                for i, r in enumerate(rows)
+            ]
+        except KeyError as e:
+            raise ProtocolError(f"Missing column {e} in {file}")
+    else:
+        cfg = toml_load(file)
+        name = name or cfg.get("name", None)
+        try:
+            events = [
+                _event(
+                    ev["t"],
+                    ev["module"],
+                    ev["pcomm"],
+                    ev.get("payload", None),
+                    source=f"{file}, event {i + 1}",
+                )
+                for i, ev in enumerate(cfg.get("events", []))
+            ]
+        except KeyError as e:
+            raise ProtocolError(f"Missing key {e} in an event of {file}")
+        events = repeat_events(events, cfg.get("repeat", 1), cfg.get("period_s", None))
+
+    if any(ev.t_offset_s < 0 for ev in events):
+        raise ProtocolError(f"Negative offsets in {file}")
+
+    return Protocol(
+        name=name or file.stem,
+        # stable, so events at the same offset keep the order of the file
+        events=tuple(sorted(events, key=lambda ev: ev.t_offset_s)),
+    )
+
+
+def get_protocols(cfg: dict, cfg_file: Path) -> dict[str, Protocol]:
+    """
+    Load the protocols listed in the `[protocols]` section of a config.
+
+    The entries map the names of the protocols to their files, which are
+    resolved relative to the config file.
+    """
+    return {
+        name: load_protocol(_resolve_cfg_path(str(path), cfg_file), name=name)
+        for name, path in cfg.get("protocols", {}).items()
+    }
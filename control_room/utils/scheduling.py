@@ -0,0 +1,242 @@
+# CPU affinity, niceness and scheduling policy of module processes and of the
+# control room's own threads
+import os
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+import psutil
+
+from control_room.utils.logging import logger
+
+# scheduling policies as used in the config, available on linux only
+SCHED_POLICIES: dict[str, str] = {
+    "other": "SCHED_OTHER",
+    "batch": "SCHED_BATCH",
+    "idle": "SCHED_IDLE",
+    "fifo": "SCHED_FIFO",
+    "rr": "SCHED_RR",
+}
+RT_POLICIES = ("fifo", "rr")
+
+
+@dataclass
+class SchedulingProfile:
+    """
+    Scheduling settings for a process or thread.
+
+    Attributes
+    ----------
+    cpu_affinity : list[int] | None
+        Indices of the CPUs to run on.
+    nice : int | None
+        Niceness, from -20 (highest priority) to 19. Mapped to the closest
+        priority class on windows.
+    sched_policy : str | None
+        One of `other`, `batch`, `idle`, `fifo` or `rr`. Linux only.
+    rt_priority : int | None
+        Static priority (1-99) for the real-time policies `fifo` and `rr`.
+    """
+
+    cpu_affinity: list[int] | None = None
+    nice: int | None = None
+    sched_policy: str | None = None
+    rt_priority: int | None = None
+
+    def __post_init__(self):
+        if self.sched_policy is not None and self.sched_policy not in SCHED_POLICIES:
+            raise ValueError(
+                f"Unsupported sched_policy {self.sched_policy!r}, use one of "
+                f"{list(SCHED_POLICIES)}"
+            )
+        if self.rt_priority is not None and self.sched_policy not in RT_POLICIES:
+            raise ValueError(
+                f"rt_priority requires sched_policy to be one of {RT_POLICIES}"
+            )
+
+    @classmethod
+    def from_cfg(cls, cfg: dict) -> "SchedulingProfile":
+        affinity = cfg.get("cpu_affinity", None)
+        nice = cfg.get("nice", None)
+        policy = cfg.get("sched_policy", None)
+        rt_priority = cfg.get("rt_priority", None)
+        return cls(
+            cpu_affinity=[int(c) for c in affinity] if affinity is not None else None,
+            nice=int(nice) if nice is not None else None,
+            sched_policy=str(policy).strip().lower() if policy is not None else None,
+            rt_priority=int(rt_priority) if rt_priority is not None else None,
+        )
+
+    @property
+    def is_default(self) -> bool:
+        return (
+            self.cpu_affinity is None
+            and self.nice is None
+            and self.sched_policy is None
+        )
+
+
+def get_control_room_profiles(cfg: dict) -> dict[str, SchedulingProfile]:
+    """
+    Profiles of the control room's own threads from the `[control_room]` section.
+
+    `[control_room.broker]` is used for the thread routing the callbacks (or
+    the broker process) and `[control_room.gui]` for the waitress workers.
+    """
+    section = cfg.get("control_room", {})
+    return {
+        part: SchedulingProfile.from_cfg(section.get(part, {}))
+        for part in ["broker", "gui"]
+    }
+
+
+def describe_scheduling(effective: dict[str, Any]) -> str:
+    """Short summary of the effective settings, e.g. for the GUI."""
+    if not effective:
+        return "default scheduling"
+    return " ".join(f"{k}={v}" for k, v in effective.items())
+
+
+def _windows_priority_class(nice: int) -> int:
+    if nice <= -15:
+        return psutil.HIGH_PRIORITY_CLASS  # realtime class is left out on purpose
+    if nice < 0:
+        return psutil.ABOVE_NORMAL_PRIORITY_CLASS
+    if nice == 0:
+        return psutil.NORMAL_PRIORITY_CLASS
+    if nice < 15:
+        return psutil.BELOW_NORMAL_PRIORITY_CLASS
+    return psutil.IDLE_PRIORITY_CLASS
+
+
+def _apply(
+    profile: SchedulingProfile, id_: int, name: str, is_thread: bool
+) -> dict[str, Any]:
+    """Apply the profile to a pid, or on linux a thread's native id."""
+    effective: dict[str, Any] = {}
+
+    if profile.cpu_affinity is not None:
+        try:
+            if is_thread:
+                os.sched_setaffinity(id_, profile.cpu_affinity)
+                effective["cpu_affinity"] = sorted(os.sched_getaffinity(id_))
+            else:
+                proc = psutil.Process(id_)
+                proc.cpu_affinity(profile.cpu_affinity)
+                effective["cpu_affinity"] = proc.cpu_affinity()
+        except (PermissionError, psutil.AccessDenied) as e:
+            logger.warning(f"No permission to set the cpu affinity of {name}: {e}")
+        except (AttributeError, ValueError, OSError) as e:
+            # e.g. not supported on macOS or CPUs which do not exist
+            logger.warning(
+                f"Cannot set cpu affinity {profile.cpu_affinity} of {name}: {e}"
+            )
+
+    if profile.nice is not None:
+        try:
+            if is_thread:
+                # on linux, the niceness is a per thread attribute
+                os.setpriority(os.PRIO_PROCESS, id_, profile.nice)
+                effective["nice"] = os.getpriority(os.PRIO_PROCESS, id_)
+            elif sys.platform == "win32":
+                proc = psutil.Process(id_)
+                proc.nice(_windows_priority_class(profile.nice))
+                effective["nice"] = str(proc.nice())
+            else:
+                proc = psutil.Process(id_)
+                proc.nice(profile.nice)
+                effective["nice"] = proc.nice()
+        except (PermissionError, psutil.AccessDenied) as e:
+            logger.warning(
+                f"No permission to set nice={profile.nice} for {name}, lowering"
+                " the niceness usually requires elevated privileges"
+                f" (e.g. CAP_SYS_NICE): {e}"
+            )
+        except OSError as e:
+            logger.warning(f"Cannot set nice={profile.nice} for {name}: {e}")
+
+    if profile.sched_policy is not None:
+        if not hasattr(os, "sched_setscheduler"):
+            logger.warning(
+                f"Scheduling policies are not supported on {sys.platform}, "
+                f"ignoring sched_policy={profile.sched_policy} for {name}"
+            )
+        else:
+            policy = getattr(os, SCHED_POLICIES[profile.sched_policy])
+            priority = profile.rt_priority or 0
+            if profile.sched_policy in RT_POLICIES and not priority:
+                priority = 1
+            try:
+                os.sched_setscheduler(id_, policy, os.sched_param(priority))
+                effective["sched_policy"] = profile.sched_policy
+                if profile.sched_policy in RT_POLICIES:
+                    effective["rt_priority"] = os.sched_getparam(id_).sched_priority
+            except PermissionError as e:
+                logger.warning(
+                    f"No permission to set sched_policy={profile.sched_policy} for"
+                    f" {name}, real-time policies require elevated privileges"
+                    f" (e.g. CAP_SYS_NICE or an rtprio limit). Keeping the default"
+                    f" policy: {e}"
+                )
+            except OSError as e:
+                logger.warning(
+                    f"Cannot set sched_policy={profile.sched_policy} for {name}: {e}"
+                )
+
+    return effective
+
+
+def apply_to_process_tree(
+    profile: SchedulingProfile, pid: int, name: str
+) -> dict[str, Any]:
+    """
+    Apply a profile to a process and all of its children.
+
+    Returns
+    -------
+    dict[str, Any]
+        The settings in effect for the parent process, after applying.
+    """
+    if profile.is_default:
+        return {}
+
+    effective = _apply(profile, pid, name, is_thread=False)
+    try:
+        children = psutil.Process(pid).children(recursive=True)
+    except psutil.Error:
+        children = []
+    for child in children:
+        _apply(profile, child.pid, f"{name} (child {child.pid})", is_thread=False)
+
+    logger.info(f"Scheduling of {name}: {describe_scheduling(effective)}")
+    return effective
+
+
+def apply_to_threads(
+    profile: SchedulingProfile, threads: list[threading.Thread | None], name: str
+) -> dict[str, Any]:
+    """
+    Apply a profile to threads of the control room.
+
+    Only supported on linux, where affinity, niceness and policy are set per
+    thread. On other platforms, a warning is logged and nothing is changed.
+    """
+    if profile.is_default:
+        return {}
+
+    if not sys.platform.startswith("linux"):
+        logger.warning(
+            f"Scheduling of single threads is only supported on linux, "
+            f"keeping the defaults for {name}"
+        )
+        return {}
+
+    effective: dict[str, Any] = {}
+    for th in threads:
+        if th is None or th.native_id is None:
+            continue
+        effective = _apply(profile, th.native_id, f"{name} ({th.name})", True)
+
+    logger.info(f"Scheduling of {name}: {describe_scheduling(effective)}")
+    return effective
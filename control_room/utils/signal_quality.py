@@ -0,0 +1,200 @@
+# Per channel signal quality of the monitored LSL streams
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from control_room.utils.logging import logger
+from control_room.utils.lsl_monitor import StreamMonitor
+
+# rows of the quality arrays
+QUALITY_METRICS: tuple[str, ...] = (
+    "variance",
+    "flatline",
+    "clipping",
+    "nan_count",
+    "line_noise",
+)
+
+
+def channel_quality(
+    data: np.ndarray,
+    srate: float,
+    line_freq: float = 50.0,
+    line_bw: float = 1.0,
+    n_fft: int | None = None,
+) -> np.ndarray:
+    """
+    Quality metrics of all channels of a window of data.
+
+    All metrics are computed for all channels at once. The spectrum is
+    estimated from Hann windowed segments of `n_fft` samples, which are
+    transformed by a single batched FFT.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The samples, of shape (n_samples, n_channels).
+    srate : float
+        Sampling rate of the data.
+    line_freq : float
+        Frequency of the power line.
+    line_bw : float
+        The power within +/- `line_bw` Hz around `line_freq` is considered
+        line noise.
+    n_fft : int | None
+        Length of the FFT segments, defaults to one second of data.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (len(QUALITY_METRICS), n_channels) with the variance,
+        the fraction of repeated samples (flatline), the fraction of samples at
+        the channel's extremes (clipping), the number of NaNs and the fraction
+        of power at the line frequency.
+    """
+    x = np.asarray(data, dtype=np.float64)
+    n, n_ch = x.shape
+    q = np.zeros((len(QUALITY_METRICS), n_ch))
+    if n < 2:
+        return q
+
+    nans = np.isnan(x)
+    q[3] = nans.sum(axis=0)
+    if nans.any():
+        # NaNs are only counted, the other metrics use the remaining samples
+        x = np.where(nans, np.nanmean(x, axis=0), x)
+        x = np.nan_to_num(x)
+
+    q[0] = x.var(axis=0)
+    q[1] = (np.diff(x, axis=0) == 0).mean(axis=0)
+
+    lo, hi = x.min(axis=0), x.max(axis=0)
+    tol = (hi - lo) * 1e-6
+    at_extremes = (x <= lo + tol) | (x >= hi - tol)
+    # a flat channel is fully at its extremes, which is reported as flatline
+    q[2] = np.where(hi > lo, at_extremes.mean(axis=0), 0)
+
+    n_fft = min(n, n_fft or max(int(srate), 2))
+    n_seg = n // n_fft
+    if srate > 0 and line_freq + line_bw < srate / 2 and n_seg > 0:
+        segs = x[-n_seg * n_fft :].reshape(n_seg, n_fft, n_ch)
+        segs = segs - segs.mean(axis=1, keepdims=True)
+        segs *= np.hanning(n_fft)[None, :, None]
+        power = (np.abs(np.fft.rfft(segs, axis=1)) ** 2).mean(axis=0)
+        freqs = np.fft.rfftfreq(n_fft, d=1 / srate)
+        line = np.abs(freqs - line_freq) <= line_bw
+        total = power[1:].sum(axis=0)
+        q[4] = np.divide(
+            power[line].sum(axis=0), total, out=np.zeros(n_ch), where=total > 0
+        )
+
+    return q
+
+
+def quality_scores(q: np.ndarray, n_samples: int) -> np.ndarray:
+    """
+    Map the metrics of `channel_quality` to scores from 0 (good) to 1 (bad).
+
+    The variance is scored by its deviation from the median channel, a
+    decade of difference and more is scored as 1. Channels without any
+    variance are scored 1.
+    """
+    scores = np.zeros_like(q)
+    var = q[0]
+    with np.errstate(divide="ignore"):
+        log_var = np.log10(var)
+    valid = var > 0
+    if valid.any():
+        scores[0] = np.clip(np.abs(log_var - np.median(log_var[valid])), 0, 1)
+    scores[0][~valid] = 1
+    scores[1] = q[1]
+    # only a few samples at the extremes are expected for unclipped signals
+    scores[2] = np.clip(q[2] * 20, 0, 1)
+    scores[3] = q[3] / max(n_samples, 1)
+    scores[4] = q[4]
+    return scores
+
+
+@dataclass
+class QualityReport:
+    t: float
+    n_samples: int
+    values: np.ndarray  # (len(QUALITY_METRICS), n_channels)
+
+    @property
+    def scores(self) -> np.ndarray:
+        return quality_scores(self.values, self.n_samples)
+
+
+@dataclass
+class SignalQualityChecker:
+    """
+    Compute the channel quality of the monitored streams in the background.
+
+    Every `interval_s`, the last `window_s` of each numeric stream are taken
+    from the stream's ring buffer and evaluated with `channel_quality`.
+
+    Attributes
+    ----------
+    monitor : StreamMonitor
+        The monitor providing the buffered data.
+    window_s : float
+        Length of the evaluated window.
+    interval_s : float
+        Time between two evaluations.
+    line_freq : float
+        Frequency of the power line, usually 50 or 60 Hz.
+    reports : dict[str, QualityReport]
+        The latest report per stream key.
+    """
+
+    monitor: StreamMonitor
+    window_s: float = 2.0
+    interval_s: float = 1.0
+    line_freq: float = 50.0
+    reports: dict[str, QualityReport] = field(default_factory=dict)
+
+    _stop_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="signal_quality", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout_s: float = 3):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_s):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Failed to compute the signal quality: {e}")
+
+    def check(self):
+        streams = dict(self.monitor.streams)
+        for key, stream in streams.items():
+            srate = stream.entry.nominal_srate
+            if stream.buffer is None or srate <= 0:
+                continue
+            data = stream.latest(int(self.window_s * srate))
+            if len(data) < 2:
+                continue
+            self.reports[key] = QualityReport(
+                t=time.time(),
+                n_samples=len(data),
+                values=channel_quality(data, srate, line_freq=self.line_freq),
+            )
+
+        # forget streams which are no longer monitored
+        for key in list(self.reports):
+            if key not in streams:
+                self.reports.pop(key, None)
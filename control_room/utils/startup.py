@@ -0,0 +1,292 @@
+# Concurrent startup of the modules with readiness probes per module
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable
+
+from dareplane_utils.module_handling.communication import SocketCommunicator
+
+from control_room.utils.config import dependency_layers
+from control_room.utils.logging import logger
+from control_room.utils.modules import ControlRoomModuleConnection
+from control_room.utils.scheduling import apply_to_process_tree
+
+# time a single module gets to become ready
+STARTUP_TIMEOUT_S: float = 30
+
+
+class ModuleStartupError(RuntimeError):
+    pass
+
+
+@dataclass
+class StartupReport:
+    """
+    Outcome and timing of a module's startup.
+
+    Attributes
+    ----------
+    name : str
+        Name of the module.
+    phases : dict[str, float]
+        Duration in seconds of each completed phase, in order of execution.
+    ready : bool
+        True if all phases were completed.
+    error : str
+        Reason why the module did not become ready.
+    """
+
+    name: str
+    phases: dict[str, float] = field(default_factory=dict)
+    ready: bool = False
+    error: str = ""
+
+    @property
+    def total_s(self) -> float:
+        return sum(self.phases.values())
+
+    def __str__(self) -> str:
+        phases = " ".join(f"{k}={v * 1000:.0f}ms" for k, v in self.phases.items())
+        status = "ready" if self.ready else f"NOT READY ({self.error})"
+        return (
+            f"{self.name:<30} {status:<10} total={self.total_s * 1000:.0f}ms {phases}"
+        )
+
+
+@contextmanager
+def record_phase(report: StartupReport, phase: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        report.phases[phase] = time.perf_counter() - start
+
+
+def wait_with_backoff(
+    probe: Callable[[], bool],
+    deadline: float,
+    initial_s: float = 0.05,
+    max_s: float = 1.0,
+) -> bool:
+    """
+    Call `probe` until it returns True, doubling the pause after each failure.
+
+    Parameters
+    ----------
+    probe : Callable[[], bool]
+        The readiness check.
+    deadline : float
+        Point in time (`time.monotonic`) after which probing is given up.
+    initial_s : float
+        Pause after the first failed probe.
+    max_s : float
+        Upper bound of the pause between two probes.
+
+    Returns
+    -------
+    bool
+        True if the probe succeeded before the deadline.
+    """
+    delay = initial_s
+    while True:
+        if probe():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_s)
+
+
+def apply_module_scheduling(conn: ControlRoomModuleConnection):
+    """Apply the module's scheduling profile to its launched process tree."""
+    process = getattr(conn.launcher, "process", None)
+    if process is None:
+        return
+    conn.scheduling_effective = apply_to_process_tree(
+        conn.scheduling, process.pid, conn.name
+    )
+
+
+def _try_connect(conn: ControlRoomModuleConnection) -> bool:
+    """Single connection attempt, the retrying is done by the caller."""
+    process = getattr(conn.launcher, "process", None)
+    if process is not None and process.poll() is not None:
+        raise ModuleStartupError(f"Host process exited with code {process.returncode}")
+
+    communicator = conn.communicator
+    if not isinstance(communicator, SocketCommunicator):
+        conn.connect_to_module()
+        return True
+
+    retries = communicator.max_connect_retries
+    retry_after_s = communicator.retry_after_s
+    communicator.max_connect_retries, communicator.retry_after_s = 1, 0
+    try:
+        conn.connect_to_module()
+    except (ConnectionRefusedError, ConnectionResetError):
+        return False
+    finally:
+        communicator.max_connect_retries = retries
+        communicator.retry_after_s = retry_after_s
+
+    # direct reads by the probes must not block
+    if communicator.socket_c is not None:
+        communicator.socket_c.settimeout(0.001)
+
+    return True
+
+
+def not_ready_dependencies(dependencies: list[StartupReport]) -> str:
+    """Reason why a module cannot be started, empty if all dependencies are ready."""
+    not_ready = [r.name for r in dependencies if not r.ready]
+    return f"dependencies not ready: {not_ready}" if not_ready else ""
+
+
+def start_module(
+    conn: ControlRoomModuleConnection,
+    timeout_s: float = STARTUP_TIMEOUT_S,
+    dependencies: list[Future] | None = None,
+) -> StartupReport:
+    """
+    Launch a module and probe it until it is ready.
+
+    The phases are: launching the process, connecting once the port is open,
+    an acknowledged `UP` and an answered `GET_PCOMMS`. Each probe is retried
+    with an exponential backoff until `timeout_s` has passed.
+
+    Parameters
+    ----------
+    conn : ControlRoomModuleConnection
+        The connection of the module to start.
+    timeout_s : float
+        Time the module gets to pass all phases, starting once its
+        dependencies are ready.
+    dependencies : list[Future] | None
+        Futures of the StartupReports of the modules `conn` depends on. The
+        module is only launched if all of them became ready.
+
+    Returns
+    -------
+    StartupReport
+        The duration of each phase and whether the module became ready.
+    """
+    report = StartupReport(name=conn.name)
+
+    if dependencies:
+        with record_phase(report, "deps"):
+            report.error = not_ready_dependencies([f.result() for f in dependencies])
+        if report.error:
+            logger.error(f"Module {conn.name} is not started: {report.error}")
+            return report
+
+    deadline = time.monotonic() + timeout_s
+
+    def get_pcommands() -> bool:
+        conn.get_pcommands(timeout_s=0.2)
+        return len(conn.pcomms) > 0
+
+    probes: list[tuple[str, Callable[[], bool]]] = [
+        ("connect", lambda: _try_connect(conn)),
+        ("up", lambda: conn.is_up(timeout_s=0.1)),
+        ("pcomms", get_pcommands),
+    ]
+
+    try:
+        with record_phase(report, "launch"):
+            logger.debug(f"Launching {conn.name=}")
+            conn.launch_module()
+            apply_module_scheduling(conn)
+
+        for phase, probe in probes:
+            with record_phase(report, phase):
+                if not wait_with_backoff(probe, deadline):
+                    raise ModuleStartupError(f"timeout in phase '{phase}'")
+
+        report.ready = True
+    except Exception as e:
+        report.error = str(e)
+        logger.error(f"Module {conn.name} did not become ready: {e}")
+
+    return report
+
+
+def log_startup_report(reports: list[StartupReport]):
+    logger.info("Module startup report:\n" + "\n".join(str(r) for r in reports))
+
+
+def start_modules(
+    connections: list[ControlRoomModuleConnection],
+    timeout_s: float = STARTUP_TIMEOUT_S,
+) -> list[StartupReport]:
+    """
+    Start all modules concurrently and wait until each is ready or timed out.
+
+    A module is launched as soon as all modules of its `depends_on` are ready,
+    i.e. the modules of one layer of the dependency graph start concurrently.
+
+    Parameters
+    ----------
+    connections : list[ControlRoomModuleConnection]
+        The connections as created by `initialize_modules`.
+    timeout_s : float
+        Time each module gets to become ready.
+
+    Returns
+    -------
+    list[StartupReport]
+        A report per module, in the order of `connections`.
+    """
+    if not connections:
+        return []
+
+    by_name = {c.name: c for c in connections}
+    layers = dependency_layers({c.name: c.depends_on for c in connections})
+    logger.debug(f"Module startup layers: {layers}")
+
+    # submitted in topological order, so the futures of the dependencies exist
+    futures: dict[str, Future] = {}
+    with ThreadPoolExecutor(
+        max_workers=len(connections), thread_name_prefix="module_startup"
+    ) as pool:
+        for layer in layers:
+            for name in layer:
+                conn = by_name[name]
+                futures[name] = pool.submit(
+                    start_module,
+                    conn,
+                    timeout_s,
+                    [futures[d] for d in conn.depends_on],
+                )
+        reports = [futures[c.name].result() for c in connections]
+
+    log_startup_report(reports)
+    return reports
+
+
+def stop_modules(connections: list[ControlRoomModuleConnection]):
+    """
+    Stop the modules in reverse order of their dependencies.
+
+    A module is only stopped after all modules depending on it are stopped.
+    The modules of a layer are stopped concurrently.
+    """
+    if not connections:
+        return
+
+    by_name = {c.name: c for c in connections}
+    layers = dependency_layers({c.name: list(c.depends_on) for c in connections})
+
+    def stop(conn):
+        try:
+            conn.stop()
+        except Exception as e:
+            logger.error(f"Error while stopping {conn.name}: {e}")
+
+    with ThreadPoolExecutor(
+        max_workers=max(len(layer) for layer in layers),
+        thread_name_prefix="module_shutdown",
+    ) as pool:
+        for layer in reversed(layers):
+            list(pool.map(stop, [by_name[n] for n in layer]))
@@ -0,0 +1,198 @@
+# Restart module processes which exited, according to a per-module policy
+import threading
+from dataclasses import dataclass, field
+from typing import Any
+
+import psutil
+
+from control_room.utils.logging import logger
+
+RESTART_MODES: tuple[str, ...] = ("never", "on-failure", "always")
+
+
+@dataclass
+class RestartPolicy:
+    """
+    When and how often a module's process is restarted after it exited.
+
+    Attributes
+    ----------
+    mode : str
+        `never` (default), `on-failure` (only if the exit code is non-zero) or
+        `always`.
+    max_restarts : int
+        Maximum number of restarts of the module during a session.
+    backoff_s : float
+        Delay before the first restart, doubled for every further restart.
+    max_backoff_s : float
+        Upper bound of the delay before a restart.
+    """
+
+    mode: str = "never"
+    max_restarts: int = 3
+    backoff_s: float = 1.0
+    max_backoff_s: float = 30.0
+
+    def __post_init__(self):
+        if self.mode not in RESTART_MODES:
+            raise ValueError(
+                f"Unsupported restart policy {self.mode!r}, use one of {RESTART_MODES}"
+            )
+
+    @classmethod
+    def from_cfg(cls, module_cfg: dict) -> "RestartPolicy":
+        """Create the policy from the `restart*` keys of a `[modules.<name>]` block."""
+        return cls(
+            mode=str(module_cfg.get("restart", "never")).strip().lower(),
+            max_restarts=int(module_cfg.get("max_restarts", 3)),
+            backoff_s=float(module_cfg.get("restart_backoff_s", 1.0)),
+        )
+
+    def should_restart(self, returncode: int | None, restarts: int) -> bool:
+        if self.mode == "never" or restarts >= self.max_restarts:
+            return False
+        return self.mode == "always" or returncode != 0
+
+    def delay_s(self, restarts: int) -> float:
+        return min(self.backoff_s * 2**restarts, self.max_backoff_s)
+
+
+@dataclass
+class ProcessSupervisor:
+    """
+    Watch the processes of the modules and restart them if they exit.
+
+    A single thread waits on all module processes via `psutil.wait_procs`. If a
+    process exited, the module's `restart_policy` decides whether it is
+    launched again. A restart runs in its own thread, so the backoff of one
+    module does not delay the others. The restarted module goes through the
+    regular startup probes, i.e. it is reconnected and its pcomms are queried
+    again.
+
+    Attributes
+    ----------
+    connections : list
+        The module connections to supervise.
+    broker : Any
+        The CallbackBroker, which stops reading from a module while it is
+        restarted and picks up its new socket afterwards. Can be None.
+    startup_timeout_s : float
+        Time a restarted module has to become ready.
+    wait_s : float
+        Upper bound of a single wait for processes to exit, i.e. the time
+        after which a stop request or new processes are picked up.
+    """
+
+    connections: list
+    broker: Any = None
+    startup_timeout_s: float = 30
+    wait_s: float = 0.5
+
+    restarts: dict[str, int] = field(default_factory=dict)
+
+    _restarting: set[str] = field(default_factory=set, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _stop_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+    _procs: dict[int, psutil.Process] = field(default_factory=dict, repr=False)
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="process_supervisor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout_s: float = 3):
+        """Stop supervising, modules exiting from now on are not restarted."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+            self._thread = None
+
+    def _watched(self) -> dict[psutil.Process, Any]:
+        watched = {}
+        with self._lock:
+            for conn in self.connections:
+                process = getattr(conn.launcher, "process", None)
+                if process is None or conn.name in self._restarting:
+                    continue
+                if process.pid not in self._procs:
+                    try:
+                        self._procs[process.pid] = psutil.Process(process.pid)
+                    except psutil.NoSuchProcess:
+                        self._on_exit(conn, process.poll())
+                        continue
+                watched[self._procs[process.pid]] = conn
+        return watched
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            watched = self._watched()
+            if not watched:
+                self._stop_event.wait(self.wait_s)
+                continue
+
+            gone, _ = psutil.wait_procs(list(watched), timeout=self.wait_s)
+            for proc in gone:
+                self._procs.pop(proc.pid, None)
+                if not self._stop_event.is_set():
+                    with self._lock:
+                        self._on_exit(watched[proc], proc.returncode)
+
+    def _on_exit(self, conn, returncode: int | None):
+        """Apply the restart policy, only call while holding the lock."""
+        restarts = self.restarts.get(conn.name, 0)
+        policy: RestartPolicy = conn.restart_policy
+        if not policy.should_restart(returncode, restarts):
+            logger.error(
+                f"Module {conn.name} exited with {returncode=}, not restarting"
+                f" ({policy.mode=}, {restarts=})"
+            )
+            # forget the process, so it is not reported again
+            conn.launcher.process = None
+            return
+
+        delay_s = policy.delay_s(restarts)
+        logger.warning(
+            f"Module {conn.name} exited with {returncode=}, restarting in {delay_s}s"
+            f" (restart {restarts + 1}/{policy.max_restarts})"
+        )
+        self.restarts[conn.name] = restarts + 1
+        self._restarting.add(conn.name)
+        conn.health.restarting = True
+        threading.Thread(
+            target=self._restart,
+            args=(conn, delay_s),
+            name=f"{conn.name}_restart",
+            daemon=True,
+        ).start()
+
+    def _restart(self, conn, delay_s: float):
+        # imported here, as the startup depends on the module connections,
+        # which in turn use the RestartPolicy of this module
+        from control_room.utils.startup import start_module
+
+        try:
+            if self._stop_event.wait(delay_s):
+                return
+
+            # the startup probes read the replies from the socket themselves
+            if self.broker is not None:
+                self.broker.suspend(conn.name)
+            conn.stop_connection()
+            conn.launcher.terminate()  # reaps what is left of the old process
+            report = start_module(conn, self.startup_timeout_s)
+            conn.health.restarts = self.restarts[conn.name]
+            if report.ready:
+                logger.info(f"Module {conn.name} was restarted: {report}")
+            else:
+                logger.error(f"Restarted module {conn.name} did not become ready")
+        except Exception as e:
+            logger.error(f"Failed to restart module {conn.name}: {e}")
+        finally:
+            if self.broker is not None:
+                self.broker.resume(conn.name)
+            conn.health.restarting = False
+            with self._lock:
+                self._restarting.discard(conn.name)
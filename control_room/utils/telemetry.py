@@ -0,0 +1,169 @@
+# Resource usage of the module processes, sampled in the background
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import psutil
+from dareplane_utils.general.ringbuffer import RingBuffer
+
+from control_room.utils.logging import logger
+
+# columns of the history buffers, summed over a module's process tree
+METRICS: tuple[str, ...] = (
+    "cpu_percent",
+    "rss_mb",
+    "num_threads",
+    "num_fds",
+    "read_mb",
+    "write_mb",
+)
+
+
+@dataclass
+class TelemetryHistory:
+    """
+    Fixed size history of the METRICS of a single module.
+
+    Attributes
+    ----------
+    capacity : int
+        Number of samples kept, older samples are overwritten.
+    n_samples : int
+        Number of samples added so far.
+    """
+
+    capacity: int = 600
+    n_samples: int = 0
+    buffer: RingBuffer = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.buffer = RingBuffer(shape=(self.capacity, len(METRICS)), dtype=np.float64)
+
+    def add(self, t: float, values: np.ndarray):
+        self.buffer.add_samples([values], [t])
+        self.n_samples += 1
+
+    def unfold(self, last_n: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """The times and values of the latest samples, oldest first."""
+        n = min(self.n_samples, self.capacity)
+        if last_n is not None:
+            n = min(n, last_n)
+        if n == 0:
+            return np.zeros(0), np.zeros((0, len(METRICS)))
+        return self.buffer.unfold_buffer_t()[-n:], self.buffer.unfold_buffer()[-n:]
+
+    def to_dict(self, last_n: int | None = None) -> dict[str, list[float]]:
+        t, values = self.unfold(last_n)
+        d = {"t": t.tolist()}
+        d |= {m: values[:, i].tolist() for i, m in enumerate(METRICS)}
+        return d
+
+
+def sample_process_tree(proc: psutil.Process) -> np.ndarray:
+    """
+    Sum the METRICS over a process and all of its children.
+
+    `cpu_percent` is relative to the previous call for the same Process
+    object, so the same objects have to be passed for consecutive samples.
+    """
+    values = np.zeros(len(METRICS))
+    try:
+        procs = [proc] + proc.children(recursive=True)
+    except psutil.Error:
+        return values
+
+    for p in procs:
+        try:
+            with p.oneshot():
+                values[0] += p.cpu_percent(interval=None)
+                values[1] += p.memory_info().rss / 2**20
+                values[2] += p.num_threads()
+                # file descriptors are called handles on windows
+                values[3] += p.num_fds() if hasattr(p, "num_fds") else p.num_handles()
+                if hasattr(p, "io_counters"):  # not available on macOS
+                    io = p.io_counters()
+                    values[4] += io.read_bytes / 2**20
+                    values[5] += io.write_bytes / 2**20
+        except psutil.Error:
+            # e.g. a child exited in between or access is denied
+            continue
+
+    return values
+
+
+@dataclass
+class TelemetrySampler:
+    """
+    Periodically record the resource usage of each module's process tree.
+
+    Attributes
+    ----------
+    connections : list
+        The module connections, modules without a launched process are skipped.
+    interval_s : float
+        Time between two samples.
+    capacity : int
+        Number of samples kept per module.
+    history : dict[str, TelemetryHistory]
+        The recorded samples per module name.
+    """
+
+    connections: list
+    interval_s: float = 1.0
+    capacity: int = 600
+    history: dict[str, TelemetryHistory] = field(default_factory=dict)
+
+    # Process objects are kept, as `cpu_percent` is computed between calls
+    _procs: dict[str, psutil.Process] = field(default_factory=dict, repr=False)
+    _stop_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="telemetry_sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout_s: float = 3):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_s):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Failed to sample module telemetry: {e}")
+
+    def _process(self, conn) -> psutil.Process | None:
+        process = getattr(conn.launcher, "process", None)
+        if process is None:
+            return None
+
+        proc = self._procs.get(conn.name, None)
+        if proc is None or proc.pid != process.pid:  # e.g. after a restart
+            try:
+                proc = psutil.Process(process.pid)
+                proc.cpu_percent(interval=None)  # the first call is always 0
+            except psutil.Error:
+                return None
+            self._procs[conn.name] = proc
+        return proc
+
+    def sample(self):
+        t = time.time()
+        for conn in self.connections:
+            proc = self._process(conn)
+            if proc is None:
+                continue
+            if conn.name not in self.history:
+                self.history[conn.name] = TelemetryHistory(capacity=self.capacity)
+            self.history[conn.name].add(t, sample_process_tree(proc))
+
+    def snapshot(self, last_n: int | None = None) -> dict[str, dict[str, list[float]]]:
+        """The latest samples of all modules, e.g. to be served as json."""
+        return {n: h.to_dict(last_n) for n, h in list(self.history.items())}
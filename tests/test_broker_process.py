@@ -0,0 +1,169 @@
+import multiprocessing
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from control_room.broker_process import (
+    STARTUP_SEQ,
+    BrokerProcess,
+    BrokerProcessError,
+    RemoteModuleConnection,
+    describe_connection,
+    serve_requests,
+)
+from control_room.callbacks import CallbackBroker
+from control_room.utils.config import check_and_transform_legacy_cfg, toml_load
+from control_room.utils.macros import MacroExecutor, MacroStep
+from control_room.utils.modules import (
+    ControlRoomModuleConnectionConnectOnly,
+    NoopLauncher,
+)
+from tests.test_callback_broker import make_connection
+
+CFG_PATH = Path("./tests/resources/test_cfg.toml")
+
+
+@pytest.fixture()
+def broker_host():
+    cfg = check_and_transform_legacy_cfg(toml_load(CFG_PATH))
+    host = BrokerProcess(cfg=cfg, cfg_file=CFG_PATH.resolve(), heartbeat_s=0.2)
+    yield host
+    host.stop()
+
+
+def test_broker_process_hosts_the_modules(broker_host):
+    connections = broker_host.start()
+
+    assert [c.name for c in connections] == ["dp-mockupmodule"]
+    conn = connections[0]
+    assert "START" in conn.gui_pcomms
+    assert conn.is_up() is True
+
+    # commands are forwarded to the module via the broker process
+    conn.send_message(b"START")
+    broker_host.refresh_state()
+    assert conn.is_up() is True
+
+
+def test_broker_process_mirrors_module_health(broker_host):
+    connections = broker_host.start()
+    time.sleep(1)
+
+    health = connections[0].health
+    assert health.is_up
+    assert health.rtt_s is not None
+
+
+def test_broker_process_stops_the_modules(broker_host):
+    broker_host.start()
+    broker_host.stop()
+
+    with pytest.raises(OSError):
+        socket.create_connection(("127.0.0.1", 8080), timeout=0.5).close()
+
+
+def test_late_replies_are_not_taken_for_the_next_request():
+    host = BrokerProcess(cfg={}, cfg_file=CFG_PATH)
+    host._pipe, child_pipe = multiprocessing.Pipe()
+
+    # the startup reply arrives after the GUI process gave up waiting
+    child_pipe.send((STARTUP_SEQ, "ok", []))
+    with pytest.raises(BrokerProcessError):
+        host.request("state", reply_timeout_s=0.1)
+
+    th = threading.Thread(target=serve_requests, args=(child_pipe, {}), daemon=True)
+    th.start()
+    assert host.request("state") == {}
+    assert host.request("stop") is None
+    th.join(timeout=1)
+    assert not th.is_alive()
+
+
+def test_ack_barriers_work_with_proxies():
+    # the parts of the broker process, run in threads of this process
+    mod, mod_peer = make_connection("mod", ["A", "C"])
+    conn_only = ControlRoomModuleConnectionConnectOnly(
+        name="conn_only", launcher=NoopLauncher(), pcomms_defaults={"B": ""}
+    )
+    conn_only_socket, conn_only_peer = make_connection("conn_only", [])
+    conn_only.communicator = conn_only_socket.communicator
+    cbb = CallbackBroker(mod_connections={"mod": mod}, stop_event=threading.Event())
+    threading.Thread(target=cbb.listen_for_callbacks, daemon=True).start()
+
+    def module():
+        # answers each `UP` after a while, with a plain `1`
+        try:
+            while frames := mod_peer.recv(1024):
+                for _ in range(frames.count(b"UP;")):
+                    time.sleep(0.05)
+                    mod_peer.sendall(b"1")
+        except OSError:
+            pass  # closed at the end of the test
+
+    threading.Thread(target=module, daemon=True).start()
+
+    host = BrokerProcess(cfg={}, cfg_file=CFG_PATH)
+    host._pipe, child_pipe = multiprocessing.Pipe()
+    connections = {"mod": mod, "conn_only": conn_only}
+    threading.Thread(
+        target=serve_requests, args=(child_pipe, connections), daemon=True
+    ).start()
+    host.connections = [
+        RemoteModuleConnection(state=describe_connection(c), host=host)
+        for c in connections.values()
+    ]
+    proxy, conn_only_proxy = host.connections
+    assert proxy.heartbeat and not conn_only_proxy.heartbeat
+
+    ex = MacroExecutor()
+    steps = [
+        MacroStep(proxy, b"A", group=0, wait_ack=True),
+        MacroStep(conn_only_proxy, b"B", group=0, wait_ack=True),
+        MacroStep(proxy, b"C", group=1),
+    ]
+    run_id = ex.submit("m", steps, ack_timeout_s=1)
+    tend = time.monotonic() + 3
+    while ex.get(run_id).is_active and time.monotonic() < tend:
+        time.sleep(0.01)
+    ex.stop()
+    cbb.stop()
+    host.request("stop")
+
+    run = ex.get(run_id)
+    assert run.state == "done", [s.error for s in run.steps]
+    assert run.hold_s >= 0.05
+    # connection only modules do not answer `UP`, so none is sent to them
+    assert conn_only_peer.recv(1024) == b"B;"
+
+
+def test_requests_waiting_on_a_module_do_not_block_others():
+    # `peer` neither reads nor answers `UP`
+    mod, peer = make_connection("mod", ["A"])
+    mod.send_timeout_s = 1
+
+    host = BrokerProcess(cfg={}, cfg_file=CFG_PATH)
+    host._pipe, child_pipe = multiprocessing.Pipe()
+    th = threading.Thread(
+        target=serve_requests, args=(child_pipe, {"mod": mod}), daemon=True
+    )
+    th.start()
+    proxy = RemoteModuleConnection(state=describe_connection(mod), host=host)
+
+    is_up = threading.Thread(target=proxy.is_up, args=(1,), daemon=True)
+    is_up.start()
+    time.sleep(0.1)
+
+    start = time.monotonic()
+    # larger than the socket buffers, the write stalls in the writer thread
+    proxy.send_message(b"A|" + b"x" * 2**22)
+    assert "mod" in host.request("state")
+    assert time.monotonic() - start < 0.5
+
+    is_up.join(timeout=3)
+    assert host.request("stop") is None
+    th.join(timeout=1)
+    assert not th.is_alive()
+    mod.stop()
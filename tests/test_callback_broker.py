@@ -0,0 +1,238 @@
+import queue
+import socket
+import threading
+import time
+
+import pytest
+from dareplane_utils.module_handling.communication import SocketCommunicator
+
+from control_room.callbacks import CallbackBroker
+from control_room.utils.modules import ControlRoomModuleConnection, NoopLauncher
+from control_room.utils.outbound import PartialWriteError
+
+
+def make_connection(name: str, pcomms: list[str]):
+    """Create a module connection backed by a local socket pair.
+
+    Returns the connection and the module side of the socket pair, which is used
+    to emulate the module's server.
+    """
+    module_side, cr_side = socket.socketpair()
+    module_side.settimeout(2)
+    cr_side.settimeout(0.001)
+
+    communicator = SocketCommunicator(ip="127.0.0.1", port=0, name=name)
+    communicator.socket_c = cr_side
+
+    conn = ControlRoomModuleConnection(name=name, launcher=NoopLauncher())
+    conn.communicator = communicator
+    conn.pcomms = pcomms
+    return conn, module_side
+
+
+@pytest.fixture()
+def broker():
+    cbb = CallbackBroker(mod_connections={}, stop_event=threading.Event())
+    th = threading.Thread(target=cbb.listen_for_callbacks, daemon=True)
+    yield cbb, th
+    cbb.stop()
+    th.join(timeout=3)
+
+
+def test_selector_broker_routes_callback(broker):
+    cbb, th = broker
+    src, src_peer = make_connection("src", [])
+    trg, trg_peer = make_connection("trg", ["START"])
+    cbb.mod_connections.update({"src": src, "trg": trg})
+    th.start()
+
+    src_peer.sendall(b'trg|START|{"a": 1};')
+
+    assert trg_peer.recv(1024) == b'START|{"a": 1};'
+
+
+def test_selector_broker_picks_up_added_connection(broker):
+    cbb, th = broker
+    trg, trg_peer = make_connection("trg", ["START"])
+    cbb.mod_connections["trg"] = trg
+    th.start()
+    time.sleep(0.1)
+
+    src, src_peer = make_connection("src", [])
+    cbb.add_connection(src)
+    src_peer.sendall(b"trg|START|{};")
+
+    assert trg_peer.recv(1024) == b"START|{};"
+
+
+def test_selector_broker_stops_without_waiting_for_timeout():
+    cbb = CallbackBroker(
+        mod_connections={}, stop_event=threading.Event(), select_timeout_s=10
+    )
+    th = threading.Thread(target=cbb.listen_for_callbacks, daemon=True)
+    th.start()
+    time.sleep(0.1)
+
+    start = time.time()
+    cbb.stop()
+    th.join(timeout=3)
+
+    assert not th.is_alive()
+    assert time.time() - start < 1
+
+
+def test_selector_broker_watches_replaced_socket(broker):
+    """A closed socket is dropped, the replacement socket is watched again."""
+    cbb, th = broker
+    src, src_peer = make_connection("src", [])
+    trg, trg_peer = make_connection("trg", ["START"])
+    cbb.mod_connections.update({"src": src, "trg": trg})
+    th.start()
+
+    src_peer.close()
+    time.sleep(0.1)
+
+    # emulate a reconnect of the source module
+    new_src, new_src_peer = make_connection("src", [])
+    src.communicator = new_src.communicator
+    cbb.wakeup()
+    new_src_peer.sendall(b"trg|START|{};")
+
+    assert trg_peer.recv(1024) == b"START|{};"
+
+
+def test_frames_split_across_reads_are_reassembled():
+    src, _ = make_connection("src", [])
+    trg, trg_peer = make_connection("trg", ["START"])
+    cbb = CallbackBroker(mod_connections={"src": src, "trg": trg})
+
+    cbb.process_message(b"trg|ST", "src")
+    cbb.process_message(b'ART|{"a"', "src")
+    cbb.process_message(b": 1};", "src")
+
+    assert trg_peer.recv(1024) == b'START|{"a": 1};'
+
+
+def test_burst_of_frames_is_routed_in_order():
+    src, _ = make_connection("src", [])
+    trg, trg_peer = make_connection("trg", ["START", "STOP"])
+    cbb = CallbackBroker(mod_connections={"src": src, "trg": trg})
+
+    cbb.process_message(b"trg|START|{};1trg|STOP|{};trg|START|{", "src")
+    cbb.process_message(b"};", "src")
+
+    received = b""
+    while received.count(b";") < 3:
+        received += trg_peer.recv(1024)
+    assert received == b"START|{};STOP|{};START|{};"
+
+
+def test_unterminated_up_ack_is_recorded():
+    src, _ = make_connection("src", [])
+    cbb = CallbackBroker(mod_connections={"src": src})
+
+    before = time.time()
+    cbb.process_message(b"1", "src")
+
+    assert src.last_up_ack >= before
+
+
+def test_acks_of_earlier_ups_do_not_count_for_later_ones():
+    src, peer = make_connection("src", [])
+    cbb = CallbackBroker(mod_connections={"src": src})
+
+    # e.g. a heartbeat of the HealthMonitor, followed by the `UP` of a barrier
+    heartbeat = src.send_up()
+    barrier = src.send_up()
+    assert barrier == heartbeat + 1
+    assert peer.recv(1024) == b"UP;UP;"
+
+    cbb.process_message(b"1", "src")
+    assert src.wait_up_ack(heartbeat, timeout_s=0)
+    assert not src.wait_up_ack(barrier, timeout_s=0.05)
+
+    cbb.process_message(b"1", "src")
+    assert src.wait_up_ack(barrier, timeout_s=0)
+
+
+def test_payload_ending_in_1_is_not_taken_for_an_ack():
+    src, _ = make_connection("src", [])
+    trg, trg_peer = make_connection("trg", ["STIM"])
+    cbb = CallbackBroker(mod_connections={"src": src, "trg": trg})
+
+    cbb.process_message(b"trg|STIM|1;", "src")
+
+    assert trg_peer.recv(1024) == b"STIM|1;"
+    assert src.last_up_ack == 0
+
+
+def test_acks_at_the_start_of_frames_are_recorded():
+    src, _ = make_connection("src", [])
+    trg, trg_peer = make_connection("trg", ["START"])
+    cbb = CallbackBroker(mod_connections={"src": src, "trg": trg})
+
+    cbb.process_message(b"1", "src")
+    cbb.process_message(b"1trg|START|{};1", "src")
+    cbb.process_message(b"1trg|START|{1};", "src")
+
+    assert src.last_up_ack > 0
+    received = b""
+    while received.count(b";") < 2:
+        received += trg_peer.recv(1024)
+    assert received == b"START|{};START|{1};"
+
+
+def test_unterminated_reply_is_handed_to_its_waiter():
+    src, _ = make_connection("src", [])
+    trg, trg_peer = make_connection("trg", ["START"])
+    cbb = CallbackBroker(mod_connections={"src": src, "trg": trg})
+
+    src.reply_waiter = queue.SimpleQueue()
+    cbb.process_message(b"START|GET_PCOMMS|UP", "src")
+    assert src.reply_waiter.get_nowait() == b"START|GET_PCOMMS|UP"
+
+    # the reply is not joined with the next callback
+    cbb.process_message(b"trg|START|{};", "src")
+    assert trg_peer.recv(1024) == b"START|{};"
+
+
+def test_stalled_target_does_not_block_routing(broker):
+    cbb, th = broker
+    src, src_peer = make_connection("src", [])
+    slow, slow_peer = make_connection("slow", ["START"])
+    fast, fast_peer = make_connection("fast", ["START"])
+    slow.send_timeout_s = 1
+    cbb.mod_connections.update({"src": src, "slow": slow, "fast": fast})
+    th.start()
+
+    # `slow_peer` never reads, so its receive window will be full quickly
+    payload = b"x" * 2**14
+    src_peer.sendall(b"".join([b"slow|START|" + payload + b";"] * 64))
+    src_peer.sendall(b"fast|START|{};")
+
+    start = time.time()
+    assert fast_peer.recv(1024) == b"START|{};"
+    assert time.time() - start < 0.5
+
+
+def test_partial_write_is_finished_before_the_next_message():
+    conn, peer = make_connection("slow", ["START"])
+    conn.send_timeout_s = 0.2
+    frame = b"START|" + b"x" * 2**22
+
+    # `peer` does not read, so only a part of the frame fits into the buffers
+    with pytest.raises(PartialWriteError):
+        conn.send_message(frame)
+
+    # the remainder is retried by the writer thread once the module reads
+    received = b""
+    while frame + b";" not in received:
+        received += peer.recv(2**16)
+
+    conn.send_message(b"STOP")
+    while not received.endswith(b"STOP;") and not received.endswith(b"STOP;UP;"):
+        received += peer.recv(2**16)
+
+    frames = [f for f in received.split(b";") if f and f != b"UP"]
+    assert frames == [frame, b"STOP"]
+    conn.stop()
@@ -3,7 +3,12 @@ from pathlib import Path
 
 import pytest
 
-from control_room.utils.config import check_and_transform_legacy_cfg, toml_load
+from control_room.utils.config import (
+    check_and_transform_legacy_cfg,
+    dependency_layers,
+    get_module_dependencies,
+    toml_load,
+)
 from control_room.utils.modules import initialize_modules
 
 RESOURCES = Path("./tests/") / "resources"
@@ -114,3 +119,26 @@ def test_legacy_and_new_convention_are_equivalent():
     )
 
     assert _describe(legacy) == _describe(new)
+
+
+def test_dependency_layers_group_independent_modules():
+    deps = {"lsl": [], "other": [], "decoder": ["lsl"], "ctrl": ["decoder", "other"]}
+    assert dependency_layers(deps) == [["lsl", "other"], ["decoder"], ["ctrl"]]
+
+
+def test_cyclic_dependencies_are_rejected():
+    cfg = {
+        "modules": {
+            "a": {"kind": "conn_only", "depends_on": ["c"]},
+            "b": {"kind": "conn_only", "depends_on": ["a"]},
+            "c": {"kind": "conn_only", "depends_on": ["b"]},
+        }
+    }
+    with pytest.raises(ValueError, match="Cyclic dependency"):
+        get_module_dependencies(cfg)
+
+
+def test_unknown_dependency_is_rejected():
+    cfg = {"modules": {"a": {"kind": "conn_only", "depends_on": ["missing"]}}}
+    with pytest.raises(ValueError, match="unknown module"):
+        get_module_dependencies(cfg)
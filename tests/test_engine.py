@@ -0,0 +1,121 @@
+import socket
+import threading
+from pathlib import Path
+
+import pytest
+
+from control_room.engine import AsyncModuleEngine, initialize_engine_modules
+from control_room.utils.config import check_and_transform_legacy_cfg, toml_load
+
+CFG_PATH = Path("./tests/resources/test_cfg.toml")
+
+
+@pytest.fixture()
+def engine():
+    eng = AsyncModuleEngine()
+    eng.start()
+    yield eng
+    eng.stop()
+
+
+def fake_module_server(on_connect):
+    """Accept a single connection, greet and hand the socket to `on_connect`."""
+    srv = socket.create_server(("127.0.0.1", 0))
+    srv.settimeout(5)
+
+    def serve():
+        conn, _ = srv.accept()
+        conn.settimeout(5)
+        conn.sendall(b"Connected to fake\n")
+        on_connect(conn)
+        srv.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return srv.getsockname()[1]
+
+
+def test_engine_starts_and_checks_modules(engine):
+    cfg = check_and_transform_legacy_cfg(toml_load(CFG_PATH))
+    connections = initialize_engine_modules(cfg, CFG_PATH.resolve(), engine)
+    try:
+        engine.run(engine.start_modules(connections), timeout=30)
+        conn = connections[0]
+
+        assert "START" in conn.gui_pcomms
+        assert conn.is_up() is True
+        conn.send_message(b"START")
+        assert conn.is_up() is True
+    finally:
+        for c in connections:
+            c.stop()
+
+
+def test_engine_routes_callbacks(engine):
+    received = []
+    done = threading.Event()
+
+    def src_module(conn):
+        conn.sendall(b"trg|START|{")
+        conn.sendall(b"};")
+        done.wait(5)
+
+    def trg_module(conn):
+        received.append(conn.recv(1024))
+        done.set()
+
+    cfg = {
+        "modules": {
+            name: {
+                "kind": "conn_only",
+                "ip": "127.0.0.1",
+                "port": fake_module_server(fn),
+                "pcomms": pcomms,
+            }
+            for name, fn, pcomms in [
+                ("src", src_module, {}),
+                ("trg", trg_module, {"START": ""}),
+            ]
+        }
+    }
+    connections = initialize_engine_modules(cfg, CFG_PATH.resolve(), engine)
+    engine.run(engine.start_modules(connections), timeout=10)
+
+    assert done.wait(5)
+    assert received == [b"START|{};"]
+
+
+def test_engine_holds_callbacks_until_all_modules_started(engine):
+    received = []
+    done = threading.Event()
+
+    def src_module(conn):
+        # sent before `trg` is even connected, as it depends on `src`
+        conn.sendall(b"trg|START|{};")
+        done.wait(5)
+
+    def trg_module(conn):
+        received.append(conn.recv(1024))
+        done.set()
+
+    cfg = {
+        "modules": {
+            "src": {
+                "kind": "conn_only",
+                "ip": "127.0.0.1",
+                "port": fake_module_server(src_module),
+                "pcomms": {},
+            },
+            "trg": {
+                "kind": "conn_only",
+                "ip": "127.0.0.1",
+                "port": fake_module_server(trg_module),
+                "pcomms": {"START": ""},
+                "depends_on": ["src"],
+            },
+        }
+    }
+    connections = initialize_engine_modules(cfg, CFG_PATH.resolve(), engine)
+    engine.run(engine.start_modules(connections), timeout=10)
+
+    assert done.wait(5)
+    assert received == [b"START|{};"]
@@ -0,0 +1,212 @@
+from types import SimpleNamespace
+
+from dash import Dash, html
+
+from control_room.gui.app import build_app
+from control_room.gui.callbacks import add_log_update
+from control_room.utils.logtail import LogTailer
+
+
+def make_module(name: str, pcomms: list[str]) -> SimpleNamespace:
+    return SimpleNamespace(
+        name=name, gui_pcomms=pcomms, pcomms_defaults={}, scheduling_effective={}
+    )
+
+
+MACROS = {"m1": {"name": "MACRO1", "cmds": {"com1": ["mod_a", "START"]}}}
+
+
+def test_json_validation_runs_clientside_per_input():
+    modules = [make_module("mod_a", ["START", "STOP"]), make_module("mod_b", ["X"])]
+    app = build_app(modules, macros=MACROS)  # type: ignore
+    deps = app.server.test_client().get("/_dash-dependencies").get_json()
+
+    validation = [
+        d for d in deps if d["output"].endswith(".className") and "MATCH" in d["output"]
+    ]
+    assert len(validation) == 2  # pcomm and macro inputs
+    for d in validation:
+        assert d["clientside_function"]["function_name"] == "validate_json"
+        assert len(d["inputs"]) == 1 and d["state"] == []
+
+
+def test_pcomm_click_only_carries_its_own_payload():
+    modules = [make_module("mod_a", ["START", "STOP"]), make_module("mod_b", ["X"])]
+    sent = []
+    modules[0].send_message = sent.append
+    app = build_app(modules, macros=MACROS)  # type: ignore
+    client = app.server.test_client()
+    deps = client.get("/_dash-dependencies").get_json()
+
+    sender = next(d for d in deps if "pcomm_sent" in d["output"])
+    assert len(sender["inputs"]) == len(sender["state"]) == 1
+
+    key = {"module": "mod_a", "pcomm": "STOP"}
+    resp = client.post(
+        "/_dash-update-component",
+        json={
+            "output": sender["output"],
+            "outputs": {"id": key | {"type": "pcomm_sent"}, "property": "children"},
+            "inputs": [
+                {"id": key | {"type": "pcomm"}, "property": "n_clicks", "value": 1}
+            ],
+            "changedPropIds": [
+                '{"module":"mod_a","pcomm":"STOP","type":"pcomm"}.n_clicks'
+            ],
+            "state": [
+                {
+                    "id": key | {"type": "pcomm_input"},
+                    "property": "value",
+                    "value": '{"a": 1}',
+                }
+            ],
+        },
+    )
+    assert resp.status_code == 200
+    assert sent == [b'STOP|{"a": 1}']
+
+
+def test_unchanged_module_states_send_no_body():
+    module = make_module("mod_a", [])
+    module.health = SimpleNamespace(restarting=False, is_up=True)
+    app = build_app([module], macros=None)  # type: ignore
+    client = app.server.test_client()
+    deps = client.get("/_dash-dependencies").get_json()
+    dep = next(d for d in deps if "module_state_hash" in d["output"])
+
+    def poll(last_hash):
+        return client.post(
+            "/_dash-update-component",
+            json={
+                "output": dep["output"],
+                "outputs": [
+                    {"id": "mod_a_check_box", "property": "className"},
+                    {"id": "module_state_hash", "property": "data"},
+                ],
+                "inputs": [
+                    {"id": "interval_modules", "property": "n_intervals", "value": 1}
+                ],
+                "changedPropIds": ["interval_modules.n_intervals"],
+                "state": [
+                    {"id": "module_state_hash", "property": "data", "value": last_hash}
+                ],
+            },
+        )
+
+    resp = poll(None)
+    outputs = resp.get_json()["response"]
+    assert "running_module_check_box" in outputs["mod_a_check_box"]["className"]
+
+    assert poll(outputs["module_state_hash"]["data"]).get_json()["response"] == {}
+
+    module.health.is_up = False
+    assert poll(outputs["module_state_hash"]["data"]).get_json()["response"] != {}
+
+
+def test_pcomm_buttons_show_their_latency():
+    modules = [make_module("mod_a", ["START", "STOP"])]
+    stats = {"STOP": {"n": 3, "p50_ms": 1.0, "p99_ms": 4.0}}
+    modules[0].latency_summary = lambda: stats
+    app = build_app(modules, macros=None)  # type: ignore
+    client = app.server.test_client()
+    deps = client.get("/_dash-dependencies").get_json()
+    dep = next(d for d in deps if "pcomm_latency_hash" in d["output"])
+
+    ids = [
+        {"type": "pcomm_latency", "module": "mod_a", "pcomm": p}
+        for p in ("START", "STOP")
+    ]
+    resp = client.post(
+        "/_dash-update-component",
+        json={
+            "output": dep["output"],
+            "outputs": [
+                [{"id": i, "property": "children"} for i in ids],
+                [{"id": i, "property": "title"} for i in ids],
+                {"id": "pcomm_latency_hash", "property": "data"},
+            ],
+            "inputs": [{"id": "interval_3s", "property": "n_intervals", "value": 1}],
+            "changedPropIds": ["interval_3s.n_intervals"],
+            "state": [{"id": "pcomm_latency_hash", "property": "data", "value": None}],
+        },
+    )
+    response = resp.get_json()["response"]
+    start, stop = (
+        response[f'{{"module":"mod_a","pcomm":"{p}","type":"pcomm_latency"}}']
+        for p in ("START", "STOP")
+    )
+    assert start["children"] == ""
+    assert stop["children"] == "1.0 | 4.0 ms"
+
+
+def test_empty_logfile_shows_an_empty_log(tmp_path):
+    logfile = tmp_path / "empty.log"
+    logfile.touch()
+    app = Dash(__name__)
+    app.layout = html.Div()
+    app = add_log_update(app, LogTailer(logfile))
+    client = app.server.test_client()
+
+    def poll(state):
+        resp = client.post(
+            "/_dash-update-component",
+            json={
+                "output": "..logfile_data.children...logfile_state.data..",
+                "outputs": [
+                    {"id": "logfile_data", "property": "children"},
+                    {"id": "logfile_state", "property": "data"},
+                ],
+                "inputs": [
+                    {"id": "interval_log", "property": "n_intervals", "value": 1}
+                ],
+                "changedPropIds": ["interval_log.n_intervals"],
+                "state": [{"id": "logfile_state", "property": "data", "value": state}],
+            },
+        )
+        return resp.get_json()["response"]
+
+    response = poll({"seq": None, "count": 0})
+    assert response["logfile_data"]["children"] == []
+    state = response["logfile_state"]["data"]
+    assert state["seq"] is not None
+
+    # afterwards, nothing is sent until new lines are logged
+    assert poll(state) == {}
+
+
+def test_unchanged_telemetry_sends_no_body():
+    module = make_module("mod_a", [])
+    hist = {"t": [0.0], "cpu_percent": [5.0], "rss_mb": [100.0], "num_threads": [3]}
+    telemetry = SimpleNamespace(snapshot=lambda last_n: {"mod_a": hist})
+    app = build_app([module], macros=None, telemetry=telemetry)  # type: ignore
+    client = app.server.test_client()
+    deps = client.get("/_dash-dependencies").get_json()
+    dep = next(d for d in deps if "telemetry_hash" in d["output"])
+
+    def poll(last_hash):
+        return client.post(
+            "/_dash-update-component",
+            json={
+                "output": dep["output"],
+                "outputs": [
+                    {"id": "mod_a_telemetry_graph", "property": "figure"},
+                    {"id": "mod_a_telemetry_text", "property": "children"},
+                    {"id": "telemetry_hash", "property": "data"},
+                ],
+                "inputs": [
+                    {"id": "interval_3s", "property": "n_intervals", "value": 1}
+                ],
+                "changedPropIds": ["interval_3s.n_intervals"],
+                "state": [
+                    {"id": "telemetry_hash", "property": "data", "value": last_hash}
+                ],
+            },
+        ).get_json()["response"]
+
+    outputs = poll(None)
+    assert outputs["mod_a_telemetry_text"]["children"].startswith("5% cpu")
+
+    assert poll(outputs["telemetry_hash"]["data"]) == {}
+
+    hist["cpu_percent"].append(7.0)
+    assert poll(outputs["telemetry_hash"]["data"]) != {}
@@ -0,0 +1,83 @@
+import json
+from types import SimpleNamespace
+
+from control_room.gui.events import EventHub
+from control_room.gui.push import GuiEventSource
+from control_room.utils.health import ModuleHealth
+from control_room.utils.logtail import LogTailer
+
+
+def drain(client) -> list[tuple[str, dict]]:
+    events = []
+    while not client.messages.empty():
+        event, data = client.messages.get_nowait().strip().split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data[6:])))
+    return events
+
+
+def test_hub_replays_states_and_fans_out_deltas():
+    hub = EventHub(max_clients=2)
+    hub.publish("modules", {"classes": {"a": "up"}}, state={"classes": {"a": "up"}})
+    hub.publish("note", {"text": "not replayed"})
+
+    first = hub.subscribe()
+    assert drain(first) == [("modules", {"classes": {"a": "up"}})]
+
+    second = hub.subscribe()
+    drain(second)
+    assert hub.subscribe() is None  # no capacity left
+    hub.publish("modules", {"classes": {"b": "up"}}, state={"classes": {}})
+    assert drain(first) == drain(second) == [("modules", {"classes": {"b": "up"}})]
+
+    hub.unsubscribe(second)
+    assert hub.n_clients == 1
+    hub.close()
+    assert hub.n_clients == 0 and first.dropped
+
+
+def test_hub_drops_slow_clients():
+    hub = EventHub()
+    client = hub.subscribe()
+    for i in range(client.messages.maxsize + 1):
+        hub.publish("log", {"i": i})
+    assert client.dropped
+    assert hub.n_clients == 0
+
+
+def test_source_publishes_only_changes(tmp_path):
+    logfile = tmp_path / "cr.log"
+    logfile.write_text("INFO first\n")
+    health = ModuleHealth(name="mod")
+    module = SimpleNamespace(name="mod", health=health)
+
+    hub = EventHub()
+    client = hub.subscribe()
+    source = GuiEventSource(hub, [module], LogTailer(logfile))
+
+    source.update()
+    events = dict(drain(client))
+    assert events["modules"] == {"classes": {"mod_check_box": "module_check_box"}}
+    assert [p["props"]["children"] for p in events["log"]["lines"]] == ["INFO first"]
+
+    source.update()
+    assert drain(client) == []
+
+    health.last_ack = 1.0
+    with open(logfile, "a") as f:
+        f.write("ERROR second\n")
+    source.update()
+    events = dict(drain(client))
+    assert events["modules"]["classes"] == {
+        "mod_check_box": "module_check_box running_module_check_box"
+    }
+    assert not events["log"]["reset"]
+    assert [p["props"]["children"] for p in events["log"]["lines"]] == ["ERROR second"]
+
+    # a new client starts with the full window, newest first
+    late = hub.subscribe()
+    log = dict(drain(late))["log"]
+    assert log["reset"]
+    assert [p["props"]["children"] for p in log["lines"]] == [
+        "ERROR second",
+        "INFO first",
+    ]
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+from control_room.callbacks import CallbackBroker
+from control_room.utils.health import HealthMonitor
+from tests.test_callback_broker import make_connection
+
+
+@pytest.fixture()
+def broker():
+    cbb = CallbackBroker(mod_connections={}, stop_event=threading.Event())
+    th = threading.Thread(target=cbb.listen_for_callbacks, daemon=True)
+    yield cbb, th
+    cbb.stop()
+    th.join(timeout=3)
+
+
+def answer_up(peer, stop: threading.Event):
+    """Emulate a module's server acknowledging every `UP`."""
+    peer.settimeout(0.05)
+    while not stop.is_set():
+        try:
+            data = peer.recv(1024)
+        except TimeoutError:
+            continue
+        peer.sendall(b"1" * data.count(b"UP;"))
+
+
+def test_monitor_tracks_up_and_down_modules(broker):
+    cbb, th = broker
+    alive, alive_peer = make_connection("alive", [])
+    silent, silent_peer = make_connection("silent", [])
+    cbb.mod_connections.update({"alive": alive, "silent": silent})
+    th.start()
+
+    stop = threading.Event()
+    threading.Thread(target=answer_up, args=(alive_peer, stop), daemon=True).start()
+
+    monitor = HealthMonitor([alive, silent], broker=cbb, interval_s=0.1, timeout_s=0.05)
+    monitor.start()
+    time.sleep(0.5)
+    monitor.stop()
+    stop.set()
+
+    assert alive.health.is_up
+    assert alive.health.rtt_s is not None and alive.health.rtt_s < 0.05
+    assert not silent.health.is_up
+    assert silent.health.consecutive_misses >= 3
+    assert set(monitor.table) == {"alive", "silent"}
+
+
+def test_heartbeats_are_sent_concurrently(broker):
+    cbb, th = broker
+    conns = [make_connection(f"silent_{i}", []) for i in range(5)]
+    cbb.mod_connections.update({c.name: c for c, _ in conns})
+    th.start()
+
+    monitor = HealthMonitor([c for c, _ in conns], broker=cbb, timeout_s=0.2)
+    tstart = time.monotonic()
+    monitor.heartbeat()
+
+    # all modules miss the heartbeat, but the timeout is only waited for once
+    assert time.monotonic() - tstart < 0.5
+    assert all(c.health.consecutive_misses == 1 for c, _ in conns)
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from control_room.callbacks import CallbackBroker
+from control_room.utils.latency import LatencyHistogram, PcommLatency
+from control_room.utils.modules import (
+    ControlRoomModuleConnection,
+    ControlRoomModuleConnectionConnectOnly,
+    NoopLauncher,
+)
+from tests.test_callback_broker import make_connection
+
+
+def test_histogram_quantiles_are_within_a_bin():
+    hist = LatencyHistogram()
+    for v in np.linspace(0.001, 0.01, 1000):
+        hist.add(v)
+
+    assert hist.n == 1000
+    assert hist.quantile(0.5) == pytest.approx(0.0055, rel=0.12)
+    assert hist.quantile(0.99) == pytest.approx(0.0099, rel=0.12)
+    assert LatencyHistogram().quantile(0.5) is None
+
+
+def test_replies_are_matched_in_order():
+    lat = PcommLatency()
+    lat.sent("START", t=1.0)
+    lat.sent("STOP", t=1.5)
+    assert lat.replied(b"started", t=1.002)
+    assert lat.replied(b"stopped", t=1.510)
+    assert not lat.replied(b"unsolicited", t=1.6)  # none pending
+
+    start, stop = lat.recent
+    assert (start.pcomm, start.reply) == ("START", b"started")
+    assert start.latency_s == pytest.approx(0.002)
+    assert (stop.pcomm, stop.reply) == ("STOP", b"stopped")
+    assert stop.latency_s == pytest.approx(0.010)
+    assert set(lat.summary()) == {"START", "STOP"}
+
+
+def test_commands_without_reply_are_done_by_their_up():
+    lat = PcommLatency()
+    lat.sent("START", t=1.0, up_seq=1)
+    lat.sent("STOP", t=2.0, up_seq=2)
+
+    assert lat.acked(1, t=1.003) == 1
+    assert lat.acked(1, t=1.004) == 0  # already done
+    assert lat.acked(2, t=2.010) == 1
+
+    start, stop = lat.recent
+    assert start.reply is None and start.latency_s == pytest.approx(0.003)
+    assert stop.reply is None and stop.latency_s == pytest.approx(0.010)
+    assert lat.n_pending == 0
+
+
+def test_unanswered_commands_expire():
+    lat = PcommLatency(max_age_s=1)
+    lat.sent("START", t=0.0, up_seq=1)
+    assert lat.acked(1, t=5.0) == 0
+    assert not lat.replied(b"late", t=5.0)
+    assert lat.summary() == {}
+
+
+def _measure_start(conn, peer, reply: bytes) -> bytes:
+    cbb = CallbackBroker(mod_connections={"mod": conn}, stop_event=threading.Event())
+    th = threading.Thread(target=cbb.listen_for_callbacks, daemon=True)
+    th.start()
+    try:
+        conn.send_message(b"START")
+        wire = peer.recv(1024)
+        time.sleep(0.02)
+        peer.sendall(reply)
+
+        tend = time.monotonic() + 2
+        while not conn.latency.recent and time.monotonic() < tend:
+            time.sleep(0.005)
+    finally:
+        cbb.stop()
+        th.join(timeout=3)
+    return wire
+
+
+def test_pcomm_round_trip_is_measured_by_the_broker():
+    conn, peer = make_connection("mod", ["START"])
+
+    # the command is sent unchanged
+    assert _measure_start(conn, peer, b"started;") == b"START;"
+
+    (ex,) = conn.latency.recent
+    assert ex.reply == b"started"
+    assert 0.02 <= ex.latency_s < 0.5
+    assert conn.latency_summary()["START"]["n"] == 1
+
+
+def test_opt_in_up_measures_commands_without_reply():
+    conn, peer = make_connection("mod", ["START"])
+    conn.latency_up = True
+
+    assert _measure_start(conn, peer, b"1") == b"START;UP;"
+
+    (ex,) = conn.latency.recent
+    assert ex.reply is None and ex.up_seq == 1
+    assert 0.02 <= ex.latency_s < 0.5
+
+
+@pytest.mark.parametrize(
+    "cls,name",
+    [
+        (ControlRoomModuleConnection, "dp-ao-communication"),
+        (ControlRoomModuleConnectionConnectOnly, "conn_only"),
+    ],
+)
+def test_up_is_not_added_for_modules_without_heartbeat(cls, name):
+    conn = cls(name=name, launcher=NoopLauncher(), latency_up=True)
+    assert not conn.latency_up
+    assert conn._frame(b"START") == b"START;"
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from control_room.utils.logtail import LogTailer
+
+
+@pytest.fixture()
+def logfile(tmp_path):
+    return tmp_path / "test.log"
+
+
+def append(path, text: str):
+    with open(path, "a") as f:
+        f.write(text)
+
+
+def test_only_new_lines_are_read(logfile):
+    append(logfile, "1 INFO first\n2 ERROR second\n")
+    tailer = LogTailer(logfile)
+
+    assert tailer.poll() == 2
+    assert tailer.poll() == 0
+
+    append(logfile, "3 WARNING third\n4 partial")
+    assert tailer.poll() == 1
+    append(logfile, " line\n")
+    assert tailer.poll() == 1
+
+    lines, reset = tailer.lines_since(1)
+    assert not reset
+    assert [(ln.seq, ln.level, ln.text) for ln in lines] == [
+        (2, "WARNING", "3 WARNING third"),
+        (3, "DEBUG", "4 partial line"),
+    ]
+
+
+def test_first_read_starts_at_the_end(logfile):
+    append(logfile, "".join(f"line {i}\n" for i in range(10_000)))
+    tailer = LogTailer(logfile, max_lines=5, initial_bytes=100)
+
+    tailer.poll()
+    lines, _ = tailer.lines_since(-1)
+
+    assert lines[-1].text == "line 9999"
+    assert tailer.last_seq < 20, "only the end of the file is parsed"
+
+
+def test_truncation_and_rotation_restart_reading(logfile):
+    append(logfile, "old 1\nold 2\n")
+    tailer = LogTailer(logfile)
+    tailer.poll()
+
+    # truncated
+    with open(logfile, "w") as f:
+        f.write("new 1\n")
+    tailer.poll()
+    assert tailer.lines_since(1)[0][-1].text == "new 1"
+
+    # rotated, i.e. replaced by a new file
+    os.rename(logfile, logfile.with_suffix(".1"))
+    append(logfile, "rotated 1\n")
+    tailer.poll()
+    assert tailer.lines_since(2)[0][-1].text == "rotated 1"
+
+
+def test_readers_which_missed_lines_are_reset(logfile):
+    append(logfile, "".join(f"line {i}\n" for i in range(10)))
+    tailer = LogTailer(logfile, max_lines=3)
+    tailer.poll()
+
+    lines, reset = tailer.lines_since(2)
+    assert reset
+    assert [ln.text for ln in lines] == ["line 7", "line 8", "line 9"]
+
+    assert tailer.lines_since(8) == ([tailer._lines[-1]], False)
@@ -0,0 +1,47 @@
+import time
+
+import pylsl
+
+from control_room.utils.lsl_discovery import StreamDiscovery, StreamEntry
+
+
+def make_info(name: str, source_id: str) -> pylsl.StreamInfo:
+    return pylsl.StreamInfo(name, "EEG", 8, 500, "float32", source_id)
+
+
+def test_update_emits_appeared_and_disappeared():
+    discovery = StreamDiscovery()
+    events = []
+    discovery.add_listener(lambda event, entry: events.append((event, entry.name)))
+
+    a, b = make_info("a", "src_a"), make_info("b", "src_b")
+    discovery.update([a, b])
+    discovery.update([a, b])
+    discovery.update([b])
+
+    assert events == [("appeared", "a"), ("appeared", "b"), ("disappeared", "a")]
+    assert [e.name for e in discovery.streams()] == ["b"]
+    assert discovery.version == 2
+
+
+def test_entry_describes_the_stream():
+    entry = StreamEntry.from_info(make_info("eeg", "src"))
+    assert (entry.name, entry.type, entry.channel_count) == ("eeg", "EEG", 8)
+    assert entry.nominal_srate == 500
+    assert "8ch @ 500Hz" in str(entry)
+
+
+def test_discovery_finds_an_outlet():
+    outlet = pylsl.StreamOutlet(make_info("discovery_test", "discovery_test_src"))
+    discovery = StreamDiscovery(interval_s=0.2)
+    discovery.start()
+    try:
+        tstart = time.monotonic()
+        while time.monotonic() - tstart < 10:
+            if any(e.name == "discovery_test" for e in discovery.streams()):
+                break
+            time.sleep(0.1)
+        assert any(e.name == "discovery_test" for e in discovery.streams())
+    finally:
+        discovery.stop()
+        del outlet
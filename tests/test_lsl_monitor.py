@@ -0,0 +1,82 @@
+import time
+
+import numpy as np
+import pylsl
+
+from control_room.utils.lsl_discovery import StreamDiscovery, StreamEntry
+from control_room.utils.lsl_monitor import MonitoredStream, StreamMonitor
+
+
+class FakeInlet:
+    """Hands out prepared chunks like `pull_chunk` with a `dest_obj`"""
+
+    def __init__(self, chunks: list[tuple[np.ndarray, np.ndarray]]):
+        self.chunks = chunks
+
+    def pull_chunk(self, timeout=0.0, max_samples=1024, dest_obj=None):
+        if not self.chunks:
+            return None, []
+        data, ts = self.chunks.pop(0)
+        dest_obj[: len(ts)] = data
+        return None, list(ts)
+
+
+def make_entry(srate: float = 100, n_ch: int = 4) -> StreamEntry:
+    info = pylsl.StreamInfo("mon", "EEG", n_ch, srate, "float32", "mon_src")
+    return StreamEntry.from_info(info)
+
+
+def test_pull_fills_buffer_and_counts_dropped_samples():
+    ts = np.arange(20) / 100
+    ts = np.delete(ts, [5, 6, 15])  # three samples missing
+    data = np.arange(len(ts) * 4, dtype=np.float32).reshape(-1, 4)
+    inlet = FakeInlet([(data[:8], ts[:8]), (data[8:], ts[8:])])
+
+    stream = MonitoredStream(entry=make_entry(), inlet=inlet, buffer_s=1)
+    received = []
+    stream.listeners.append(lambda chunk, t: received.append(chunk.copy()))
+
+    assert stream.pull(now=0.0) == 8
+    assert stream.pull(now=0.1) == len(ts) - 8
+    assert stream.pull(now=0.2) == 0
+
+    assert stream.metrics.n_samples == len(ts)
+    assert stream.metrics.dropped == 3
+    assert stream.n_buffered == len(ts)
+    buffered = stream.buffer.unfold_buffer()[-len(ts) :]  # type: ignore
+    np.testing.assert_array_equal(buffered, data)
+    np.testing.assert_array_equal(np.concatenate(received), data)
+
+
+def test_monitor_pulls_from_a_selected_outlet():
+    info = pylsl.StreamInfo("monitor_test", "EEG", 8, 500, "float32", "monitor_src")
+    outlet = pylsl.StreamOutlet(info)
+    discovery = StreamDiscovery(interval_s=0.2)
+    discovery.start()
+    monitor = StreamMonitor(discovery, buffer_s=2)
+    monitor.start()
+    try:
+        tstart = time.monotonic()
+        key = None
+        while time.monotonic() - tstart < 10 and key is None:
+            keys = [e.key for e in discovery.streams() if e.name == "monitor_test"]
+            key = keys[0] if keys else None
+            time.sleep(0.1)
+        assert key is not None
+        monitor.select([key])
+
+        tstart = time.monotonic()
+        while time.monotonic() - tstart < 10:
+            outlet.push_chunk(np.random.randn(25, 8).astype(np.float32))
+            time.sleep(0.05)
+            if monitor.metrics().get(key, None) and monitor.metrics()[key].n_samples:
+                break
+        assert monitor.metrics()[key].n_samples > 0
+
+        monitor.select([])
+        time.sleep(0.2)
+        assert monitor.metrics() == {}
+    finally:
+        monitor.stop()
+        discovery.stop()
+        del outlet
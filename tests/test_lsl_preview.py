@@ -0,0 +1,43 @@
+import numpy as np
+import pylsl
+
+from control_room.gui.callbacks import envelope_figure
+from control_room.utils.lsl_discovery import StreamEntry
+from control_room.utils.lsl_monitor import MonitoredStream
+from control_room.utils.lsl_preview import EnvelopeDecimator
+from tests.test_lsl_monitor import FakeInlet
+
+
+def test_incremental_envelope_matches_full_computation():
+    rng = np.random.default_rng(1)
+    data = rng.standard_normal((1000, 3)).astype(np.float32)
+    ts = np.arange(1000) / 100
+    dec = EnvelopeDecimator(n_channels=3, bin_size=7, n_bins=50)
+
+    # chunks of arbitrary sizes, bins span chunk borders
+    bounds = [0, 3, 4, 20, 21, 300, 301, 650, 1000]
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        dec.add(data[a:b], ts[a:b])
+
+    n_full = 1000 // 7
+    assert dec.n_added == n_full
+    bins = data[: n_full * 7].reshape(n_full, 7, 3)
+    t, env = dec.unfold()
+    assert env.shape == (50, 3, 2)
+    np.testing.assert_array_equal(env[:, :, 0], bins.min(axis=1)[-50:])
+    np.testing.assert_array_equal(env[:, :, 1], bins.max(axis=1)[-50:])
+    np.testing.assert_allclose(t, ts[6 : n_full * 7 : 7][-50:])
+
+
+def test_decimator_bins_are_bounded_by_the_window():
+    info = pylsl.StreamInfo("preview", "EEG", 64, 2000, "float32", "preview_src")
+    stream = MonitoredStream(
+        entry=StreamEntry.from_info(info), inlet=FakeInlet([]), buffer_s=1
+    )
+    dec = EnvelopeDecimator.for_stream(stream, window_s=10, n_points=200)
+    assert dec.bin_size == 100
+    assert dec.n_bins == 200
+
+    fig = envelope_figure(np.linspace(-10, 0, 200), np.zeros((200, 8, 2)))
+    assert len(fig["data"]) == 8
+    assert len(fig["data"][0]["y"]) == 400
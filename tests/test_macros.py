@@ -0,0 +1,256 @@
+import logging
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from control_room.gui.callbacks import compile_macros
+from control_room.utils.macros import (
+    MacroConfigError,
+    MacroExecutor,
+    MacroStep,
+    PayloadError,
+)
+
+
+class RecordingTarget:
+    def __init__(self, name: str, fail: bool = False, ack_delay_s: float | None = 0):
+        self.name = name
+        self.fail = fail
+        self.sent: list[tuple[float, bytes]] = []
+        # delay of the acknowledgement of `UP`, None for never
+        self.ack_delay_s = ack_delay_s
+        self._ack_at = float("inf")
+
+    def send_message(self, msg: bytes):
+        if self.fail:
+            raise ConnectionError("not reachable")
+        self.sent.append((time.monotonic(), msg))
+
+    def enqueue_message(self, msg: bytes) -> bool:
+        self.send_message(msg)
+        return True
+
+    def send_up(self) -> int:
+        self.send_message(b"UP")
+        if self.ack_delay_s is not None:
+            self._ack_at = time.monotonic() + self.ack_delay_s
+        return len(self.sent)
+
+    def wait_up_ack(self, seq: int, timeout_s: float) -> bool:
+        wait_s = self._ack_at - time.monotonic()
+        time.sleep(max(0.0, min(wait_s, timeout_s)))
+        return wait_s <= timeout_s
+
+
+def wait_for(cond, timeout_s: float = 2):
+    tend = time.monotonic() + timeout_s
+    while not cond() and time.monotonic() < tend:
+        time.sleep(0.005)
+    return cond()
+
+
+def test_submit_returns_before_the_steps_are_sent():
+    ex = MacroExecutor()
+    target = RecordingTarget("a")
+    steps = [MacroStep(target, b"A;", 0.2), MacroStep(target, b"B;", 0.4)]
+
+    t0 = time.monotonic()
+    run_id = ex.submit("m", steps)
+    assert time.monotonic() - t0 < 0.05
+    assert ex.get(run_id).state == "scheduled"
+
+    assert wait_for(lambda: ex.get(run_id).state == "done")
+    ex.stop()
+
+    assert [m for _, m in target.sent] == [b"A;", b"B;"]
+    # deadlines are relative to the start, so they do not drift
+    run = ex.get(run_id)
+    assert all(0 <= s.lateness_ms < 50 for s in run.steps)
+
+
+def test_runs_are_interleaved_by_deadline():
+    ex = MacroExecutor()
+    target = RecordingTarget("a")
+    ex.submit("slow", [MacroStep(target, b"S1", 0.1), MacroStep(target, b"S2", 0.3)])
+    ex.submit("fast", [MacroStep(target, b"F1", 0.2)])
+
+    assert wait_for(lambda: len(target.sent) == 3)
+    ex.stop()
+    assert [m for _, m in target.sent] == [b"S1", b"F1", b"S2"]
+
+
+def test_cancel_stops_the_remaining_steps():
+    ex = MacroExecutor()
+    target = RecordingTarget("a")
+    run_id = ex.submit(
+        "m", [MacroStep(target, b"A", 0.0), MacroStep(target, b"B", 0.3)]
+    )
+    assert wait_for(lambda: ex.get(run_id).n_sent == 1)
+
+    assert ex.cancel(run_id)
+    assert not ex.cancel(run_id)
+    time.sleep(0.4)
+    ex.stop()
+
+    assert [m for _, m in target.sent] == [b"A"]
+    assert ex.get(run_id).state == "cancelled"
+
+
+def test_failed_step_fails_the_run():
+    ex = MacroExecutor()
+    ok = RecordingTarget("ok")
+    run_id = ex.submit(
+        "m",
+        [
+            MacroStep(RecordingTarget("down", fail=True), b"A"),
+            MacroStep(ok, b"B", group=1),
+        ],
+    )
+    assert wait_for(lambda: not ex.get(run_id).is_active)
+    ex.stop()
+
+    run = ex.get(run_id)
+    assert run.state == "failed"
+    assert run.steps[0].error == "not reachable"
+    assert ok.sent == []
+
+
+def test_history_keeps_the_latest_finished_runs():
+    ex = MacroExecutor(history=2)
+    ids = [ex.submit(f"m{i}", []) for i in range(4)]
+    ex.stop()
+    assert [r.run_id for r in ex.runs()] == ids[:1:-1]
+
+
+def test_macro_steps_are_spaced_by_sleep_s():
+    mod = SimpleNamespace(name="mod_a")
+    macros = {
+        "globals": {"sleep_s": 0.5},
+        "m": {
+            "name": "M",
+            "default_json": {"x": 1},
+            "cmds": {"c1": ["mod_a", "START", "a=x"], "c2": ["mod_a", "STOP"]},
+        },
+    }
+    plan = compile_macros(macros, [mod])["M"]
+    steps = plan.steps(plan.kwargs('{"x": 1}'))
+
+    assert [s.message for s in steps] == [b'START|{"a": 1};', b"STOP;"]
+    assert [s.offset_s for s in steps] == [0.5, 1.0]
+
+
+def test_groups_wait_at_barriers_for_acks():
+    ex = MacroExecutor()
+    slow = RecordingTarget("slow", ack_delay_s=0.2)
+    fast = RecordingTarget("fast")
+    steps = [
+        MacroStep(slow, b"A", group=0, wait_ack=True),
+        MacroStep(fast, b"B", group=0, wait_ack=True),
+        MacroStep(fast, b"C", group=1, wait_ack=True),
+    ]
+    t0 = time.monotonic()
+    run_id = ex.submit("m", steps)
+    assert wait_for(lambda: ex.get(run_id).state == "waiting")
+    assert ex.get(run_id).n_sent == 2
+
+    assert wait_for(lambda: ex.get(run_id).state == "done")
+    ex.stop()
+
+    assert [m for _, m in slow.sent] == [b"A", b"UP"]
+    assert [m for _, m in fast.sent] == [b"B", b"UP", b"C", b"UP"]
+    # the group is sent together, the next one only after the slow ack
+    assert abs(slow.sent[0][0] - fast.sent[0][0]) < 0.01
+    assert fast.sent[2][0] - t0 >= 0.2
+    assert ex.get(run_id).hold_s >= 0.2
+
+
+def test_missing_ack_fails_the_run():
+    ex = MacroExecutor()
+    mute = RecordingTarget("mute", ack_delay_s=None)
+    other = RecordingTarget("other")
+    steps = [
+        MacroStep(mute, b"A", group=0, wait_ack=True),
+        MacroStep(other, b"B", group=1),
+    ]
+    run_id = ex.submit("m", steps, ack_timeout_s=0.1)
+    assert wait_for(lambda: not ex.get(run_id).is_active)
+    ex.stop()
+
+    run = ex.get(run_id)
+    assert run.state == "failed"
+    assert run.steps[0].error == "no acknowledgement"
+    assert other.sent == []
+
+
+def test_list_of_commands_forms_a_group():
+    mods = [SimpleNamespace(name=n) for n in ("mod_a", "mod_b")]
+    macros = {
+        "m": {
+            "name": "M",
+            "wait_ack": True,
+            "cmds": {
+                "start": [["mod_a", "START"], ["mod_b", "START"]],
+                "stop": ["mod_a", "STOP"],
+            },
+        }
+    }
+    steps = compile_macros(macros, mods)["M"].steps({})
+
+    assert [(s.group, s.target.name) for s in steps] == [
+        (0, "mod_a"),
+        (0, "mod_b"),
+        (1, "mod_a"),
+    ]
+    assert all(s.wait_ack for s in steps)
+
+
+def test_plan_binds_defaults_and_edited_input():
+    mod = SimpleNamespace(name="mod_a")
+    macros = {
+        "m": {
+            "name": "M",
+            "default_json": {"name": "eeg", "path": "../$<name>"},
+            "cmds": {"c1": ["mod_a", "SET", "p=path"]},
+        }
+    }
+    plan = compile_macros(macros, [mod])["M"]
+
+    assert plan.kwargs(plan.default_input) == {"name": "eeg", "path": "../eeg"}
+    edited = plan.kwargs('{"name": "emg", "path": "$<name>/x"}')
+    assert plan.steps(edited)[0].message == b'SET|{"p": "emg/x"};'
+
+
+def test_kwargs_can_be_provided_in_the_input_only(caplog):
+    macros = {
+        "m": {
+            "name": "M",
+            "default_json": {"x": 1},
+            "cmds": {"c1": ["mod_a", "START", "a=y", "b=x"]},
+        }
+    }
+    with caplog.at_level(logging.WARNING, logger="control_room"):
+        plan = compile_macros(macros, [SimpleNamespace(name="mod_a")])["M"]
+    # mappings whose kwarg is not in the default_json are reported at startup
+    assert [m for m in caplog.messages if "mod_a START a=y" in m]
+    assert not [m for m in caplog.messages if "b=x" in m]
+
+    assert plan.steps(plan.kwargs('{"x": 1, "y": 2}'))[0].message == (
+        b'START|{"a": 2, "b": 1};'
+    )
+    with pytest.raises(PayloadError):
+        plan.steps(plan.kwargs(plan.default_input))
+
+
+@pytest.mark.parametrize(
+    "cmds",
+    [
+        {"c1": ["mod_b", "START"]},  # unknown module
+        {"c1": ["mod_a", "START;"]},  # reserved character
+        {"c1": [["mod_a", "START"], ["mod_c", "START"]]},
+    ],
+)
+def test_invalid_macros_are_rejected_when_compiled(cmds):
+    macros = {"m": {"name": "M", "default_json": {"x": 1}, "cmds": cmds}}
+    with pytest.raises(MacroConfigError):
+        compile_macros(macros, [SimpleNamespace(name="mod_a")])
@@ -56,7 +56,7 @@ def test_is_up_without_communicator(connection):
         (b"11", b""),  # several acknowledgements batched together
         (b"dp-mod|START|{}", b"dp-mod|START|{}"),  # plain callback
         (b"1dp-mod|START|{}", b"dp-mod|START|{}"),  # ack prepended to a callback
-        (b"dp-mod|START|{}1", b"dp-mod|START|{}"),  # ack appended to a callback
+        (b"dp-mod|STIM|1", b"dp-mod|STIM|1"),  # payload ending in 1
         (b"dp-mod|START|{'a': 1}", b"dp-mod|START|{'a': 1}"),  # 1 inside the payload
         (b"mod1|START|{}", b"mod1|START|{}"),  # module name ending in 1
     ],
@@ -0,0 +1,69 @@
+import threading
+import time
+
+from control_room.utils.outbound import OutboundQueue
+
+
+def test_queued_frames_are_coalesced():
+    release = threading.Event()
+    writes = []
+
+    def write(data: bytes):
+        writes.append(data)
+        release.wait(timeout=2)
+
+    oq = OutboundQueue(name="mod", write=write)
+    oq.put(b"A;")
+    time.sleep(0.1)  # the writer is now blocked with the first frame
+
+    oq.put(b"B;")
+    oq.put(b"C;")
+    assert oq.depth == 2
+
+    release.set()
+    assert oq.flush(timeout_s=2)
+    oq.stop()
+
+    assert writes == [b"A;", b"B;C;"]
+    assert oq.sent == 3
+    assert oq.dropped == 0
+
+
+def test_full_queue_drops_without_blocking():
+    release = threading.Event()
+    oq = OutboundQueue(name="mod", write=lambda data: release.wait(2), maxsize=2)
+
+    oq.put(b"A;")
+    time.sleep(0.1)
+    results = [oq.put(f"{i};".encode()) for i in range(4)]
+
+    assert results == [True, True, False, False]
+    assert oq.dropped == 2
+
+    release.set()
+    oq.stop()
+
+
+def test_failed_write_is_counted_as_dropped():
+    def write(data: bytes):
+        raise ConnectionResetError("peer is gone")
+
+    oq = OutboundQueue(name="mod", write=write)
+    oq.put(b"A;")
+
+    assert oq.flush(timeout_s=2)
+    assert oq.dropped == 1
+    oq.stop()
+
+
+def test_puts_after_stop_are_rejected():
+    writes = []
+    oq = OutboundQueue(name="mod", write=writes.append)
+    oq.put(b"A;")
+    assert oq.flush(timeout_s=2)
+    oq.stop()
+
+    assert not oq.put(b"B;")
+    time.sleep(0.1)
+    assert writes == [b"A;"]
+    assert oq.dropped == 1
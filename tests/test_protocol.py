@@ -0,0 +1,136 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from control_room.gui.callbacks import protocol_steps
+from control_room.utils.macros import MacroConfigError, MacroExecutor, MacroStep
+from control_room.utils.protocol import ProtocolError, load_protocol
+
+
+def test_toml_protocol_blocks_are_repeated(tmp_path):
+    file = tmp_path / "blocks.toml"
+    file.write_text(
+        """
+name = "blocks"
+repeat = 3
+period_s = 60
+
+[[events]]
+t = 30
+module = "stim"
+pcomm = "OFF"
+
+[[events]]
+t = 0
+module = "stim"
+pcomm = "ON"
+payload = { amp = 1.5 }
+"""
+    )
+    protocol = load_protocol(file)
+
+    assert protocol.name == "blocks"
+    assert [(ev.t_offset_s, ev.pcomm) for ev in protocol.events] == [
+        (0, "ON"),
+        (30, "OFF"),
+        (60, "ON"),
+        (90, "OFF"),
+        (120, "ON"),
+        (150, "OFF"),
+    ]
+    assert protocol.events[0].payload == {"amp": 1.5}
+
+
+def test_csv_protocol(tmp_path):
+    file = tmp_path / "timeline.csv"
+    file.write_text(
+        "t_offset,module,pcomm,payload\n"
+        "0.5,rec,START,\n"
+        '0.5,stim,ON,"{""amp"": 2}"\n'
+        "1.0,stim,OFF,\n"
+    )
+    protocol = load_protocol(file, name="timeline")
+
+    assert len(protocol.events) == 3
+    assert protocol.events[1].payload == {"amp": 2}
+    assert protocol.duration_s == 1.0
+
+
+def test_invalid_json_payload_is_a_protocol_error(tmp_path):
+    file = tmp_path / "timeline.csv"
+    file.write_text(
+        't_offset,module,pcomm,payload\n0.5,rec,START,\n1.0,stim,ON,"{""amp"": }"\n'
+    )
+    with pytest.raises(ProtocolError, match=r"'ON' at 1.0s in .*timeline.csv, line 3"):
+        load_protocol(file)
+
+
+def test_repeat_needs_a_period_longer_than_the_block(tmp_path):
+    file = tmp_path / "bad.toml"
+    file.write_text('repeat = 2\n[[events]]\nt = 5\nmodule = "a"\npcomm = "X"\n')
+    with pytest.raises(ProtocolError):
+        load_protocol(file)
+
+
+def test_events_at_the_same_offset_form_a_group(tmp_path):
+    file = tmp_path / "timeline.csv"
+    file.write_text("t_offset,module,pcomm\n0,a,START\n0,b,START\n1,a,STOP\n")
+    protocol = load_protocol(file)
+    mods = [SimpleNamespace(name="a"), SimpleNamespace(name="b")]
+
+    steps = protocol_steps(protocol, mods)
+    assert [(s.group, s.message) for s in steps] == [
+        (0, b"START;"),
+        (0, b"START;"),
+        (1, b"STOP;"),
+    ]
+    with pytest.raises(MacroConfigError):
+        protocol_steps(protocol, mods[:1])
+
+
+class Target:
+    name = "a"
+
+    def __init__(self):
+        self.sent = []
+
+    def enqueue_message(self, msg: bytes) -> bool:
+        self.sent.append(msg)
+        return True
+
+
+def test_steps_are_sent_close_to_their_deadlines():
+    ex = MacroExecutor(spin_s=0.002)
+    steps = [MacroStep(Target(), b"X", offset_s=0.01 * i, group=i) for i in range(20)]
+    run_id = ex.submit("p", steps)
+    time.sleep(0.3)
+    ex.stop()
+
+    lateness = [s.lateness_ms for s in ex.get(run_id).steps]
+    assert ex.get(run_id).state == "done"
+    assert sorted(lateness)[len(lateness) // 2] < 1.0
+
+
+def test_pause_postpones_the_remaining_steps():
+    ex = MacroExecutor()
+    target = Target()
+    steps = [MacroStep(target, b"A", 0.0), MacroStep(target, b"B", 0.2, group=1)]
+    run_id = ex.submit("p", steps)
+    time.sleep(0.05)
+
+    assert ex.pause(run_id)
+    time.sleep(0.3)
+    assert target.sent == [b"A"]
+
+    assert ex.resume(run_id)
+    assert not ex.resume(run_id)
+    time.sleep(0.25)
+    ex.stop()
+
+    run = ex.get(run_id)
+    assert target.sent == [b"A", b"B"]
+    assert run.state == "done"
+    # B kept its spacing, i.e. was sent after the pause plus its offset
+    assert run.steps[1].sent_s == pytest.approx(0.5, abs=0.05)
+    assert run.steps[1].lateness_ms < 20
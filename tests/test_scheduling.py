@@ -0,0 +1,84 @@
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+import psutil
+import pytest
+
+from control_room.utils.scheduling import (
+    SchedulingProfile,
+    apply_to_process_tree,
+    apply_to_threads,
+    get_control_room_profiles,
+)
+
+linux_only = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="per thread scheduling is linux only"
+)
+
+
+@pytest.fixture()
+def process():
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+def test_profile_from_cfg():
+    profile = SchedulingProfile.from_cfg(
+        {"cpu_affinity": [0], "nice": 5, "sched_policy": "FIFO", "rt_priority": 10}
+    )
+    assert profile == SchedulingProfile([0], 5, "fifo", 10)
+    assert SchedulingProfile.from_cfg({}).is_default
+
+    with pytest.raises(ValueError):
+        SchedulingProfile(sched_policy="fast")
+    with pytest.raises(ValueError):
+        SchedulingProfile(sched_policy="other", rt_priority=10)
+
+
+def test_control_room_profiles():
+    profiles = get_control_room_profiles({"control_room": {"broker": {"nice": 3}}})
+    assert profiles["broker"].nice == 3
+    assert profiles["gui"].is_default
+
+
+@linux_only
+def test_apply_to_process_tree(process):
+    effective = apply_to_process_tree(
+        SchedulingProfile(cpu_affinity=[0], nice=5), process.pid, "sleeper"
+    )
+
+    assert effective == {"cpu_affinity": [0], "nice": 5}
+    assert psutil.Process(process.pid).nice() == 5
+
+
+@linux_only
+def test_missing_permission_is_logged(process, monkeypatch, caplog):
+    def deny(*args):
+        raise PermissionError("Operation not permitted")
+
+    monkeypatch.setattr(os, "sched_setscheduler", deny)
+    with caplog.at_level(logging.WARNING, logger="control_room"):
+        effective = apply_to_process_tree(
+            SchedulingProfile(nice=5, sched_policy="fifo"), process.pid, "sleeper"
+        )
+
+    assert effective == {"nice": 5}
+    assert any("sched_policy=fifo" in msg for msg in caplog.messages)
+
+
+@linux_only
+def test_apply_to_threads_only_changes_the_thread():
+    done = threading.Event()
+    th = threading.Thread(target=done.wait, daemon=True)
+    th.start()
+
+    effective = apply_to_threads(SchedulingProfile(nice=7), [th], "worker")
+    done.set()
+
+    assert effective == {"nice": 7}
+    assert os.getpriority(os.PRIO_PROCESS, 0) != 7
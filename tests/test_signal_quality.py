@@ -0,0 +1,65 @@
+import numpy as np
+import pylsl
+
+from control_room.utils.lsl_discovery import StreamEntry
+from control_room.utils.lsl_monitor import MonitoredStream
+from control_room.utils.signal_quality import (
+    QUALITY_METRICS,
+    SignalQualityChecker,
+    channel_quality,
+    quality_scores,
+)
+from tests.test_lsl_monitor import FakeInlet
+
+
+def idx(metric: str) -> int:
+    return QUALITY_METRICS.index(metric)
+
+
+def test_channel_quality_flags_bad_channels():
+    srate, n = 500, 1000
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((n, 5))
+    x[:, 1] = 0  # flat
+    x[:, 2] = np.clip(x[:, 2], -0.5, 0.5)  # clipped
+    x[10:20, 3] = np.nan
+    x[:, 4] += 5 * np.sin(2 * np.pi * 50 * np.arange(n) / srate)
+
+    q = channel_quality(x, srate, line_freq=50)
+    assert q.shape == (len(QUALITY_METRICS), 5)
+
+    assert q[idx("variance"), 1] == 0
+    assert q[idx("flatline"), 1] == 1
+    assert q[idx("clipping"), 2] > 0.2
+    assert q[idx("clipping"), 0] < 0.01
+    np.testing.assert_array_equal(q[idx("nan_count")], [0, 0, 0, 10, 0])
+    assert q[idx("line_noise"), 4] > 0.8
+    assert q[idx("line_noise"), 0] < 0.05
+
+    scores = quality_scores(q, n)
+    assert scores.min() >= 0 and scores.max() <= 1
+    assert scores[idx("variance"), 1] == 1
+    assert scores[:, 0].max() < 0.2
+
+
+def test_checker_reports_monitored_streams():
+    info = pylsl.StreamInfo("quality", "EEG", 3, 100, "float32", "quality_src")
+    data = np.random.randn(300, 3).astype(np.float32)
+    inlet = FakeInlet([(data, np.arange(300) / 100)])
+    stream = MonitoredStream(entry=StreamEntry.from_info(info), inlet=inlet, buffer_s=5)
+    stream.pull()
+
+    class Monitor:
+        streams = {"quality": stream}
+
+    checker = SignalQualityChecker(Monitor(), window_s=2)  # type: ignore
+    checker.check()
+    report = checker.reports["quality"]
+    assert report.n_samples == 200
+    np.testing.assert_allclose(
+        report.values[idx("variance")], data[-200:].var(axis=0), rtol=1e-4
+    )
+
+    Monitor.streams = {}
+    checker.check()
+    assert checker.reports == {}
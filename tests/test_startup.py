@@ -0,0 +1,121 @@
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pytest
+
+from control_room.utils.config import check_and_transform_legacy_cfg, toml_load
+from control_room.utils.modules import NoopLauncher, initialize_modules
+from control_room.utils.startup import start_modules, stop_modules, wait_with_backoff
+
+CFG_PATH = Path("./tests/resources/test_cfg.toml")
+
+
+@pytest.fixture()
+def connections():
+    cfg = check_and_transform_legacy_cfg(toml_load(CFG_PATH))
+    conns = initialize_modules(cfg, CFG_PATH.resolve())
+    yield conns
+    for conn in conns:
+        try:
+            conn.stop()
+        except Exception:
+            pass
+
+
+def test_start_modules_reports_phases(connections):
+    reports = start_modules(connections, timeout_s=20)
+
+    assert len(reports) == len(connections)
+    report = reports[0]
+    assert report.ready, report.error
+    assert list(report.phases) == ["launch", "connect", "up", "pcomms"]
+    assert "GET_PCOMMS" in connections[0].pcomms
+
+
+def test_wait_with_backoff_gives_up_at_deadline():
+    calls = []
+
+    def probe() -> bool:
+        calls.append(time.monotonic())
+        return False
+
+    tstart = time.monotonic()
+    assert wait_with_backoff(probe, deadline=tstart + 0.3, initial_s=0.01) is False
+    assert time.monotonic() - tstart < 0.5
+
+    # pauses between probes are growing
+    pauses = [b - a for a, b in zip(calls, calls[1:])]
+    assert pauses[-1] > pauses[0]
+
+
+@dataclass
+class FakeConnection:
+    name: str
+    depends_on: list[str] = field(default_factory=list)
+    events: list = field(default_factory=list)
+    fail: bool = False
+
+    launcher = NoopLauncher()
+    communicator = None
+    pcomms = ["UP"]
+
+    def launch_module(self):
+        self.events.append(("launch", self.name))
+        time.sleep(0.05)
+
+    def connect_to_module(self):
+        if self.fail:
+            raise ConnectionError("cannot connect")
+
+    def is_up(self, timeout_s: float = 0.1) -> bool:
+        return True
+
+    def get_pcommands(self, timeout_s: float = 1.0):
+        self.events.append(("ready", self.name))
+
+    def stop(self):
+        self.events.append(("stop", self.name))
+
+
+def test_start_modules_waits_for_dependencies():
+    events = []
+    conns = [
+        FakeConnection("decoder", depends_on=["lsl"], events=events),
+        FakeConnection("lsl", events=events),
+        FakeConnection("other", events=events),
+    ]
+
+    reports = start_modules(conns, timeout_s=2)  # type: ignore
+
+    assert all(r.ready for r in reports)
+    assert events.index(("ready", "lsl")) < events.index(("launch", "decoder"))
+    # independent modules are launched concurrently
+    assert set(events[:2]) == {("launch", "lsl"), ("launch", "other")}
+
+
+def test_module_is_not_started_if_dependency_fails():
+    events = []
+    conns = [
+        FakeConnection("lsl", events=events, fail=True),
+        FakeConnection("decoder", depends_on=["lsl"], events=events),
+    ]
+
+    reports = start_modules(conns, timeout_s=0.2)  # type: ignore
+
+    assert not reports[0].ready and not reports[1].ready
+    assert "lsl" in reports[1].error
+    assert ("launch", "decoder") not in events
+
+
+def test_stop_modules_in_reverse_dependency_order():
+    events = []
+    conns = [
+        FakeConnection("lsl", events=events),
+        FakeConnection("decoder", depends_on=["lsl"], events=events),
+        FakeConnection("ctrl", depends_on=["decoder"], events=events),
+    ]
+
+    stop_modules(conns)  # type: ignore
+
+    assert events == [("stop", "ctrl"), ("stop", "decoder"), ("stop", "lsl")]
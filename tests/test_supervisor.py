@@ -0,0 +1,71 @@
+import time
+from pathlib import Path
+
+import psutil
+import pytest
+
+from control_room.callbacks import start_callback_broker
+from control_room.utils.config import check_and_transform_legacy_cfg, toml_load
+from control_room.utils.modules import initialize_modules
+from control_room.utils.startup import start_modules
+from control_room.utils.supervisor import ProcessSupervisor, RestartPolicy
+
+CFG_PATH = Path("./tests/resources/test_cfg.toml")
+
+
+def test_restart_policy_modes():
+    assert not RestartPolicy(mode="never").should_restart(1, 0)
+    assert not RestartPolicy(mode="on-failure").should_restart(0, 0)
+    assert RestartPolicy(mode="on-failure").should_restart(-9, 0)
+    assert RestartPolicy(mode="always").should_restart(0, 0)
+    assert not RestartPolicy(mode="always", max_restarts=2).should_restart(0, 2)
+
+    with pytest.raises(ValueError):
+        RestartPolicy(mode="sometimes")
+
+
+def test_restart_backoff_is_exponential_and_capped():
+    policy = RestartPolicy(backoff_s=0.5, max_backoff_s=3)
+    assert [policy.delay_s(i) for i in range(5)] == [0.5, 1, 2, 3, 3]
+
+
+@pytest.fixture()
+def supervised():
+    cfg = check_and_transform_legacy_cfg(toml_load(CFG_PATH))
+    cfg["modules"]["dp-mockupmodule"] |= {
+        "restart": "on-failure",
+        "restart_backoff_s": 0.1,
+    }
+    conns = initialize_modules(cfg, CFG_PATH.resolve())
+    start_modules(conns)
+    cbb, cbb_th = start_callback_broker(conns)
+    supervisor = ProcessSupervisor(conns, broker=cbb)
+    supervisor.start()
+
+    yield conns[0], supervisor
+
+    supervisor.stop()
+    cbb.stop()
+    cbb_th.join(timeout=3)
+    for conn in conns:
+        conn.stop()
+
+
+def test_supervisor_restarts_crashed_module(supervised):
+    conn, supervisor = supervised
+    old_pid = conn.launcher.process.pid
+    conn.pcomms = []
+
+    psutil.Process(old_pid).kill()
+
+    tstart = time.monotonic()
+    while time.monotonic() - tstart < 15:
+        if supervisor.restarts and not conn.health.restarting:
+            break
+        time.sleep(0.1)
+
+    assert supervisor.restarts == {"dp-mockupmodule": 1}
+    assert conn.launcher.process.pid != old_pid
+    assert "START" in conn.pcomms, "pcomms are discovered again"
+    assert conn.health.restarts == 1
+    assert conn.is_up() is True
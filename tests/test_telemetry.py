@@ -0,0 +1,71 @@
+import subprocess
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+import pytest
+
+from control_room.gui.app import build_app
+from control_room.utils.modules import ControlRoomModuleConnection, NoopLauncher
+from control_room.utils.telemetry import METRICS, TelemetryHistory, TelemetrySampler
+
+
+@dataclass
+class ProcessLauncher:
+    process: subprocess.Popen
+
+
+@pytest.fixture()
+def module_process():
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+def test_history_keeps_latest_samples_in_order():
+    hist = TelemetryHistory(capacity=4)
+    for i in range(6):
+        hist.add(float(i), np.full(len(METRICS), i))
+
+    t, values = hist.unfold()
+    assert t.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert values[:, 0].tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert hist.to_dict(last_n=2)["t"] == [4.0, 5.0]
+
+
+def test_sampler_records_module_process(module_process):
+    conns = [
+        ControlRoomModuleConnection(
+            name="mod",
+            launcher=ProcessLauncher(module_process),  # type: ignore
+        ),
+        ControlRoomModuleConnection(name="no_process", launcher=NoopLauncher()),
+    ]
+    sampler = TelemetrySampler(conns, capacity=10)
+    sampler.sample()
+    sampler.sample()
+
+    snapshot = sampler.snapshot()
+    assert list(snapshot) == ["mod"]
+    assert len(snapshot["mod"]["t"]) == 2
+    assert snapshot["mod"]["rss_mb"][-1] > 0
+    assert snapshot["mod"]["num_threads"][-1] >= 1
+
+
+def test_telemetry_api(module_process):
+    conns = [
+        ControlRoomModuleConnection(
+            name="mod",
+            launcher=ProcessLauncher(module_process),  # type: ignore
+        )
+    ]
+    sampler = TelemetrySampler(conns)
+    sampler.sample()
+    client = build_app(conns, macros=None, telemetry=sampler).server.test_client()
+
+    reply = client.get("/api/telemetry?module=mod&n=1")
+    assert reply.status_code == 200
+    assert set(reply.get_json()["mod"]) == {"t", *METRICS}
+
+    assert client.get("/api/telemetry?module=unknown").status_code == 404